@@ -0,0 +1,320 @@
+import pandas as pd
+import numpy as np
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import warnings
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.linear_model import LogisticRegression, LinearRegression
+from sklearn.exceptions import ConvergenceWarning
+import catboost as cb
+import xgboost as xgb
+from helper import split_id_cols, clean_frame
+from pipeline import CLEANING_STAGES
+from preprocessing import NFLPreprocessor
+from synthetic import make_raw_frame
+
+# input sizes in rows (22 rows per play)
+BENCH_SIZES = (10000, 100000, 500000, 5000000)
+# model fits are slow, so they only run up to this many rows by default
+MODEL_MAX_ROWS = 100000
+BASELINE_PATH = 'Data/benchmark_baseline.json'
+
+# model families of modeling.py and the notebooks, with small settings
+# so the timings measure the code path rather than the search
+MODELS = {'random_forest_classifier':
+          lambda: RandomForestClassifier(n_estimators=50, max_depth=12,
+                                         random_state=220),
+          'logistic_regression':
+          lambda: LogisticRegression(solver='saga', max_iter=50),
+          'catboost_classifier':
+          lambda: cb.CatBoostClassifier(iterations=50, depth=6,
+                                        loss_function='MultiClass',
+                                        random_state=220, verbose=False),
+          'linear_regression': lambda: LinearRegression(),
+          'random_forest_regressor':
+          lambda: RandomForestRegressor(n_estimators=50, max_depth=12,
+                                        random_state=220),
+          'xgboost_regressor':
+          lambda: xgb.XGBRegressor(n_estimators=50, max_depth=6,
+                                   random_state=220)}
+
+
+def _status_bytes(field):
+    '''
+    This function reads a memory field of /proc/self/status
+    (e.g. VmRSS, VmHWM) in bytes.
+    '''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def peak_rss(func, *args):
+    '''
+    This function measures how much the resident memory of the process
+    grows at the peak of one call. Unlike tracemalloc, it sees the native
+    allocations of CatBoost, XGBoost and sklearn's tree code.
+    The peak is reset before the call by writing 5 to
+    /proc/self/clear_refs (Linux), then read as VmHWM.
+
+    Parameters
+    ----------
+    func: function
+    args: arguments of func
+
+    Returns
+    -------
+    bytes, or nan where the peak cannot be reset (not Linux)
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        func(*args)
+        return np.nan
+    start = _status_bytes('VmRSS')
+    func(*args)
+    return _status_bytes('VmHWM') - start
+
+
+def measure(func, setup=None, repeat=3):
+    '''
+    This function times a function and measures its peak memory.
+    setup builds fresh arguments before every call and is not timed.
+
+    Parameters
+    ----------
+    func: function
+    setup: function (default=None), returns a tuple of arguments for func
+    repeat: int (default=3), number of timed calls
+
+    Returns
+    -------
+    dict with the best wall time (s) and the peak memory (MB)
+    one call adds to the resident memory (see peak_rss)
+    '''
+    setup = setup or tuple
+
+    args = setup()
+    gc.collect()
+    peak = peak_rss(func, *args)
+
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    return {'time': min(times), 'peak_mb': peak / 2**20}
+
+
+def _copy(*frames):
+    return lambda: tuple(f.copy() for f in frames)
+
+
+def bench_cleaning(raw, repeat=3):
+    '''
+    This function times every cleaning step of helper.py on the output
+    of the step before it, then the full clean_frame.
+
+    Parameters
+    ----------
+    raw: DataFrame, raw data (train.csv schema)
+    repeat: int (default=3)
+
+    Returns
+    -------
+    dict, case name -> measurements
+    '''
+    results = {'split_id_cols': measure(split_id_cols, _copy(raw), repeat)}
+    df, df_id = split_id_cols(raw.copy())
+    for stage in CLEANING_STAGES:
+        results[stage.name] = measure(stage.func, _copy(df, df_id), repeat)
+        df, df_id = stage.func(df.copy(), df_id.copy(), **stage.params)
+
+    results['clean_frame'] = measure(clean_frame, _copy(raw), repeat)
+    results['get_dummies'] = measure(
+        lambda d: pd.get_dummies(d, drop_first=True), _copy(df), repeat)
+
+    return results
+
+
+def bench_models(raw, models=MODELS, repeat=1):
+    '''
+    This function times fit and predict for each model family
+    on label-encoded features of the raw data.
+
+    Parameters
+    ----------
+    raw: DataFrame, raw data (train.csv schema)
+    models: dict (default=MODELS), name -> function making the model
+    repeat: int (default=1)
+
+    Returns
+    -------
+    dict, case name -> measurements
+    '''
+    prep = NFLPreprocessor().fit(raw)
+    X = prep.transform(raw)
+    y_yards = raw['Yards'].values
+    y_class = clean_frame(raw.copy())[0]['Yard_class'].values
+
+    results = {}
+    for name, make_model in models.items():
+        y = y_yards if name.endswith('regressor') or name.startswith(
+            'linear') else y_class
+        with warnings.catch_warnings():
+            # the iteration caps are deliberately low
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            results[f'{name}.fit'] = measure(lambda: make_model().fit(X, y),
+                                             repeat=repeat)
+            model = make_model().fit(X, y)
+        results[f'{name}.predict'] = measure(lambda: model.predict(X),
+                                             repeat=repeat)
+
+    return results
+
+
+def run_benchmarks(sizes=BENCH_SIZES, model_max_rows=MODEL_MAX_ROWS,
+                   repeat=3, seed=220, verbose=True):
+    '''
+    This function runs the benchmark suite at several input sizes
+    on synthetic data, so it needs no download.
+
+    Parameters
+    ----------
+    sizes: tuple (default=BENCH_SIZES), input sizes in rows
+    model_max_rows: int (default=MODEL_MAX_ROWS), largest size the
+                    models are fitted on (0 to skip the models)
+    repeat: int (default=3), timed calls per case (models: 1)
+    seed: int (default=220), seed of the synthetic data
+    verbose: boolean (default=True), print each result
+
+    Returns
+    -------
+    DataFrame with one row per case and size
+    '''
+    rows = []
+    for size in sizes:
+        raw = make_raw_frame(max(1, size // 22), seed=seed)
+        results = bench_cleaning(raw, repeat)
+        if size <= model_max_rows:
+            results.update(bench_models(raw))
+
+        for case, result in results.items():
+            rows.append({'case': case, 'rows': len(raw), **result})
+            if verbose:
+                print(f"{case:>36} {len(raw):>9} rows "
+                      f"{result['time']:9.4f}s {result['peak_mb']:9.1f}MB")
+
+    return pd.DataFrame(rows)
+
+
+def _key(row):
+    return f"{row['case']}@{row['rows']}"
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    '''
+    This function stores benchmark results as the baseline.
+
+    Parameters
+    ----------
+    results: DataFrame, output of run_benchmarks
+    path: str (default=BASELINE_PATH)
+
+    Returns
+    -------
+    None
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    baseline = {_key(row): {'time': row['time'], 'peak_mb': row['peak_mb']}
+                for _, row in results.iterrows()}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def compare_to_baseline(results, path=BASELINE_PATH, threshold=0.2,
+                        min_seconds=0.01):
+    '''
+    This function compares benchmark results with the stored baseline.
+    A case regresses when its time or peak memory grew by more than
+    threshold (relative to the baseline). Slowdowns smaller than
+    min_seconds are ignored, they are mostly timer noise.
+    Cases missing from the baseline are not compared.
+
+    Parameters
+    ----------
+    results: DataFrame, output of run_benchmarks
+    path: str (default=BASELINE_PATH)
+    threshold: float (default=0.2)
+    min_seconds: float (default=0.01)
+
+    Returns
+    -------
+    DataFrame with the baseline, the ratios and a regressed column
+    '''
+    with open(path) as f:
+        baseline = json.load(f)
+
+    results = results.copy()
+    keys = results.apply(_key, axis=1)
+    for col in ['time', 'peak_mb']:
+        base = keys.map(lambda k: baseline.get(k, {}).get(col, np.nan))
+        results[f'base_{col}'] = base
+        results[f'{col}_ratio'] = results[col] / base
+    slower = ((results['time_ratio'] > 1 + threshold)
+              & (results['time'] - results['base_time'] > min_seconds))
+    results['regressed'] = slower | (results['peak_mb_ratio'] > 1 + threshold)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the cleaning helpers and the models '
+                    'on synthetic data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=BENCH_SIZES,
+                        help='input sizes in rows')
+    parser.add_argument('--model-max-rows', type=int, default=MODEL_MAX_ROWS,
+                        help='largest size the models run on (0 to skip)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative slowdown or memory growth')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.model_max_rows, args.repeat)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --save-baseline')
+        return 0
+
+    compared = compare_to_baseline(results, args.baseline, args.threshold)
+    regressed = compared[compared['regressed']]
+    if len(regressed):
+        print(f'{len(regressed)} regressions '
+              f'(threshold {args.threshold:.0%}):')
+        print(regressed[['case', 'rows', 'time', 'base_time',
+                         'peak_mb', 'base_peak_mb']].round(4)
+              .to_string(index=False))
+        return 1
+    print('No regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import pandas as pd
+import numpy as np
+
+# number of players on the field in every play
+N_PLAYERS = 22
+
+# columns that describe one player in a play
+PLAYER_COLS = ['long_axis', 'short_axis', 'speed', 'accel', 'Dis',
+               'Orientation', 'Dir', 'PlayerHeight', 'PlayerWeight']
+
+# columns that are the same for all 22 players of a play
+PLAY_COLS = ['YardLine', 'Quarter', 'GameClock', 'Down', 'Distance',
+             'HomeScoreBeforePlay', 'VisitorScoreBeforePlay',
+             'DefendersInTheBox', 'Week', 'Temperature', 'Humidity',
+             'WindSpeed', 'Yards']
+
+
+def _numeric_values(df, cols):
+    '''
+    This function stacks columns into a float32 array.
+    Non-numeric columns are stored as their category codes.
+    '''
+    values = np.empty((len(df), len(cols)), dtype=np.float32)
+    for j, col in enumerate(cols):
+        if pd.api.types.is_numeric_dtype(df[col].dtype):
+            values[:, j] = df[col].values
+        else:
+            values[:, j] = pd.Categorical(df[col]).codes
+    return values
+
+
+def player_order(df_id):
+    '''
+    This function sorts the rows of every play:
+    rusher first, then the rest of the offense, then the defense.
+    Plays stay in the order they first appear.
+
+    Parameters
+    ----------
+    df_id: DataFrame for ID purposes (GameId, PlayId, Team, NflId,
+           NflIdRusher)
+
+    Returns
+    -------
+    play number of each row, array of row positions in sorted order
+    '''
+    play_codes = pd.factorize(df_id['PlayId'])[0]
+    is_rusher = (df_id['NflId'].values == df_id['NflIdRusher'].values)
+
+    # the offense is the team of the rusher
+    rusher_team = pd.Series(df_id['Team'].values[is_rusher],
+                            index=play_codes[is_rusher])
+    rusher_team = rusher_team[~rusher_team.index.duplicated()]
+    is_offense = (df_id['Team'].values
+                  == rusher_team.reindex(play_codes).values)
+
+    order = np.lexsort((np.arange(len(df_id)), ~is_offense,
+                        ~is_rusher, play_codes))
+    return play_codes, order
+
+
+def plays_without_rusher(df_id):
+    '''
+    This function finds the plays where no row is the rusher
+    (NflIdRusher is not the NflId of any of the play's players).
+
+    Parameters
+    ----------
+    df_id: DataFrame for ID purposes (PlayId, NflId, NflIdRusher)
+
+    Returns
+    -------
+    array of PlayIds
+    '''
+    is_rusher = df_id['NflId'].values == df_id['NflIdRusher'].values
+    plays = pd.unique(df_id['PlayId'].values)
+    return plays[~np.isin(plays, df_id['PlayId'].values[is_rusher])]
+
+
+def build_play_tensors(df, df_id, player_cols=PLAYER_COLS,
+                       play_cols=PLAY_COLS, drop_no_rusher=True):
+    '''
+    This function turns the cleaned data (22 rows per play)
+    into one dense array of player features and one array of
+    play features, with one entry per play.
+    The layout starts from the rusher, so plays without a rusher row
+    (see plays_without_rusher) are left out, or raise an error.
+
+    Parameters
+    ----------
+    df: DataFrame used for training (cleaned)
+    df_id: DataFrame for ID purposes, aligned row by row with df
+    player_cols: list (default=PLAYER_COLS), player feature columns
+    play_cols: list (default=PLAY_COLS), play feature columns
+    drop_no_rusher: boolean (default=True), False to raise a ValueError
+                    when some plays have no rusher row
+
+    Returns
+    -------
+    players: array (n_plays, 22, n_player_features), rusher first,
+             then offense, then defense; missing players are NaN
+    plays: array (n_plays, n_play_features)
+    index: DataFrame with the GameId and PlayId of every play
+    rows: array (n_plays, 22), position in df of each player (-1 if none)
+    '''
+    positions = np.arange(len(df_id))
+    missing = plays_without_rusher(df_id)
+    if len(missing):
+        if not drop_no_rusher:
+            raise ValueError(f'{len(missing)} plays have no row for their '
+                             f'rusher, e.g. PlayId {missing[0]}')
+        keep = ~df_id['PlayId'].isin(missing).values
+        positions = positions[keep]
+        df, df_id = df[keep], df_id[keep]
+
+    play_codes, order = player_order(df_id)
+    n_plays = play_codes.max() + 1 if len(play_codes) else 0
+
+    sorted_codes = play_codes[order]
+    starts = np.searchsorted(sorted_codes, np.arange(n_plays))
+    slots = np.arange(len(order)) - starts[sorted_codes]
+    if len(slots) and slots.max() >= N_PLAYERS:
+        raise ValueError(f'plays can have at most {N_PLAYERS} rows')
+
+    rows = np.full((n_plays, N_PLAYERS), -1, dtype=np.int64)
+    rows[sorted_codes, slots] = order
+
+    players = np.full((n_plays, N_PLAYERS, len(player_cols)), np.nan,
+                      dtype=np.float32)
+    players[sorted_codes, slots] = _numeric_values(df, player_cols)[order]
+
+    first_rows = rows[:, 0]
+    plays = _numeric_values(df, play_cols)[first_rows]
+    index = df_id[['GameId', 'PlayId']].iloc[first_rows].reset_index(drop=True)
+    rows = np.where(rows >= 0, positions[rows], -1)
+
+    return players, plays, index, rows
+
+
+def defense_mask(df_id, rows):
+    '''
+    This function marks which player slots of the play tensors
+    belong to the defense (the team without the rusher).
+    Plays whose first slot is not the rusher get no defenders.
+
+    Parameters
+    ----------
+    df_id: DataFrame for ID purposes
+    rows: array (n_plays, 22), output of build_play_tensors
+
+    Returns
+    -------
+    boolean array (n_plays, 22)
+    '''
+    team = df_id['Team'].values[rows]
+    first = rows[:, 0]
+    has_rusher = ((first >= 0)
+                  & (df_id['NflId'].values[first]
+                     == df_id['NflIdRusher'].values[first]))
+    return has_rusher[:, None] & (rows >= 0) & (team != team[:, [0]])
+
+
+def spatial_features(players, defense, player_cols=PLAYER_COLS,
+                     radii=(1, 3, 5)):
+    '''
+    This function computes, for every play at once, how the rusher
+    (first slot) relates to each defender: distances, closing speed
+    and time to contact.
+
+    Parameters
+    ----------
+    players: array (n_plays, 22, n_player_features),
+             output of build_play_tensors
+    defense: boolean array (n_plays, 22), output of defense_mask
+    player_cols: list (default=PLAYER_COLS), columns of players
+    radii: tuple (default=(1, 3, 5)), yards used to count close defenders
+
+    Returns
+    -------
+    DataFrame with one row per play
+    (min_time_to_contact is NaN when no defender is closing in;
+    every feature is NaN for plays without defenders, e.g. without
+    a rusher row, see defense_mask)
+    '''
+    x = players[:, :, player_cols.index('long_axis')].astype(np.float64)
+    y = players[:, :, player_cols.index('short_axis')].astype(np.float64)
+    speed = players[:, :, player_cols.index('speed')].astype(np.float64)
+    angle = np.radians(players[:, :, player_cols.index('Dir')]
+                       .astype(np.float64))
+
+    # Dir is measured clockwise from the short axis
+    vx = speed*np.sin(angle)
+    vy = speed*np.cos(angle)
+
+    # position and velocity of each player relative to the rusher
+    dx = x - x[:, [0]]
+    dy = y - y[:, [0]]
+    dvx = vx - vx[:, [0]]
+    dvy = vy - vy[:, [0]]
+
+    dist = np.hypot(dx, dy)
+    dist = np.where(defense, dist, np.inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        closing = -(dx*dvx + dy*dvy) / dist
+        time_to_contact = np.where(defense & (closing > 0),
+                                   dist / closing, np.inf)
+        mean_dist = (np.where(defense, dist, 0).sum(axis=1)
+                     / defense.sum(axis=1))
+    min_time = time_to_contact.min(axis=1)
+
+    nearest = dist.argmin(axis=1)
+    plays = np.arange(len(players))
+    feats = {'nearest_def_dist': dist[plays, nearest],
+             'mean_def_dist': mean_dist,
+             'nearest_def_closing_speed': closing[plays, nearest],
+             'min_time_to_contact': np.where(np.isinf(min_time), np.nan,
+                                             min_time)}
+    for r in radii:
+        feats[f'defenders_within_{r}'] = (dist <= r).sum(axis=1)
+
+    feats = pd.DataFrame(feats)
+    no_defense = ~defense.any(axis=1)
+    if no_defense.any():
+        feats = feats.astype(np.float64)
+        feats[no_defense] = np.nan
+    return feats
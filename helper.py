@@ -1,136 +1,200 @@
 import pandas as pd
 import numpy as np
 from string import punctuation
+from functools import lru_cache
+from instrumentation import instrument
+
+# max number of distinct values remembered per string parser
+PARSER_CACHE_SIZE = 4096
+
+# dtypes used when reading the raw data; the free-text columns are kept
+# as strings so they parse the same whichever rows are read together
+RAW_DTYPES = {'Season': str,
+              'GameClock': str,
+              'StadiumType': str,
+              'Turf': str,
+              'GameWeather': str,
+              'WindSpeed': str,
+              'WindDirection': str,
+              'PlayerHeight': str}
+
+# columns kept aside for ID purposes and dropped from the training data
+ID_COLS = ['GameId', 'PlayId', 'Team', 'NflId',
+           'DisplayName', 'JerseyNumber', 'NflIdRusher',
+           'PlayerCollegeName', 'HomeTeamAbbr',
+           'VisitorTeamAbbr', 'PlayerBirthDate',
+           'Stadium', 'Location']
+
+DROP_COLS = ['GameId', 'PlayId', 'NflId', 'Location',
+             'JerseyNumber', 'NflIdRusher',
+             'PlayerBirthDate', 'PlayerCollegeName',
+             'TimeHandoff', 'TimeSnap', 'Stadium']
+
+
+def _factorize(series):
+    '''
+    This function splits a column into integer codes and distinct values.
+    Categorical columns reuse their category codes.
+    Missing values get their own code.
+    '''
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.values.astype(np.intp)
+        uniques = pd.Index(series.cat.categories).astype(object)
+        if (codes == -1).any():
+            codes = np.where(codes == -1, len(uniques), codes)
+            uniques = uniques.append(pd.Index([np.nan], dtype=object))
+        return codes, uniques
+    return pd.factorize(series, use_na_sentinel=False)
 
-def rename_elements(df, df_id):
+
+@lru_cache(maxsize=32)
+def _cached_parser(func):
+    return lru_cache(maxsize=PARSER_CACHE_SIZE)(func)
+
+
+def map_unique(series, func):
     '''
-    This function renames items in the following columns of the DataFrame:
-    StadiumType
-    Turf
-    GameWeather
-    Position
+    This function applies a parser once per distinct value of a column
+    and broadcasts the results back to every row.
+    Parsed values are cached (up to PARSER_CACHE_SIZE per parser),
+    so repeated calls (e.g. over chunks) only parse new values.
 
     Parameters
-    -----------
-    df = DataFrame used for training
-    df_id = DataFrame for ID purposes
+    ----------
+    series: Series, object or categorical column
+    func: function applied to each distinct value
 
     Returns
-    --------
-    DataFrame
+    -------
+    Series, same result as series.apply(func)
+    '''
+    codes, uniques = _factorize(series)
+    mapped = pd.Series(list(uniques), dtype=object).map(_cached_parser(func))
+    return pd.Series(mapped.values.take(codes), index=series.index,
+                     name=series.name)
+
+
+def map_values(series, mapping):
     '''
+    This function renames the values of a column with a dictionary,
+    looking up each distinct value only once.
+    Values missing from the dictionary are kept as is.
 
-    # set stadium types as outdoor or indoor
-    stadium_types = {'Outdoor': 'Outdoor',
-                     'Indoor': 'Indoor',
-                     'Outdoors': 'Outdoor',
-                     'Indoors': 'Indoor',
-                     'Dome': 'Indoor',
-                     'Retractable Roof': 'Indoor',
-                     'Open': 'Outdoor',
-                     'Retr. Roof-Closed': 'Indoor',
-                     'Retr. Roof - Closed': 'Indoor',
-                     'Domed, closed': 'Indoor',
-                     'Domed, open': 'Outdoor',
-                     'Closed Dome': 'Indoor',
-                     'Domed': 'Indoor',
-                     'Dome, closed': 'Indoor',
-                     'Oudoor': 'Outdoor',
-                     'Retr. Roof Closed': 'Indoor',
-                     'Indoor, Roof Closed': 'Indoor',
-                     'Retr. Roof-Open': 'Outdoor',
-                     'Bowl': 'Outdoor',
-                     'Outddors': 'Outdoor',
-                     'Heinz Field': 'Outdoor',
-                     'Retr. Roof - Open': 'Outdoor',
-                     'Outdoor Retr Roof-Open': 'Outdoor',
-                     'Outdor': 'Outdoor',
-                     'Ourdoor': 'Outdoor',
-                     'Indoor, Open Roof': 'Outdoor',
-                     'Outside': 'Outdoor',
-                     'Cloudy': 'Outdoor',
-                     'Domed, Open': 'Outdoor'}
-
-    df['StadiumType'] = df['StadiumType'].apply(lambda x: stadium_types[x])
-
-    # set turf type as natural or artificial
-    grass = {'Grass': 'Natural',
-             'Natural Grass': 'Natural',
-             'Field Turf': 'Artificial',
-             'Artificial': 'Artificial',
-             'FieldTurf': 'Artificial',
-             'UBU Speed Series-S5-M': 'Artificial',
-             'A-Turf Titan': 'Artificial',
-             'UBU Sports Speed S5-M': 'Artificial',
-             'FieldTurf360': 'Artificial',
-             'DD GrassMaster': 'Mix',
-             'Twenty-Four/Seven Turf': 'Artificial',
-             'SISGrass': 'Mix',
-             'FieldTurf 360': 'Artificial',
-             'Natural grass': 'Natural',
-             'Artifical': 'Artificial',
-             'Natural': 'Natural',
-             'Field turf': 'Artificial',
-             'Naturall Grass': 'Natural',
-             'grass': 'Natural',
-             'natural grass': 'Natural'}
-
-    df['Turf'] = df['Turf'].apply(lambda x: grass[x])
-
-    # rename weather values to combine them
-    weather = {'Controlled Climate': 'Indoor',
-               'N/A (Indoors)': 'Indoor',
-               'Indoors': 'Indoor',
-               'N/A Indoor': 'Indoor',
-               'Sunny, highs to upper 80s': 'Sunny',
-               'Cloudy, fog started developing in 2nd quarter': 'Cloudy, fog',
-               'Rain likely, temps in low 40s.': 'Rain',
-               'Cloudy, 50% change of rain': 'Cloudy',
-               'Cloudy with periods of rain, thunder possible. Winds shifting to WNW, 10-20 mph.': 'Cloudy, rain',
-               'Cloudy, chance of rain': 'Cloudy, rain',
-               'Cloudy, light snow accumulating 1-3"': 'Cloudy, snow',
-               'Rain Chance 40%': 'Rain',
-               'Rainy': 'Rain',
-               'Partly sunny': 'Partly Sunny',
-               'Partly cloudy': 'Partly Cloudy',
-               'Clear skies': 'Clear Skies',
-               'cloudy': 'Cloudy',
-               'Heavy lake effect snow': 'Snow',
-               'Cloudy and Cool': 'Cloudy and cool',
-               'Partly Clouidy': 'Partly Cloudy',
-               'Cloudy, Rain': 'Cloudy, rain',
-               'Clear and Cool': 'Clear and cool',
-               'Clear and Sunny': 'Clear and sunny',
-               'Mostly cloudy': 'Mostly Cloudy',
-               'Mostly sunny': 'Mostly Sunny',
-               '30% Chance of Rain': 'Rain',
-               'Partly Cloudly': 'Partly Cloudy',
-               'Coudy': 'Cloudy',
-               'Mostly coudy': 'Mostly Cloudy',
-               'Partly clear': 'Partly Clear',
-               'T: 51; H: 55; W: NW 10 mph': 'Fair',
-               'Party Cloudy': 'Partly Cloudy',
-               'Mostly Coudy': 'Mostly Cloudy'}
-
-    df['GameWeather'] = df['GameWeather'].apply(lambda x: weather[x]
-                                                if x in weather.keys()
-                                                else x)
-
-    # rename positions to combine them into one
-    pos = {'OLB': 'LB',
-           'ILB': 'LB',
-           'MLB': 'LB',
-           'SS': 'S',
-           'FS': 'S',
-           'SAF': 'S',
-           'T': 'OT'}
-
-    df['Position'] = df['Position'].apply(lambda x: pos[x]
-                                          if x in pos.keys()
-                                          else x)
-
-    # rename cities to match the format of 'city, state'
-    cities = {'Orchard Park NY': 'Orchard Park, NY',
+    Parameters
+    ----------
+    series: Series, object or categorical column
+    mapping: dict, old value -> new value
+
+    Returns
+    -------
+    Series with renamed values
+    '''
+    codes, uniques = _factorize(series)
+    mapped = np.empty(len(uniques), dtype=object)
+    mapped[:] = [mapping.get(x, x) for x in uniques]
+    return pd.Series(mapped.take(codes), index=series.index,
+                     name=series.name)
+
+
+# stadium types grouped as outdoor or indoor
+STADIUM_TYPES = {'Outdoor': 'Outdoor',
+                 'Indoor': 'Indoor',
+                 'Outdoors': 'Outdoor',
+                 'Indoors': 'Indoor',
+                 'Dome': 'Indoor',
+                 'Retractable Roof': 'Indoor',
+                 'Open': 'Outdoor',
+                 'Retr. Roof-Closed': 'Indoor',
+                 'Retr. Roof - Closed': 'Indoor',
+                 'Domed, closed': 'Indoor',
+                 'Domed, open': 'Outdoor',
+                 'Closed Dome': 'Indoor',
+                 'Domed': 'Indoor',
+                 'Dome, closed': 'Indoor',
+                 'Oudoor': 'Outdoor',
+                 'Retr. Roof Closed': 'Indoor',
+                 'Indoor, Roof Closed': 'Indoor',
+                 'Retr. Roof-Open': 'Outdoor',
+                 'Bowl': 'Outdoor',
+                 'Outddors': 'Outdoor',
+                 'Heinz Field': 'Outdoor',
+                 'Retr. Roof - Open': 'Outdoor',
+                 'Outdoor Retr Roof-Open': 'Outdoor',
+                 'Outdor': 'Outdoor',
+                 'Ourdoor': 'Outdoor',
+                 'Indoor, Open Roof': 'Outdoor',
+                 'Outside': 'Outdoor',
+                 'Cloudy': 'Outdoor',
+                 'Domed, Open': 'Outdoor'}
+
+# turf types grouped as natural, artificial or mix
+TURF_TYPES = {'Grass': 'Natural',
+              'Natural Grass': 'Natural',
+              'Field Turf': 'Artificial',
+              'Artificial': 'Artificial',
+              'FieldTurf': 'Artificial',
+              'UBU Speed Series-S5-M': 'Artificial',
+              'A-Turf Titan': 'Artificial',
+              'UBU Sports Speed S5-M': 'Artificial',
+              'FieldTurf360': 'Artificial',
+              'DD GrassMaster': 'Mix',
+              'Twenty-Four/Seven Turf': 'Artificial',
+              'SISGrass': 'Mix',
+              'FieldTurf 360': 'Artificial',
+              'Natural grass': 'Natural',
+              'Artifical': 'Artificial',
+              'Natural': 'Natural',
+              'Field turf': 'Artificial',
+              'Naturall Grass': 'Natural',
+              'grass': 'Natural',
+              'natural grass': 'Natural'}
+
+# spellings of the same weather, combined
+WEATHER_NAMES = {'Controlled Climate': 'Indoor',
+                 'N/A (Indoors)': 'Indoor',
+                 'Indoors': 'Indoor',
+                 'N/A Indoor': 'Indoor',
+                 'Sunny, highs to upper 80s': 'Sunny',
+                 'Cloudy, fog started developing in 2nd quarter': 'Cloudy, fog',
+                 'Rain likely, temps in low 40s.': 'Rain',
+                 'Cloudy, 50% change of rain': 'Cloudy',
+                 'Cloudy with periods of rain, thunder possible. Winds shifting to WNW, 10-20 mph.': 'Cloudy, rain',
+                 'Cloudy, chance of rain': 'Cloudy, rain',
+                 'Cloudy, light snow accumulating 1-3"': 'Cloudy, snow',
+                 'Rain Chance 40%': 'Rain',
+                 'Rainy': 'Rain',
+                 'Partly sunny': 'Partly Sunny',
+                 'Partly cloudy': 'Partly Cloudy',
+                 'Clear skies': 'Clear Skies',
+                 'cloudy': 'Cloudy',
+                 'Heavy lake effect snow': 'Snow',
+                 'Cloudy and Cool': 'Cloudy and cool',
+                 'Partly Clouidy': 'Partly Cloudy',
+                 'Cloudy, Rain': 'Cloudy, rain',
+                 'Clear and Cool': 'Clear and cool',
+                 'Clear and Sunny': 'Clear and sunny',
+                 'Mostly cloudy': 'Mostly Cloudy',
+                 'Mostly sunny': 'Mostly Sunny',
+                 '30% Chance of Rain': 'Rain',
+                 'Partly Cloudly': 'Partly Cloudy',
+                 'Coudy': 'Cloudy',
+                 'Mostly coudy': 'Mostly Cloudy',
+                 'Partly clear': 'Partly Clear',
+                 'T: 51; H: 55; W: NW 10 mph': 'Fair',
+                 'Party Cloudy': 'Partly Cloudy',
+                 'Mostly Coudy': 'Mostly Cloudy'}
+
+# positions combined into one
+POSITION_NAMES = {'OLB': 'LB',
+                  'ILB': 'LB',
+                  'MLB': 'LB',
+                  'SS': 'S',
+                  'FS': 'S',
+                  'SAF': 'S',
+                  'T': 'OT'}
+
+# cities in the format 'city, state'
+CITY_NAMES = {'Orchard Park NY': 'Orchard Park, NY',
               'Chicago. IL': 'Chicago, IL',
               'Houston, Texas': 'Houston, TX',
               'Los Angeles, Calif.': 'Los Angeles, CA',
@@ -162,12 +226,34 @@ def rename_elements(df, df_id):
               'New Orleans': 'New Orleans, LA',
               'Cleveland, Ohio': 'Cleveland, OH'}
 
-    df_id['Location'] = df_id['Location'].apply(lambda x: cities[x]
-                                                if x in cities.keys()
-                                                else x)
 
-    return df
+@instrument
+def rename_elements(df, df_id):
+    '''
+    This function renames items in the following columns of the DataFrame:
+    StadiumType
+    Turf
+    GameWeather
+    Position
+
+    Parameters
+    -----------
+    df = DataFrame used for training
+    df_id = DataFrame for ID purposes
+
+    Returns
+    --------
+    DataFrame
+    '''
 
+    # stadium types and turfs missing from the dictionaries are kept as is
+    df['StadiumType'] = map_values(df['StadiumType'], STADIUM_TYPES)
+    df['Turf'] = map_values(df['Turf'], TURF_TYPES)
+    df['GameWeather'] = map_values(df['GameWeather'], WEATHER_NAMES)
+    df['Position'] = map_values(df['Position'], POSITION_NAMES)
+    df_id['Location'] = map_values(df_id['Location'], CITY_NAMES)
+
+    return df
 
 def group_weather(txt):
     if 'Clear' in txt:
@@ -190,7 +276,37 @@ def group_weather(txt):
         return 'Rain'
     return txt
 
-def replace_null_cols(df):
+@instrument
+def null_fill_values(df):
+    '''
+    This function finds null columns and the values to fill them with.
+    Categorical columns get the most common value.
+    Numerical columns get the median value.
+
+    Parameters
+    -----------
+    df: DataFrame
+
+    Returns
+    --------
+    dict, column name -> fill value
+    '''
+    fills = {}
+    for col in df.columns:
+        if df[col].isna().any() == True:
+            if df[col].dtype == 'O' or isinstance(df[col].dtype,
+                                                  pd.CategoricalDtype):
+                # ties go to the value seen first
+                counts = df[col].value_counts(sort=False)
+                fills[col] = counts.index[counts.values.argmax()]
+            else:
+                fills[col] = df[col].median()
+
+    return fills
+
+
+@instrument
+def replace_null_cols(df, fills=None):
     '''
     This function finds null columns and replaces them with appropriate values.
     Categorical columns will be replaced with the most common values.
@@ -199,22 +315,23 @@ def replace_null_cols(df):
     Parameters
     -----------
     df: DataFrame
+    fills: dict (default=None), column name -> fill value,
+           computed beforehand (e.g. over the whole file when cleaning
+           in chunks); computed from df when None
 
     Returns
     --------
     DataFrame
     '''
-    null_cols = []
-    for col in df.columns:
-        if df[col].isna().any() == True:
-            null_cols.append(col)
+    if fills is None:
+        fills = null_fill_values(df)
 
-    for col in null_cols:
-        if df[col].dtype == 'O':
-            df[col].fillna(df[col].value_counts().index[0],
-                           inplace=True)
-        else:
-            df[col].fillna(df[col].median(), inplace=True)
+    # filled object columns are downcast by infer_objects, as fillna
+    # used to do silently (with a FutureWarning)
+    with pd.option_context('future.no_silent_downcasting', True):
+        for col, value in fills.items():
+            if col in df.columns:
+                df[col] = df[col].fillna(value).infer_objects(copy=False)
 
     return df
 
@@ -258,6 +375,7 @@ def strtoseconds(txt):
     return ans
 
 
+@instrument
 def organize_team_abbrs(df):
     '''
     This function reorganizes team abbreviations,
@@ -271,12 +389,11 @@ def organize_team_abbrs(df):
     --------
     DataFrame
     '''
-    df['TeamAbbr'] = df.apply(lambda row: row['HomeTeamAbbr']
-                              if row['Team'] == 'home'
-                              else row['VisitorTeamAbbr'], axis=1)
-    df['OppTeamAbbr'] = df.apply(lambda row: row['VisitorTeamAbbr']
-                                 if row['Team'] == 'home'
-                                 else row['HomeTeamAbbr'], axis=1)
+    home = (df['Team'] == 'home').values
+    df['TeamAbbr'] = np.where(home, df['HomeTeamAbbr'],
+                              df['VisitorTeamAbbr'])
+    df['OppTeamAbbr'] = np.where(home, df['VisitorTeamAbbr'],
+                                 df['HomeTeamAbbr'])
     df.drop(['HomeTeamAbbr', 'VisitorTeamAbbr'], axis=1, inplace=True)
 
     diff_abbr = {}
@@ -288,15 +405,8 @@ def organize_team_abbrs(df):
     for abb in df['PossessionTeam'].unique():
         diff_abbr[abb] = abb
 
-    df['PossessionTeam'] = df['PossessionTeam'].map(lambda x: diff_abbr[x]
-                                                    if x in diff_abbr
-                                                    else x)
-    df['TeamAbbr'] = df['TeamAbbr'].map(lambda x: diff_abbr[x]
-                                        if x in diff_abbr
-                                        else x)
-    df['OppTeamAbbr'] = df['OppTeamAbbr'].map(lambda x: diff_abbr[x]
-                                              if x in diff_abbr
-                                              else x)
+    for col in ['PossessionTeam', 'TeamAbbr', 'OppTeamAbbr']:
+        df[col] = df[col].replace(diff_abbr)
 
     return df
 
@@ -380,3 +490,210 @@ def assign_yard_class(x):
         return "4-6"
     else:
         return "> 6"
+
+
+@instrument
+def yard_classes(yards):
+    '''
+    This function bins the number of yards of a whole column at once.
+    Same bins as assign_yard_class.
+
+    Parameters
+    ----------
+    yards: Series, number of yards
+
+    Returns
+    -------
+    array of yard classes (<0, 0-1, 2-3, 4-6, >6)
+    '''
+    yards = np.asarray(yards)
+    conditions = [yards < 0,
+                  (yards >= 0) & (yards <= 1),
+                  (yards > 1) & (yards <= 3),
+                  (yards > 3) & (yards <= 6)]
+    return np.select(conditions, ['< 0', '0-1', '2-3', '4-6'],
+                     default='> 6').astype(object)
+
+
+def flip_orientation(angle, play_direction):
+    '''
+    This function cleans up an orientation column at once.
+    Same result as new_orientation applied row by row.
+
+    Parameters
+    ----------
+    angle: Series, angles
+    play_direction: Series, play directions
+
+    Returns
+    -------
+    array of new angles
+    '''
+    angle = np.asarray(angle, dtype=float)
+    new_angle = 360.0 - angle
+    new_angle[new_angle == 360.0] = 0.0
+    return np.where(np.asarray(play_direction == 0), new_angle, angle)
+
+
+def _height_to_inches(txt):
+    return 12*int(txt.split('-')[0]) + int(txt.split('-')[1])
+
+
+@instrument
+def height_to_inches(heights):
+    '''
+    This function turns player heights (ft-in) into inches.
+
+    Parameters
+    ----------
+    heights: Series, player heights as 'ft-in' strings
+
+    Returns
+    -------
+    Series of heights in inches
+    '''
+    return map_unique(heights, _height_to_inches)
+
+
+def home_or_away(team, team_abbr):
+    '''
+    This function marks a team column as 'Home' when it matches
+    the player's team abbreviation and 'Away' otherwise.
+
+    Parameters
+    ----------
+    team: Series, team abbreviations (e.g. FieldPosition, PossessionTeam)
+    team_abbr: Series, abbreviations of the player's team
+
+    Returns
+    -------
+    array of 'Home'/'Away'
+    '''
+    return np.where(team.values == team_abbr.values,
+                    'Home', 'Away').astype(object)
+
+
+@instrument
+def parse_text_cols(df):
+    '''
+    This function parses the WindSpeed, GameClock and WindDirection
+    text columns.
+
+    Parameters
+    -----------
+    df: DataFrame
+
+    Returns
+    --------
+    DataFrame
+    '''
+    df['WindSpeed'] = map_unique(df['WindSpeed'],
+                                 give_me_WindSpeed).astype(float)
+    df['GameClock'] = map_unique(df['GameClock'], strtoseconds)
+    df['WindDirection'] = map_unique(df['WindDirection'],
+                                     clean_WindDirection)
+
+    return df
+
+
+@instrument
+def flip_play_direction(df):
+    '''
+    This function lines up long_axis, Orientation and Dir
+    with the play direction.
+
+    Parameters
+    -----------
+    df: DataFrame
+
+    Returns
+    --------
+    DataFrame
+    '''
+    # any non-empty play direction keeps the long axis as is
+    df['long_axis'] = np.where(df['PlayDirection'].astype(bool),
+                               df['long_axis'], 120 - df['long_axis'])
+    df['Orientation'] = flip_orientation(df['Orientation'],
+                                         df['PlayDirection'])
+    df['Dir'] = flip_orientation(df['Dir'], df['PlayDirection'])
+
+    return df
+
+
+@instrument
+def team_sides(df):
+    '''
+    This function turns FieldPosition and PossessionTeam into
+    'Home'/'Away' relative to the player's team.
+
+    Parameters
+    -----------
+    df: DataFrame, with the TeamAbbr column
+
+    Returns
+    --------
+    DataFrame
+    '''
+    df['FieldPosition'] = home_or_away(df['FieldPosition'], df['TeamAbbr'])
+    df['PossessionTeam'] = home_or_away(df['PossessionTeam'],
+                                        df['TeamAbbr'])
+
+    return df
+
+
+@instrument
+def split_id_cols(df):
+    '''
+    This function renames the tracking columns of the raw DataFrame
+    and splits off the columns used for ID purposes.
+
+    Parameters
+    -----------
+    df: DataFrame, raw data
+
+    Returns
+    --------
+    DataFrame used for training, DataFrame for ID purposes
+    '''
+    df = df.rename(columns={'X': 'long_axis', 'Y': 'short_axis',
+                            'S': 'speed', 'A': 'accel'})
+    df_id = df[ID_COLS].copy()
+    df = df.drop(DROP_COLS, axis=1)
+
+    return df, df_id
+
+
+@instrument
+def clean_frame(df, fills=None):
+    '''
+    This function runs every cleaning step on the raw DataFrame
+    (as read from train.csv) with column-wise operations.
+    The output is the same as running the helpers row by row.
+
+    Parameters
+    -----------
+    df: DataFrame, raw data
+    fills: dict (default=None), null fill values passed to
+           replace_null_cols
+
+    Returns
+    --------
+    DataFrame used for training, DataFrame for ID purposes
+    '''
+    df, df_id = split_id_cols(df)
+
+    df = replace_null_cols(df, fills)
+    df = rename_elements(df, df_id)
+    df = parse_text_cols(df)
+    df = organize_team_abbrs(df)
+    df['PlayerHeight'] = height_to_inches(df['PlayerHeight'])
+    df = flip_play_direction(df)
+    df = team_sides(df)
+    # rows to score have no Yards yet
+    if 'Yards' in df.columns:
+        df['Yard_class'] = yard_classes(df['Yards'])
+    df['GameWeather'] = map_unique(df['GameWeather'], group_weather)
+    df['OffenseFormation'] = df['OffenseFormation'].replace('ACE',
+                                                            'SINGLEBACK')
+
+    return df, df_id
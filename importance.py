@@ -0,0 +1,375 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import scipy.sparse as sp
+import xgboost as xgb
+import catboost as cb
+import shap
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from sklearn.metrics import check_scoring
+from pipeline import code_fingerprint
+from registry import LazyModel, _tree_models
+from scheduler import split_cores, set_n_threads
+from modeling import shared_frame, _take, _hash_array, data_fingerprint
+
+# folder of the cached importances
+IMPORTANCE_CACHE_DIR = 'Data/importance_cache'
+
+
+def _unwrap(model):
+    '''
+    This function finds the fitted model behind a search object
+    or a registered LazyModel.
+    '''
+    model = getattr(model, 'best_estimator_', model)
+    if isinstance(model, LazyModel):
+        model = model.model
+    return model
+
+
+def _feature_names(X, feature_names=None):
+    if feature_names is not None:
+        return list(feature_names)
+    if hasattr(X, 'columns'):
+        return list(X.columns)
+    return [f'f{i}' for i in range(X.shape[1])]
+
+
+def model_fingerprint(model):
+    '''
+    This function identifies a fitted model by its class, its parameters
+    and what it learned: the node arrays of sklearn trees and forests,
+    the serialized booster of XGBoost and CatBoost models, and the pickle
+    of any other model. The cache keys add the data fingerprint to it.
+
+    Parameters
+    ----------
+    model: fitted model, search object or LazyModel
+
+    Returns
+    -------
+    str, hex digest
+    '''
+    model = _unwrap(model)
+    digest = hashlib.sha256(f'{model.__class__.__module__}.'
+                            f'{model.__class__.__name__}'.encode())
+    if hasattr(model, 'get_params'):
+        digest.update(repr(sorted(model.get_params().items())).encode())
+
+    trees = _tree_models(model)
+    if trees is not None:
+        for tree in trees:
+            state = tree.tree_.__getstate__()
+            # field by field: the padding between fields is not data
+            for field in state['nodes'].dtype.names:
+                _hash_array(digest, state['nodes'][field])
+            _hash_array(digest, state['values'])
+        # the rest of what fit learned (classes_, n_features_in_, ...)
+        fitted = {k: v for k, v in vars(model).items()
+                  if k.endswith('_') and k not in ('estimators_', 'tree_',
+                                                   'estimator_')}
+        digest.update(pickle.dumps(fitted))
+    elif isinstance(model, (xgb.Booster, xgb.XGBModel)):
+        booster = (model if isinstance(model, xgb.Booster)
+                   else model.get_booster())
+        digest.update(bytes(booster.save_raw('ubj')))
+    elif isinstance(model, cb.CatBoost):
+        fd, path = tempfile.mkstemp(suffix='.cbm')
+        os.close(fd)
+        try:
+            model.save_model(path)
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        finally:
+            os.remove(path)
+    else:
+        digest.update(pickle.dumps(model))
+    return digest.hexdigest()
+
+
+def _cached(func, kind, model, X, y, params, cache_dir):
+    '''
+    This function returns the cached result of func for this model,
+    data and parameters, computing and saving it when it is missing.
+    '''
+    if not cache_dir:
+        return func()
+    digest = hashlib.sha256(kind.encode())
+    digest.update(model_fingerprint(model).encode())
+    digest.update(data_fingerprint(X, y).encode())
+    digest.update(code_fingerprint(func).encode())
+    digest.update(repr(sorted(params.items())).encode())
+    path = os.path.join(cache_dir, f'{kind}_{digest.hexdigest()}.pkl')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    result = func()
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump(result, f)
+    return result
+
+
+def builtin_importances(model, feature_names):
+    '''
+    This function gives the importances a model computes itself:
+    feature_importances_ for trees and boosted models, the absolute
+    coefficients (averaged over the classes) for linear models.
+
+    Parameters
+    ----------
+    model: fitted model, search object or LazyModel
+    feature_names: list, names of the features
+
+    Returns
+    -------
+    DataFrame with an importance column, indexed by feature
+    '''
+    model = _unwrap(model)
+    if hasattr(model, 'coef_'):
+        values = np.abs(np.atleast_2d(model.coef_)).mean(axis=0)
+    else:
+        values = model.feature_importances_
+    return pd.DataFrame({'importance': values},
+                        index=pd.Index(feature_names, name='feature'))
+
+
+def _permuted_scores(model, X, y, scorer, tasks, seed, n_threads,
+                     set_threads):
+    '''
+    This function scores the model on a batch of (feature, repeat)
+    permutations, using one private copy of X for the whole batch.
+    Each permutation only depends on the seed, the feature and the
+    repeat, so the scores do not depend on how the tasks are split.
+    '''
+    if set_threads:
+        set_n_threads(model, n_threads)
+    X_perm = X.copy()
+    scores = []
+    with threadpool_limits(limits=n_threads):
+        for col, repeat in tasks:
+            rng = np.random.default_rng([seed, col, repeat])
+            perm = rng.permutation(X.shape[0])
+            if hasattr(X, 'columns'):
+                name = X.columns[col]
+                X_perm[name] = X[name].values[perm]
+                scores.append(scorer(model, X_perm, y))
+                X_perm[name] = X[name].values
+            else:
+                X_perm[:, col] = X[:, col][perm]
+                scores.append(scorer(model, X_perm, y))
+                X_perm[:, col] = X[:, col]
+    return scores
+
+
+def permutation_importances(model, X, y, scoring=None, n_repeats=5,
+                            n_jobs=None, seed=220, feature_names=None,
+                            cache_dir=IMPORTANCE_CACHE_DIR):
+    '''
+    This function measures how much the score drops when the values of
+    each feature are shuffled, on held-out data.
+    The (feature, repeat) pairs are split between worker processes that
+    all read one shared memory-mapped copy of X (see
+    modeling.shared_frame); each worker copies it once for its batch.
+    The result is cached for this model, data and settings.
+
+    Parameters
+    ----------
+    model: fitted model, search object or LazyModel
+    X: DataFrame or array, held-out features (dense)
+    y: Series or array, held-out target
+    scoring: str (default=None), sklearn scoring name; the score
+             method of the model if None
+    n_repeats: int (default=5), shuffles per feature
+    n_jobs: int (default=None), number of cores; all when None
+    seed: int (default=220)
+    feature_names: list (default=None), names of the features;
+                   the columns of X if None
+    cache_dir: str (default=IMPORTANCE_CACHE_DIR), None to skip the cache
+
+    Returns
+    -------
+    DataFrame with the mean drop of the score (importance) and its
+    standard deviation over the repeats (std), indexed by feature
+    '''
+    if sp.issparse(X):
+        raise TypeError('permutation_importances needs dense features')
+    model = _unwrap(model)
+    y = np.asarray(y)
+    names = _feature_names(X, feature_names)
+    params = {'scoring': scoring, 'n_repeats': n_repeats, 'seed': seed,
+              'feature_names': names}
+
+    def compute():
+        scorer = check_scoring(model, scoring=scoring)
+        baseline = scorer(model, X, y)
+        tasks = [(col, repeat) for col in range(X.shape[1])
+                 for repeat in range(n_repeats)]
+        n_outer, n_threads = split_cores(n_jobs or os.cpu_count(),
+                                         len(tasks))
+        batches = np.array_split(np.arange(len(tasks)), n_outer)
+        with shared_frame(X) as X_shared:
+            results = Parallel(n_jobs=n_outer)(
+                delayed(_permuted_scores)(model, X_shared, y, scorer,
+                                          [tasks[i] for i in batch], seed,
+                                          n_threads, n_outer > 1)
+                for batch in batches)
+        scores = np.concatenate(results).reshape(X.shape[1], n_repeats)
+        drops = baseline - scores
+        return pd.DataFrame({'importance': drops.mean(axis=1),
+                             'std': drops.std(axis=1)},
+                            index=pd.Index(names, name='feature'))
+
+    return _cached(compute, 'permutation', model, X, y, params, cache_dir)
+
+
+def _tree_shap(model, X):
+    '''
+    This function computes the exact TreeSHAP values of a tree model
+    with shap (sklearn trees and forests).
+    '''
+    values = shap.TreeExplainer(model).shap_values(X, check_additivity=False)
+    if isinstance(values, list):
+        values = np.stack(values, axis=-1)
+    return values
+
+
+def _booster_threads(booster):
+    config = json.loads(booster.save_config())
+    return int(config['learner']['generic_param']['nthread'])
+
+
+def shap_values(model, X, n_jobs=None):
+    '''
+    This function computes the exact TreeSHAP values of a tree model:
+    XGBoost and CatBoost compute them natively with their own threads,
+    sklearn trees and forests with shap, in parallel over row blocks.
+
+    Parameters
+    ----------
+    model: fitted tree model, search object or LazyModel
+    X: DataFrame or array
+    n_jobs: int (default=None), number of cores; all when None
+
+    Returns
+    -------
+    array of shape (rows, features) for regression or
+    (rows, features, classes) for classification
+    '''
+    model = _unwrap(model)
+    n_jobs = n_jobs or os.cpu_count()
+    module = model.__class__.__module__.split('.')[0]
+
+    if module == 'xgboost':
+        booster = model if isinstance(model, xgb.Booster) \
+            else model.get_booster()
+        # the caller's booster keeps its own thread setting
+        previous = _booster_threads(booster)
+        booster.set_param({'nthread': n_jobs})
+        try:
+            values = booster.predict(xgb.DMatrix(X), pred_contribs=True)
+        finally:
+            booster.set_param({'nthread': previous})
+        # the last column is the bias; classes come before the features
+        values = values[..., :-1]
+        return values if values.ndim == 2 else values.transpose(0, 2, 1)
+
+    if module == 'catboost':
+        pool = cb.Pool(X, cat_features=model.get_cat_feature_indices())
+        values = model.get_feature_importance(pool, type='ShapValues',
+                                              thread_count=n_jobs)
+        values = values[..., :-1]
+        return values if values.ndim == 2 else values.transpose(0, 2, 1)
+
+    n_outer = max(1, min(n_jobs, X.shape[0] // 1000))
+    blocks = np.array_split(np.arange(X.shape[0]), n_outer)
+    with shared_frame(X) as X_shared:
+        results = Parallel(n_jobs=n_outer)(
+            delayed(_tree_shap)(model, _take(X_shared, block))
+            for block in blocks)
+    return np.concatenate(results)
+
+
+def shap_importances(model, X, n_jobs=None, max_rows=10000, seed=220,
+                     feature_names=None, cache_dir=IMPORTANCE_CACHE_DIR):
+    '''
+    This function ranks the features by their mean absolute TreeSHAP
+    value (see shap_values). The result is cached for this model,
+    data and settings.
+
+    Parameters
+    ----------
+    model: fitted tree model, search object or LazyModel
+    X: DataFrame or array
+    n_jobs: int (default=None), number of cores; all when None
+    max_rows: int (default=10000), explain a random sample of this many
+              rows (None for all rows); TreeSHAP costs about
+              trees x leaves x depth^2 per row, so a large forest on
+              every test row can take hours
+    seed: int (default=220), seed of the sample
+    feature_names: list (default=None), names of the features;
+                   the columns of X if None
+    cache_dir: str (default=IMPORTANCE_CACHE_DIR), None to skip the cache
+
+    Returns
+    -------
+    DataFrame with the importance (summed over the classes) and, for
+    classifiers, one column per class, indexed by feature
+    '''
+    model = _unwrap(model)
+    names = _feature_names(X, feature_names)
+    params = {'max_rows': max_rows, 'seed': seed, 'feature_names': names}
+
+    def compute():
+        X_explained = X
+        if max_rows and X.shape[0] > max_rows:
+            rows = np.sort(np.random.default_rng(seed).choice(
+                X.shape[0], max_rows, replace=False))
+            X_explained = _take(X, rows)
+        mean_abs = np.abs(shap_values(model, X_explained, n_jobs)).mean(axis=0)
+        importances = pd.DataFrame(index=pd.Index(names, name='feature'))
+        if mean_abs.ndim == 1:
+            importances['importance'] = mean_abs
+        else:
+            importances['importance'] = mean_abs.sum(axis=1)
+            classes = getattr(model, 'classes_', range(mean_abs.shape[1]))
+            for i, label in enumerate(classes):
+                importances[str(label)] = mean_abs[:, i]
+        return importances
+
+    return _cached(compute, 'shap', model, X, None, params, cache_dir)
+
+
+def feature_importances(model, X, y=None, kind='permutation', **kwargs):
+    '''
+    This function computes (or reads from the cache) the importances of
+    the features for the plotting functions of visualizations.py.
+
+    Parameters
+    ----------
+    model: fitted model, search object or LazyModel
+    X: DataFrame or array, held-out features
+    y: Series or array (default=None), held-out target,
+       needed for permutation importances
+    kind: str (default='permutation'), 'permutation', 'shap' or
+          'builtin' (feature_importances_ or coefficients)
+    kwargs: passed to permutation_importances or shap_importances
+
+    Returns
+    -------
+    DataFrame with an importance column, indexed by feature
+    '''
+    if kind == 'permutation':
+        return permutation_importances(model, X, y, **kwargs)
+    if kind == 'shap':
+        return shap_importances(model, X, **kwargs)
+    if kind == 'builtin':
+        return builtin_importances(model, _feature_names(
+            X, kwargs.get('feature_names')))
+    raise ValueError(f'Unknown kind of importance: {kind}')
@@ -0,0 +1,458 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import shutil
+import xgboost as xgb
+from registry import (REGISTRY_DIR, COMPILED_DIR, LazyModel, load_model,
+                      _tree_models)
+
+# most (row, tree) pairs walked at once; bounds the memory of a batch
+MAX_PAIRS = 2**20
+
+
+def _float32_at_most(values):
+    '''
+    This function rounds thresholds down to float32. The features are
+    compared as float32, and for a float32 x, x <= t holds exactly when
+    x <= (largest float32 <= t), so no comparison changes.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    rounded = values.astype(np.float32)
+    above = rounded.astype(np.float64) > values
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+class CompiledForest:
+    '''
+    This class predicts with a tree ensemble stored as a few flat arrays
+    (one entry per node of all trees), walking a batch of rows down all
+    trees at once with vectorized lookups.
+    Make it with compile_model.
+
+    Parameters
+    ----------
+    feature: int32 array, feature of the split of each node
+    threshold: float32 array, rows with feature <= threshold go left
+    children: int32 array of shape (nodes, 2), left and right child;
+              leaves point to themselves
+    missing_left: boolean array, where rows with a missing value go
+    value: array of shape (nodes, outputs), leaf values
+    roots: int32 array, first node of each tree
+    depth: int, depth of the deepest tree
+    average: boolean, True to average the trees (forests),
+             False to add them up (boosting)
+    bias: array of shape (outputs,), added to the sum of the trees
+    link: str, 'identity', 'sigmoid', 'softmax' or 'exp'
+    tree_class: int array (default=None), output of each tree when every
+                tree predicts one class (XGBoost multi-class)
+    classes: array (default=None), classes of a classifier
+    feature_names: list (default=None), features in training order
+    '''
+    def __init__(self, feature, threshold, children, missing_left, value,
+                 roots, depth, average, bias, link, tree_class=None,
+                 classes=None, feature_names=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.average = bool(average)
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.link = link
+        self.tree_class = tree_class
+        self.classes_ = classes
+        self.feature_names = feature_names
+
+    @property
+    def nbytes(self):
+        '''
+        Memory used by the node arrays, in bytes.
+        '''
+        return sum(a.nbytes for a in (self.feature, self.threshold,
+                                      self.children, self.missing_left,
+                                      self.value, self.roots))
+
+    def _features(self, X):
+        if hasattr(X, 'columns') and self.feature_names is not None:
+            X = X[self.feature_names]
+        return np.ascontiguousarray(X, dtype=np.float32)
+
+    def _leaves(self, X):
+        '''
+        This function walks every (tree, row) pair down one level at a
+        time. The pairs are ordered tree by tree, so the rows walking the
+        same tree read nearby nodes, and every few levels the pairs that
+        reached a leaf are put aside.
+        '''
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        flat = X.ravel()
+        has_nan = np.isnan(flat).any()
+        children = self.children.ravel()
+
+        nodes = np.repeat(self.roots, n_rows)
+        rows = np.tile(np.arange(n_rows, dtype=np.int64) * n_features,
+                       n_trees)
+        pairs = np.arange(len(nodes))
+        leaves = np.empty_like(nodes)
+        for level in range(self.depth):
+            x = flat[rows + self.feature[nodes]]
+            right = x > self.threshold[nodes]
+            if has_nan:
+                right |= np.isnan(x) & ~self.missing_left[nodes]
+            nodes = children[2 * nodes + right]
+            if level % 4 == 3:
+                done = children[2 * nodes] == nodes
+                leaves[pairs[done]] = nodes[done]
+                nodes, rows, pairs = nodes[~done], rows[~done], pairs[~done]
+        leaves[pairs] = nodes
+        return leaves.reshape(n_trees, n_rows)
+
+    def apply(self, X):
+        '''
+        This function finds the leaf each row reaches in each tree.
+
+        Parameters
+        ----------
+        X: DataFrame or array
+
+        Returns
+        -------
+        int32 array of shape (rows, trees), node numbers
+        '''
+        return self._leaves(self._features(X)).T
+
+    def _raw(self, X):
+        '''
+        This function adds up (or averages) the leaf values of the trees
+        and the bias, before the link function.
+        '''
+        n_trees = len(self.roots)
+        block = max(1, MAX_PAIRS // n_trees)
+        n_out = len(self.bias)
+        out = np.empty((X.shape[0], n_out))
+        for start in range(0, X.shape[0], block):
+            leaves = self._leaves(X[start:start + block])
+            if self.tree_class is None:
+                raw = self.value[leaves].sum(axis=0, dtype=np.float64)
+            else:
+                values = self.value[leaves, 0]
+                raw = np.column_stack([
+                    values[self.tree_class == c].sum(axis=0,
+                                                     dtype=np.float64)
+                    for c in range(n_out)])
+            if self.average:
+                raw /= n_trees
+            out[start:start + block] = raw + self.bias
+        return out
+
+    def _transform(self, raw):
+        if self.link == 'sigmoid':
+            return 1 / (1 + np.exp(-raw))
+        if self.link == 'softmax':
+            raw = np.exp(raw - raw.max(axis=1, keepdims=True))
+            return raw / raw.sum(axis=1, keepdims=True)
+        if self.link == 'exp':
+            return np.exp(raw)
+        return raw
+
+    def predict_proba(self, X):
+        '''
+        This function predicts the probability of each class.
+
+        Parameters
+        ----------
+        X: DataFrame or array
+
+        Returns
+        -------
+        array of shape (rows, classes)
+        '''
+        proba = self._transform(self._raw(self._features(X)))
+        if proba.shape[1] == 1:
+            proba = np.hstack([1 - proba, proba])
+        return proba
+
+    def predict(self, X):
+        '''
+        This function predicts the target (regression) or the class.
+
+        Parameters
+        ----------
+        X: DataFrame or array
+
+        Returns
+        -------
+        array of predictions
+        '''
+        if self.classes_ is not None:
+            return self.classes_[self.predict_proba(X).argmax(axis=1)]
+        return self._transform(self._raw(self._features(X)))[:, 0]
+
+    def save(self, path):
+        '''
+        This function saves the node arrays as .npy files
+        (memory-mappable) and the rest in compiled.json.
+
+        Parameters
+        ----------
+        path: str, folder
+
+        Returns
+        -------
+        None
+        '''
+        os.makedirs(path, exist_ok=True)
+        arrays = {'feature': self.feature, 'threshold': self.threshold,
+                  'children': self.children,
+                  'missing_left': self.missing_left, 'value': self.value,
+                  'roots': self.roots}
+        if self.tree_class is not None:
+            arrays['tree_class'] = self.tree_class
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), values)
+        meta = {'depth': self.depth, 'average': self.average,
+                'bias': self.bias.tolist(), 'link': self.link,
+                'classes': None if self.classes_ is None
+                else self.classes_.tolist(),
+                'feature_names': self.feature_names}
+        with open(os.path.join(path, 'compiled.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        This function loads a saved CompiledForest.
+
+        Parameters
+        ----------
+        path: str, folder
+        mmap: boolean (default=True), memory-map the node arrays,
+              so processes scoring with the same model share them
+
+        Returns
+        -------
+        CompiledForest
+        '''
+        with open(os.path.join(path, 'compiled.json')) as f:
+            meta = json.load(f)
+
+        def load(name):
+            file = os.path.join(path, f'{name}.npy')
+            if not os.path.exists(file):
+                return None
+            return np.load(file, mmap_mode='r' if mmap else None)
+
+        classes = meta['classes']
+        return cls(load('feature'), load('threshold'), load('children'),
+                   load('missing_left'), load('value'), load('roots'),
+                   meta['depth'], meta['average'], meta['bias'],
+                   meta['link'], load('tree_class'),
+                   None if classes is None else np.array(classes),
+                   meta['feature_names'])
+
+
+def _concat_trees(trees, value_dtype):
+    '''
+    This function lays the trees out one after the other in flat arrays,
+    renumbering the children. Each tree is a dict with feature,
+    threshold, left, right (-1 at leaves), missing_left and value.
+    '''
+    sizes = [len(t['feature']) for t in trees]
+    roots = np.cumsum([0] + sizes[:-1]).astype(np.int32)
+    n_nodes = sum(sizes)
+
+    feature = np.zeros(n_nodes, dtype=np.int32)
+    threshold = np.zeros(n_nodes, dtype=np.float32)
+    children = np.empty((n_nodes, 2), dtype=np.int32)
+    missing_left = np.zeros(n_nodes, dtype=bool)
+    value = np.zeros((n_nodes, trees[0]['value'].shape[1]), dtype=value_dtype)
+    depth = 0
+    for root, t in zip(roots, trees):
+        nodes = slice(root, root + len(t['feature']))
+        own = np.arange(len(t['feature']))
+        leaf = t['left'] < 0
+        feature[nodes] = np.where(leaf, 0, t['feature'])
+        threshold[nodes] = t['threshold']
+        children[nodes, 0] = root + np.where(leaf, own, t['left'])
+        children[nodes, 1] = root + np.where(leaf, own, t['right'])
+        missing_left[nodes] = t['missing_left']
+        value[nodes] = t['value']
+        depth = max(depth, t['depth'])
+
+    return feature, threshold, children, missing_left, value, roots, depth
+
+
+def _tree_depth(left, right):
+    depth = np.zeros(len(left), dtype=int)
+    for node in range(len(left)):
+        if left[node] >= 0:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return int(depth.max())
+
+
+def _compile_sklearn(model, value_dtype):
+    trees = []
+    for estimator in _tree_models(model):
+        state = estimator.tree_.__getstate__()
+        nodes = state['nodes']
+        if state['values'].shape[1] != 1:
+            raise ValueError('Multi-output trees are not supported')
+        values = state['values'][:, 0, :].astype(np.float64)
+        if hasattr(model, 'classes_'):
+            # class fractions of the leaf, as predict_proba gives them
+            values /= values.sum(axis=1, keepdims=True)
+        trees.append({'feature': nodes['feature'],
+                      'threshold': _float32_at_most(nodes['threshold']),
+                      'left': nodes['left_child'],
+                      'right': nodes['right_child'],
+                      'missing_left': nodes['missing_go_to_left'].astype(bool)
+                      if 'missing_go_to_left' in nodes.dtype.names
+                      else np.zeros(len(nodes), dtype=bool),
+                      'value': values,
+                      'depth': state['max_depth']})
+
+    arrays = _concat_trees(trees, value_dtype)
+    classes = getattr(model, 'classes_', None)
+    n_out = arrays[4].shape[1]
+    names = getattr(model, 'feature_names_in_', None)
+    return CompiledForest(*arrays, average=True,
+                          bias=np.zeros(n_out), link='identity',
+                          classes=classes,
+                          feature_names=None if names is None
+                          else list(names))
+
+
+def _compile_xgboost(model, value_dtype):
+    booster = model if isinstance(model, xgb.Booster) else model.get_booster()
+    learner = json.loads(booster.save_raw('json'))['learner']
+    gbtree = learner['gradient_booster']
+    if gbtree['name'] != 'gbtree':
+        raise ValueError(f"Only gbtree boosters are supported, "
+                         f"not {gbtree['name']}")
+    objective = learner['objective']['name']
+    if objective.startswith('multi:'):
+        link = 'softmax'
+    elif objective in ('binary:logistic', 'reg:logistic'):
+        link = 'sigmoid'
+    elif objective in ('count:poisson', 'reg:gamma', 'reg:tweedie'):
+        link = 'exp'
+    elif objective.startswith('reg:'):
+        link = 'identity'
+    else:
+        raise ValueError(f'Objective {objective} is not supported')
+
+    tree_dicts = gbtree['model']['trees']
+    tree_info = np.array(gbtree['model']['tree_info'])
+    # the sklearn wrapper predicts with the best iteration only
+    best = booster.attr('best_iteration') \
+        if isinstance(model, xgb.XGBModel) else None
+    if best is not None:
+        best = int(best)
+        n_trees = gbtree['model']['iteration_indptr'][best + 1]
+        tree_dicts, tree_info = tree_dicts[:n_trees], tree_info[:n_trees]
+
+    trees = []
+    for t in tree_dicts:
+        if any(t['split_type']):
+            raise ValueError('Categorical splits are not supported')
+        left = np.array(t['left_children'])
+        right = np.array(t['right_children'])
+        conditions = np.array(t['split_conditions'], dtype=np.float32)
+        # XGBoost sends x < c left, which for float32 x is
+        # x <= the float32 just below c
+        threshold = np.nextafter(conditions, np.float32(-np.inf))
+        trees.append({'feature': np.array(t['split_indices']),
+                      'threshold': threshold,
+                      'left': left, 'right': right,
+                      'missing_left': np.array(t['default_left'], dtype=bool),
+                      'value': conditions.astype(np.float64)[:, None],
+                      'depth': _tree_depth(left, right)})
+
+    n_classes = int(learner['learner_model_param']['num_class'])
+    n_out = max(1, n_classes)
+    arrays = _concat_trees(trees, value_dtype)
+    classes = getattr(model, 'classes_', None)
+    names = booster.feature_names
+    compiled = CompiledForest(*arrays, average=False, bias=np.zeros(n_out),
+                              link=link,
+                              tree_class=tree_info if n_classes > 1 else None,
+                              classes=classes, feature_names=names)
+
+    # the bias (base score) is stored differently across XGBoost
+    # versions, so it is read off the margin of one row
+    probe = np.zeros((1, booster.num_features()), dtype=np.float32)
+    margin = booster.predict(xgb.DMatrix(probe, feature_names=names),
+                             output_margin=True,
+                             iteration_range=(0, best + 1) if best is not None
+                             else (0, 0))
+    compiled.bias = np.reshape(margin, -1)[:n_out].astype(np.float64) \
+        - compiled._raw(probe)[0]
+    return compiled
+
+
+def compile_model(model, quantize=False):
+    '''
+    This function compiles a fitted tree ensemble into a CompiledForest:
+    sklearn decision trees and forests (regression or classification)
+    and XGBoost tree boosters (sklearn wrapper or Booster).
+    Thresholds are stored as float32 without changing any split
+    (both libraries compare float32 features).
+
+    Parameters
+    ----------
+    model: fitted model, search object or LazyModel
+    quantize: boolean (default=False), True to store the leaf values as
+              float32 too (predictions then differ by about 1e-7
+              relative)
+
+    Returns
+    -------
+    CompiledForest
+    '''
+    model = getattr(model, 'best_estimator_', model)
+    if isinstance(model, LazyModel):
+        model = model.model
+    value_dtype = np.float32 if quantize else np.float64
+
+    if _tree_models(model) is not None:
+        return _compile_sklearn(model, value_dtype)
+    if isinstance(model, (xgb.Booster, xgb.XGBModel)):
+        return _compile_xgboost(model, value_dtype)
+    raise TypeError(f'Cannot compile a {model.__class__.__name__}')
+
+
+def load_compiled(name, registry_dir=REGISTRY_DIR, quantize=False):
+    '''
+    This function loads a registered tree model as a CompiledForest
+    with memory-mapped node arrays, so processes scoring with the same
+    model share one copy of its pages. The model is compiled and saved
+    in its folder the first time (save_model removes the copy when the
+    model is saved again).
+
+    Parameters
+    ----------
+    name: str, model name
+    registry_dir: str (default=REGISTRY_DIR)
+    quantize: boolean (default=False), see compile_model; only used
+              when the model is compiled
+
+    Returns
+    -------
+    CompiledForest
+    '''
+    path = os.path.join(registry_dir, name, COMPILED_DIR)
+    if not os.path.exists(os.path.join(path, 'compiled.json')):
+        tmp = f'{path}.{os.getpid()}.tmp'
+        compile_model(load_model(name, registry_dir), quantize).save(tmp)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another process saved it first
+            shutil.rmtree(tmp)
+
+    return CompiledForest.load(path, mmap=True)
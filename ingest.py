@@ -0,0 +1,353 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import pickle
+import argparse
+import pyarrow as pa
+from helper import clean_frame
+from pipeline import (read_plays, chunk_fill_summary, merge_fill_summaries,
+                      fill_values_from_summary)
+from storage import load_cleaned_table, frame_from_table
+from lookup import save_indexed, CleanedLookup, INDEX_COLS
+from instrumentation import instrument, stage
+
+# folder of the Season/Week partitioned store of the cleaned data
+STORE_DIR = 'Data/cleaned_store'
+
+# most distinct values kept per numerical column in the fill summary;
+# the angles (0.01 degree steps) have 36001, so the fills stay exact
+SKETCH_SIZE = 2**16
+
+
+def compress_counts(counts, max_values=SKETCH_SIZE):
+    '''
+    This function shrinks the value counts of a numerical column to
+    at most max_values entries: neighbouring values are merged into
+    buckets of about the same count, each kept at its mean value.
+    The result can be merged with other counts and compressed again,
+    and the median found from it is off by less than one bucket.
+
+    Parameters
+    ----------
+    counts: Series, value -> count
+    max_values: int (default=SKETCH_SIZE)
+
+    Returns
+    -------
+    Series, value -> count (the same counts when already small enough)
+    '''
+    if len(counts) <= max_values:
+        return counts
+    counts = counts[counts > 0].sort_index()
+    values = counts.index.values.astype(np.float64)
+    n = counts.values.sum()
+    before = counts.values.cumsum() - counts.values
+    bucket = before * max_values // n
+    weights = pd.DataFrame({'sum': values * counts.values,
+                            'count': counts.values}).groupby(bucket).sum()
+
+    return pd.Series(weights['count'].values,
+                     index=weights['sum'].values / weights['count'].values)
+
+
+def update_summary(summary, new, max_values=SKETCH_SIZE):
+    '''
+    This function adds the summary of a new batch to the running
+    summary of the store, keeping the numerical counts bounded.
+
+    Parameters
+    ----------
+    summary: dict (or None for an empty store), from chunk_fill_summary
+    new: dict, summary of the new rows
+    max_values: int (default=SKETCH_SIZE), see compress_counts
+
+    Returns
+    -------
+    dict, combined summary
+    '''
+    merged = new if summary is None else merge_fill_summaries(summary, new)
+    for col, (has_nulls, is_obj, counts) in merged.items():
+        if not is_obj:
+            merged[col] = (has_nulls, is_obj,
+                           compress_counts(counts, max_values))
+
+    return merged
+
+
+def _json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def load_state(store_dir=STORE_DIR):
+    '''
+    This function reads the manifest and the fill summary of a store.
+
+    Parameters
+    ----------
+    store_dir: str (default=STORE_DIR)
+
+    Returns
+    -------
+    manifest dict (games, parts, batches), summary dict or None
+    '''
+    manifest = {'games': {}, 'parts': [], 'batches': 0}
+    summary = None
+    if os.path.exists(os.path.join(store_dir, 'manifest.json')):
+        with open(os.path.join(store_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+        with open(os.path.join(store_dir, 'summary.pkl'), 'rb') as f:
+            summary = pickle.load(f)
+
+    return manifest, summary
+
+
+def _save_state(store_dir, manifest, summary):
+    '''
+    This function replaces the manifest and the summary of a store.
+    The manifest is written last: parts written by an ingest that
+    did not finish are never listed, so they are never read.
+    '''
+    path = os.path.join(store_dir, 'summary.pkl')
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(summary, f)
+    os.replace(path + '.tmp', path)
+
+    path = os.path.join(store_dir, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def _new_rows(make_chunks, known):
+    '''
+    This function drops the rows of games already in the store.
+    '''
+    for chunk in make_chunks():
+        chunk = chunk[~chunk['GameId'].isin(known)]
+        if len(chunk):
+            yield chunk
+
+
+def _write_part(store_dir, season, week, name, frames):
+    '''
+    This function writes the cleaned rows of one partition from one
+    ingest as a pair of Feather files (training data and IDs),
+    with the index of the IDs.
+    '''
+    folder = os.path.join(f'Season={season}', f'Week={week}')
+    os.makedirs(os.path.join(store_dir, folder), exist_ok=True)
+    df = pd.concat([df for df, _ in frames], ignore_index=True)
+    df_id = pd.concat([df_id for _, df_id in frames], ignore_index=True)
+    path = os.path.join(folder, name)
+    with stage('write_part', rows_in=len(df)):
+        save_indexed(df, df_id, os.path.join(store_dir, path + '.feather'))
+
+    return {'season': str(season), 'week': int(week), 'file': path,
+            'rows': len(df), 'games': df_id['GameId'].unique().tolist()}
+
+
+@instrument
+def ingest_games(raw, store_dir=STORE_DIR, chunksize=100000,
+                 max_values=SKETCH_SIZE, verbose=True):
+    '''
+    This function cleans the games of the raw data that are not in the
+    store yet and adds them to it, partitioned by Season and Week.
+    The null fill values come from the store's summary merged with the
+    new games (the same values cleaning everything at once would use),
+    so the cost of an ingest follows the new games, not the history.
+    Rows already in the store keep the fills they were cleaned with;
+    every part records them in the manifest.
+
+    Parameters
+    ----------
+    raw: str or DataFrame, raw data (train.csv schema), e.g. one week
+         of games; games are ingested whole, so a game already in the
+         store is skipped
+    store_dir: str (default=STORE_DIR), folder of the store
+    chunksize: int (default=100000), rows read at a time from a file
+    max_values: int (default=SKETCH_SIZE), see compress_counts
+    verbose: boolean (default=True), print what was added
+
+    Returns
+    -------
+    DataFrame with the season, week, file, rows and games of the new parts
+    '''
+    if isinstance(raw, pd.DataFrame):
+        make_chunks = lambda: [raw]
+    else:
+        make_chunks = lambda: read_plays(raw, chunksize)
+
+    manifest, summary = load_state(store_dir)
+    known = [int(game) for game in manifest['games']]
+
+    # first pass: the summary of the new games gives the fills
+    new = None
+    for chunk in _new_rows(make_chunks, known):
+        chunk_summary = chunk_fill_summary(chunk)
+        new = (chunk_summary if new is None
+               else merge_fill_summaries(new, chunk_summary))
+    if new is None:
+        if verbose:
+            print('No new games')
+        return pd.DataFrame(columns=['season', 'week', 'file', 'rows',
+                                     'games'])
+    summary = update_summary(summary, new, max_values)
+    fills = fill_values_from_summary(summary)
+
+    # second pass: clean and write each Season/Week partition as soon
+    # as the chunks move past it (the raw data is ordered by game)
+    batch = manifest['batches']
+    parts = []
+    pending = {}
+
+    def flush(keys):
+        for key in keys:
+            name = f'part-{batch:05d}-{len(parts):04d}'
+            parts.append(_write_part(store_dir, *key, name, pending.pop(key)))
+
+    for chunk in _new_rows(make_chunks, known):
+        df, df_id = clean_frame(chunk, fills)
+        groups = df.groupby(['Season', 'Week'], sort=False).indices
+        for key, rows in groups.items():
+            pending.setdefault(key, []).append((df.iloc[rows],
+                                                df_id.iloc[rows]))
+        flush([key for key in list(pending) if key not in groups])
+    flush(list(pending))
+
+    fills = {col: _json_value(value) for col, value in fills.items()}
+    for part in parts:
+        for game in part['games']:
+            manifest['games'][str(game)] = part['file']
+        manifest['parts'].append({**part, 'games': len(part['games']),
+                                  'fills': fills})
+    manifest['batches'] = batch + 1
+    _save_state(store_dir, manifest, summary)
+
+    added = pd.DataFrame(parts)
+    added['games'] = added['games'].map(len)
+    if verbose:
+        print(f'Added {added["games"].sum()} games, '
+              f'{added["rows"].sum()} rows in {len(added)} parts')
+    return added
+
+
+def store_parts(store_dir=STORE_DIR, seasons=None, weeks=None):
+    '''
+    This function lists the parts of the store, optionally only
+    those of some seasons and weeks.
+
+    Parameters
+    ----------
+    store_dir: str (default=STORE_DIR)
+    seasons: list (default=None), seasons to keep; all when None
+    weeks: list (default=None), weeks to keep; all when None
+
+    Returns
+    -------
+    DataFrame with one row per part (season, week, file, rows, games, fills)
+    '''
+    parts = pd.DataFrame(load_state(store_dir)[0]['parts'],
+                         columns=['season', 'week', 'file', 'rows',
+                                  'games', 'fills'])
+    if seasons is not None:
+        parts = parts[parts['season'].isin([str(s) for s in seasons])]
+    if weeks is not None:
+        parts = parts[parts['week'].isin([int(w) for w in weeks])]
+
+    return parts.reset_index(drop=True)
+
+
+def load_store_table(store_dir=STORE_DIR, columns=None, seasons=None,
+                     weeks=None, ids=False):
+    '''
+    This function memory-maps the parts of the store as one Arrow table,
+    reading only the partitions and columns asked for.
+
+    Parameters
+    ----------
+    store_dir: str (default=STORE_DIR)
+    columns: list (default=None), columns to read; all when None
+    seasons: list (default=None), seasons to read; all when None
+    weeks: list (default=None), weeks to read; all when None
+    ids: boolean (default=False), True for the ID columns
+         (GameId, PlayId, NflId, DisplayName, ...) instead of the
+         training data
+
+    Returns
+    -------
+    pyarrow Table
+    '''
+    suffix = '_id.feather' if ids else '.feather'
+    tables = [load_cleaned_table(os.path.join(store_dir, file + suffix),
+                                 columns)
+              for file in store_parts(store_dir, seasons, weeks)['file']]
+    if not tables:
+        raise ValueError(f'no parts in {store_dir} for these seasons/weeks')
+    # compact dtypes can differ between parts (e.g. int8 and float32)
+    return pa.concat_tables(tables, promote_options='permissive')
+
+
+def load_store(store_dir=STORE_DIR, columns=None, seasons=None, weeks=None,
+               ids=False, categorical=True):
+    '''
+    This function loads the cleaned data of the store into a DataFrame.
+
+    Parameters
+    ----------
+    store_dir: str (default=STORE_DIR)
+    columns: list (default=None), columns to read; all when None
+    seasons: list (default=None), seasons to read; all when None
+    weeks: list (default=None), weeks to read; all when None
+    ids: boolean (default=False), True for the ID columns
+    categorical: boolean (default=True), False to turn categoricals
+                 back into object columns, as read from the csv
+
+    Returns
+    -------
+    DataFrame
+    '''
+    return frame_from_table(load_store_table(store_dir, columns, seasons,
+                                             weeks, ids), categorical)
+
+
+def store_lookup(store_dir=STORE_DIR, seasons=None, weeks=None,
+                 columns=INDEX_COLS):
+    '''
+    This function opens the parts of the store for lookups by
+    GameId, PlayId, NflId or DisplayName.
+
+    Parameters
+    ----------
+    store_dir: str (default=STORE_DIR)
+    seasons: list (default=None), seasons to open; all when None
+    weeks: list (default=None), weeks to open; all when None
+    columns: list (default=INDEX_COLS), indexed columns to load
+
+    Returns
+    -------
+    CleanedLookup
+    '''
+    parts = store_parts(store_dir, seasons, weeks)['file']
+    return CleanedLookup([os.path.join(store_dir, file + '.feather')
+                          for file in parts], columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Clean new games and add them to the Season/Week '
+                    'partitioned store.')
+    parser.add_argument('raw', nargs='+',
+                        help='raw csv files (train.csv schema)')
+    parser.add_argument('--store', default=STORE_DIR)
+    parser.add_argument('--chunksize', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    for path in args.raw:
+        ingest_games(path, args.store, args.chunksize)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+import pandas as pd
+import numpy as np
+import os
+import pyarrow as pa
+from storage import save_cleaned, load_cleaned_table, frame_from_table
+from instrumentation import instrument
+
+# ID columns indexed when the cleaned data is saved
+INDEX_COLS = ['GameId', 'PlayId', 'NflId', 'DisplayName']
+
+
+def id_path(path):
+    '''
+    This function gives the path of the ID table saved next to
+    the cleaned data (e.g. Data/cleaned_nfl_id.feather).
+    '''
+    return os.path.splitext(path)[0] + '_id.feather'
+
+
+def index_path(path):
+    '''
+    This function gives the folder of the index saved next to
+    the cleaned data (e.g. Data/cleaned_nfl_index).
+    '''
+    return os.path.splitext(path)[0] + '_index'
+
+
+@instrument
+def build_index(df_id, columns=INDEX_COLS):
+    '''
+    This function indexes the rows of the ID table by key.
+    For every column, the distinct keys are sorted and each one points
+    to a range of an array of row positions (in file order within a key),
+    so the rows of a key are found with a binary search.
+
+    Parameters
+    ----------
+    df_id: DataFrame for ID purposes (from clean_frame)
+    columns: list (default=INDEX_COLS), columns to index
+
+    Returns
+    -------
+    dict, column name -> (sorted keys, offsets, row positions)
+    '''
+    index = {}
+    for col in columns:
+        values = df_id[col].values
+        if values.dtype == object:
+            values = values.astype(str)
+        rows = np.argsort(values, kind='stable')
+        keys, counts = np.unique(values[rows], return_counts=True)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        index[col] = (keys, offsets, rows.astype(np.int64))
+
+    return index
+
+
+def save_index(index, folder):
+    '''
+    This function saves an index as .npy files that can be memory-mapped.
+
+    Parameters
+    ----------
+    index: dict, from build_index
+    folder: str
+
+    Returns
+    -------
+    None
+    '''
+    os.makedirs(folder, exist_ok=True)
+    for col, arrays in index.items():
+        for name, array in zip(['keys', 'offsets', 'rows'], arrays):
+            np.save(os.path.join(folder, f'{col}_{name}.npy'), array)
+
+
+def load_index(folder, columns=INDEX_COLS, mmap=True):
+    '''
+    This function loads an index saved with save_index.
+
+    Parameters
+    ----------
+    folder: str
+    columns: list (default=INDEX_COLS), indexed columns to load
+    mmap: boolean (default=True), memory-map the arrays instead of
+          reading them
+
+    Returns
+    -------
+    dict, column name -> (sorted keys, offsets, row positions)
+    '''
+    mmap_mode = 'r' if mmap else None
+    return {col: tuple(np.load(os.path.join(folder, f'{col}_{name}.npy'),
+                               mmap_mode=mmap_mode)
+                       for name in ['keys', 'offsets', 'rows'])
+            for col in columns}
+
+
+def find_rows(index, column, values):
+    '''
+    This function finds the row positions of one or more keys.
+
+    Parameters
+    ----------
+    index: dict, from build_index/load_index
+    column: str, indexed column
+    values: key or list of keys
+
+    Returns
+    -------
+    array of row positions, in file order for each key
+    (empty when no key is found)
+    '''
+    keys, offsets, rows = index[column]
+    values = np.atleast_1d(np.asarray(values))
+    pos = np.searchsorted(keys, values)
+    found = pos < len(keys)
+    found[found] = keys[pos[found]] == values[found]
+    pos = pos[found]
+    if not len(pos):
+        return np.empty(0, dtype=np.int64)
+
+    return np.concatenate([rows[offsets[i]:offsets[i + 1]] for i in pos])
+
+
+def _take(table, rows):
+    '''
+    This function takes sorted rows of a table batch by batch:
+    Table.take on a table of several batches rebuilds the dictionaries
+    of the categorical columns, which is much slower.
+    '''
+    batches = table.to_batches()
+    offsets = np.cumsum([0] + [batch.num_rows for batch in batches])
+    cuts = np.searchsorted(rows, offsets)
+    taken = [batch.take(rows[cuts[i]:cuts[i + 1]] - offsets[i])
+             for i, batch in enumerate(batches) if cuts[i + 1] > cuts[i]]
+
+    return pa.Table.from_batches(taken, schema=table.schema)
+
+
+def _decode(table):
+    '''
+    This function turns the dictionary-encoded columns of a table
+    back into plain strings, which converts to pandas faster than
+    building categoricals.
+    '''
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(
+                i, field.name, table.column(i).cast(field.type.value_type))
+
+    return table
+
+
+@instrument
+def save_indexed(df, df_id, path='Data/cleaned_nfl.feather',
+                 columns=INDEX_COLS):
+    '''
+    This function saves the cleaned data, its ID table and the index
+    of the ID table (see build_index) side by side.
+    Rows of the two tables line up, so a row found in the index
+    is at the same position in both.
+
+    Parameters
+    ----------
+    df: DataFrame used for training (from clean_frame)
+    df_id: DataFrame for ID purposes, with the same rows
+    path: str (default='Data/cleaned_nfl.feather'), path of the cleaned
+          data; the ID table and the index get id_path and index_path
+    columns: list (default=INDEX_COLS), columns to index
+
+    Returns
+    -------
+    None
+    '''
+    if len(df) != len(df_id):
+        raise ValueError(f'{len(df)} cleaned rows but {len(df_id)} ID rows')
+    save_cleaned(df, path)
+    save_cleaned(df_id, id_path(path))
+    save_index(build_index(df_id, columns), index_path(path))
+
+
+class CleanedLookup:
+    '''
+    This class finds rows of the cleaned data by GameId, PlayId, NflId
+    or DisplayName without scanning it, and joins the ID columns to
+    the training columns.
+    The tables and the indexes are memory-mapped, so only the rows
+    asked for are read.
+
+    Parameters
+    ----------
+    paths: list, paths of cleaned data saved with save_indexed
+           (e.g. the parts of the store)
+    columns: list (default=INDEX_COLS), indexed columns to load
+    '''
+    def __init__(self, paths, columns=INDEX_COLS):
+        self.paths = list(paths)
+        self.tables = [load_cleaned_table(path) for path in self.paths]
+        self.id_tables = [load_cleaned_table(id_path(path))
+                          for path in self.paths]
+        self.indexes = [load_index(index_path(path), columns)
+                        for path in self.paths]
+
+    def rows(self, column, values):
+        '''
+        This function finds the rows of some keys in every part.
+
+        Parameters
+        ----------
+        column: str, indexed column
+        values: key or list of keys
+
+        Returns
+        -------
+        list of (part number, array of row positions) for the parts
+        holding a key
+        '''
+        found = [(i, find_rows(index, column, values))
+                 for i, index in enumerate(self.indexes)]
+        return [(i, rows) for i, rows in found if len(rows)]
+
+    def frame(self, column, values, columns=None, id_columns=None,
+              categorical=False):
+        '''
+        This function gets the rows of some keys with their ID columns
+        joined to the training columns.
+
+        Parameters
+        ----------
+        column: str, indexed column
+        values: key or list of keys
+        columns: list (default=None), training columns; all when None
+        id_columns: list (default=None), ID columns; all when None
+                    (ID columns also in the training data are kept once)
+        categorical: boolean (default=False), True to keep the text
+                     columns as categoricals
+
+        Returns
+        -------
+        DataFrame in file order (empty when no key is found)
+        '''
+        tables = []
+        for i, rows in self.rows(column, values):
+            rows = np.sort(rows)
+            table = self.tables[i]
+            ids = self.id_tables[i]
+            if columns is not None:
+                table = table.select(columns)
+            id_cols = ids.column_names if id_columns is None else id_columns
+            table = _take(table, rows)
+            ids = _take(ids.select([col for col in id_cols
+                                    if col not in table.column_names]), rows)
+            for col in ids.column_names:
+                table = table.append_column(col, ids[col])
+            tables.append(table)
+        if not tables:
+            return pd.DataFrame()
+
+        table = pa.concat_tables(tables, promote_options='permissive')
+        if categorical:
+            return frame_from_table(table)
+        return _decode(table).to_pandas()
+
+    def play(self, play_id, **params):
+        '''
+        This function gets the rows of one or more plays.
+        params are passed to frame (columns, id_columns, categorical).
+        '''
+        return self.frame('PlayId', play_id, **params)
+
+    def game(self, game_id, **params):
+        '''
+        This function gets the rows of one or more games.
+        params are passed to frame (columns, id_columns, categorical).
+        '''
+        return self.frame('GameId', game_id, **params)
+
+    def player(self, nfl_id=None, name=None, **params):
+        '''
+        This function gets the rows of one or more players,
+        by NflId or by DisplayName.
+        params are passed to frame (columns, id_columns, categorical).
+        '''
+        if nfl_id is not None:
+            return self.frame('NflId', nfl_id, **params)
+        return self.frame('DisplayName', name, **params)
+
+
+def open_cleaned(path='Data/cleaned_nfl.feather', columns=INDEX_COLS):
+    '''
+    This function opens cleaned data saved with save_indexed for lookups.
+
+    Parameters
+    ----------
+    path: str (default='Data/cleaned_nfl.feather')
+    columns: list (default=INDEX_COLS), indexed columns to load
+
+    Returns
+    -------
+    CleanedLookup
+    '''
+    return CleanedLookup([path], columns)
@@ -7,11 +7,128 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 # from sklearn.neighbors import KNeighborsClassifier
 # from sklearn.SVM import SVC
+from sklearn.model_selection import ParameterSampler, check_cv
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import get_scorer
+from joblib import Parallel, delayed
+import scipy.sparse as sp
+from scipy import stats
+from statsmodels.iolib.summary import summary_params
 import catboost as cb
 import pickle
+from scheduler import split_cores, set_n_threads
+from registry import save_model
+from pipeline import frame_fingerprint
+from instrumentation import instrument, stage
+import json
+import math
+import hashlib
+import time
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager, nullcontext
 
+# folder of the shared training matrices: /dev/shm is in RAM on Linux
+SHARED_DIR = '/dev/shm'
+# share of each training fold kept aside for early stopping
+EARLY_STOPPING_SHARE = 0.1
+
+
+@contextmanager
+def shared_frame(X, dtype=np.float64, folder=SHARED_DIR):
+    '''
+    This function copies a numeric DataFrame once into one contiguous
+    array in a memory-mapped file and gives back a DataFrame over it:
+
+        with shared_frame(X_train) as X_cv:
+            rs.fit(X_cv, y_train)
+
+    joblib sends memory-mapped arrays to its workers as a file
+    reference, so every CV worker reads the same pages instead of
+    unpickling its own copy of the data. Each fit still copies
+    its own fold, as the estimators need it in one array.
+    Numeric columns of any dtype are shared (nullable ones with NaN
+    for their missing values); data that cannot be shared this way
+    (text or category columns, sparse matrices) is given back unchanged.
+    The file is deleted when the with block ends.
+
+    Parameters
+    ----------
+    X: DataFrame or array
+    dtype: numpy dtype (default=np.float64)
+    folder: str (default=SHARED_DIR), folder of the file; the system
+            temporary folder when it does not exist or lacks space
+
+    Returns
+    -------
+    context manager giving a DataFrame backed by the shared array
+    '''
+    dtypes = X.dtypes if hasattr(X, 'dtypes') else [X.dtype]
+    if (sp.issparse(X)
+            or not all(pd.api.types.is_numeric_dtype(d) for d in dtypes)):
+        yield X
+        return
+
+    n_rows, n_cols = X.shape
+    nbytes = n_rows * n_cols * np.dtype(dtype).itemsize
+    if not (os.path.isdir(folder)
+            and shutil.disk_usage(folder).free > 2 * nbytes):
+        folder = None
+    fd, path = tempfile.mkstemp(suffix='.mmap', dir=folder)
+    os.close(fd)
+    try:
+        if hasattr(X, 'columns'):
+            # pandas keeps a 2D block as columns x rows, so the file is
+            # laid out that way: the block is then the memmap itself,
+            # which joblib can hand over (it mishandles transposed views)
+            values = np.memmap(path, dtype=dtype, mode='w+',
+                               shape=(n_cols, n_rows)).T
+        else:
+            values = np.memmap(path, dtype=dtype, mode='w+',
+                               shape=(n_rows, n_cols))
+        # filled in blocks of rows, so only one block is ever copied
+        block = max(1, 2**24 // n_cols)
+        for start in range(0, n_rows, block):
+            rows = slice(start, start + block)
+            part = _take(X, rows)
+            if hasattr(part, 'columns'):
+                # nullable columns (Int64, Float64) hold pd.NA
+                values[rows] = part.to_numpy(dtype, na_value=np.nan)
+            else:
+                values[rows] = np.asarray(part, dtype=dtype)
+        values.flush()
+        if hasattr(X, 'columns'):
+            yield pd.DataFrame(values, index=X.index, columns=X.columns,
+                               copy=False)
+        else:
+            yield values
+    finally:
+        os.remove(path)
+
+
+def _refit_best(rs, X, y, n_cores=None, **fit_params):
+    '''
+    This function refits the best candidate of a RandomizedSearchCV run
+    with refit=False on the whole train set, as refit=True would,
+    but with all n_cores threads: during the search the model being
+    searched only had its share of the cores.
+    '''
+    best = clone(rs.estimator).set_params(**rs.best_params_)
+    set_n_threads(best, n_cores or os.cpu_count())
+    start = time.time()
+    rs.best_estimator_ = best.fit(X, y, **fit_params)
+    rs.refit_time_ = time.time() - start
+    # score and predict now go to best_estimator_
+    rs.refit = True
+    return rs
+
+
+@instrument
 def run_randomized_search(model, model_name, params, X_train, X_test,
-                          y_train, y_test, cat_feats=None):
+                          y_train, y_test, cat_feats=None, n_cores=None,
+                          halving=False, preprocessor=None,
+                          **halving_params):
 
     '''
     This function runs Randomized Search with various models.
@@ -27,41 +144,88 @@ def run_randomized_search(model, model_name, params, X_train, X_test,
     y_train: DataFrame, train set of target values
     y_test: DataFrame, test set of target values
     random_state: int
+    n_cores: int (default=None), cores shared between the CV fits
+             and the threads of each model; all when None
+    halving: boolean (default=False), True to run halving_search
+             instead of a full RandomizedSearchCV
+    preprocessor: fitted NFLPreprocessor (default=None), the one that
+                  made X_train, registered with the model
+    halving_params: passed to halving_search
+                    (e.g. n_candidates, resource, early_stopping_rounds)
 
     Returns
     --------
     Model with the best hyperparameters, train score, and test score.
     '''
 
-    if model == cb.CatBoostClassifier:
-        rs = RandomizedSearchCV(estimator=model(loss_function='MultiClass',
-                                                random_state=220),
+    if halving:
+        if model == cb.CatBoostClassifier:
+            estimator = model(loss_function='MultiClass', random_state=220,
+                              verbose=False)
+            fit_params = {'cat_features': cat_feats}
+        else:
+            estimator = model(random_state=220)
+            fit_params = {}
+        rs = halving_search(estimator, params, X_train, y_train, model_name,
+                            fit_params=fit_params, n_cores=n_cores,
+                            **halving_params)
+        mod = rs
+
+    elif model == cb.CatBoostClassifier:
+        # 10 candidates x 5 folds fit in parallel
+        n_jobs, n_threads = split_cores(n_cores or os.cpu_count(), 50)
+        estimator = model(loss_function='MultiClass', random_state=220)
+        rs = RandomizedSearchCV(estimator=set_n_threads(estimator, n_threads),
                                 param_distributions=params,
                                 scoring='accuracy',
-                                cv=5, verbose=1, n_jobs=-1)
+                                cv=5, verbose=1, n_jobs=n_jobs,
+                                refit=False)
 
-        mod = rs.fit(X_train, y_train, cat_features=cat_feats)
+        # text columns given as cat_features cannot be shared as numbers
+        shared = (shared_frame(X_train) if cat_feats is None
+                  else nullcontext(X_train))
+        with stage('cv_fit', rows_in=len(X_train)), shared as X_cv:
+            rs.fit(X_cv, y_train, cat_features=cat_feats)
+        with stage('refit', rows_in=len(X_train)):
+            mod = _refit_best(rs, X_train, y_train, n_cores,
+                              cat_features=cat_feats)
 
     else:
-        rs = RandomizedSearchCV(estimator=model(random_state=220),
+        n_jobs, n_threads = split_cores(n_cores or os.cpu_count(), 50)
+        estimator = model(random_state=220)
+        rs = RandomizedSearchCV(estimator=set_n_threads(estimator, n_threads),
                                 param_distributions=params,
                                 scoring='accuracy',
-                                cv=5, verbose=1, n_jobs=-1)
+                                cv=5, verbose=1, n_jobs=n_jobs,
+                                refit=False)
 
-        mod = rs.fit(X_train, y_train)
+        with stage('cv_fit', rows_in=len(X_train)), \
+                shared_frame(X_train) as X_cv:
+            rs.fit(X_cv, y_train)
+        with stage('refit', rows_in=len(X_train)):
+            mod = _refit_best(rs, X_train, y_train, n_cores)
 
-    pickle.dump(mod, open(f'Models/{model_name}.sav', 'wb'))
+    with stage('test_score', rows_in=len(X_test)):
+        test_score = rs.score(X_test, y_test)
+    with stage('save_model'):
+        save_model(rs, model_name, feature_names=list(X_train.columns),
+                   scores={'train': rs.best_score_, 'test': test_score},
+                   preprocessor=preprocessor)
 
     print('Best params:', rs.best_params_)
     print('Train score: %.3f' % rs.best_score_)
-    print('Test score: %.3f' % rs.score(X_test, y_test))
+    print('Test score: %.3f' % test_score)
 
     return mod
 
 
+@instrument
 def run_randomized_search_scaled(model, model_name, params,
                                  X_train_scale, X_test_scale,
-                                 y_train, y_test, random_state=None):
+                                 y_train, y_test, random_state=None,
+                                 n_cores=None, halving=False,
+                                 feature_names=None, preprocessor=None,
+                                 **halving_params):
     '''
     This function runs Randomized Search with standardized data.
 
@@ -71,23 +235,40 @@ def run_randomized_search_scaled(model, model_name, params,
     (e.g. LogisticRegression, KNeighborsClassifier, SVC)
     model_name: str, model name as a string
     params: dict, different parameters
-    X_train_scale: DataFrame, scaled train set of variables
-    X_test_scale: DataFrame, scaled test set of variables
+    X_train_scale: DataFrame or CSR matrix, scaled train set of variables
+                   (see NumericScaler for sparse one-hot data)
+    X_test_scale: DataFrame or CSR matrix, scaled test set of variables
     y_train: DataFrame, train set of target values
     y_test: DataFrame, test set of target values
     random_state: int
+    n_cores: int (default=None), cores shared between the CV fits
+             and the threads of each model; all when None
+    halving: boolean (default=False), True to run halving_search
+             instead of a full RandomizedSearchCV
+    feature_names: list (default=None), names of the columns, needed
+                   for the registry when X_train_scale is a CSR matrix
+    preprocessor: fitted NFLPreprocessor (default=None), the one that
+                  made the data before scaling, registered with the model
+    halving_params: passed to halving_search
 
     Returns
     --------
     Model with the best hyperparameters, train score, and test score.
     '''
     # if model == LogisticRegression:
-    rs = RandomizedSearchCV(estimator=model(solver='saga',
-                                            multi_class='multinomial',
-                                            random_state=random_state),
-                            param_distributions=params,
-                            scoring='accuracy',
-                            cv=5, verbose=1, n_jobs=-1)
+    estimator = model(solver='saga',
+                      multi_class='multinomial',
+                      random_state=random_state)
+    if halving:
+        rs = halving_search(estimator, params, X_train_scale, y_train,
+                            model_name, n_cores=n_cores, **halving_params)
+    else:
+        n_jobs, n_threads = split_cores(n_cores or os.cpu_count(), 50)
+        rs = RandomizedSearchCV(estimator=set_n_threads(estimator, n_threads),
+                                param_distributions=params,
+                                scoring='accuracy',
+                                cv=5, verbose=1, n_jobs=n_jobs,
+                                refit=False)
 
     # elif model == SVC:
     #     rs = RandomizedSearchCV(estimator=SVC(probability=True,
@@ -103,12 +284,410 @@ def run_randomized_search_scaled(model, model_name, params,
     #                             scoring='accuracy',
     #                             cv=5, verbose=1, n_jobs=-1)
 
-    mod = rs.fit(X_train_scale, y_train)
+    if halving:
+        mod = rs
+    else:
+        with stage('cv_fit', rows_in=X_train_scale.shape[0]), \
+                shared_frame(X_train_scale) as X_cv:
+            rs.fit(X_cv, y_train)
+        with stage('refit', rows_in=X_train_scale.shape[0]):
+            mod = _refit_best(rs, X_train_scale, y_train, n_cores)
 
-    pickle.dump(mod, open(f'Models/{model_name}.sav', 'wb'))
+    with stage('test_score', rows_in=X_test_scale.shape[0]):
+        test_score = rs.score(X_test_scale, y_test)
+    if feature_names is None and hasattr(X_train_scale, 'columns'):
+        feature_names = list(X_train_scale.columns)
+    with stage('save_model'):
+        save_model(rs, model_name, feature_names=feature_names,
+                   scores={'train': rs.best_score_, 'test': test_score},
+                   preprocessor=preprocessor)
 
     print('Best params:', rs.best_params_)
     print('Train score: %.3f' % rs.best_score_)
-    print('Test score: %.3f' % rs.score(X_test_scale, y_test))
+    print('Test score: %.3f' % test_score)
 
     return mod
+
+
+class SearchResult:
+    '''
+    This class holds the outcome of halving_search.
+    Like a fitted RandomizedSearchCV, it has best_params_, best_score_,
+    best_estimator_ and cv_results_, and scores/predicts with the best
+    estimator.
+    '''
+    def __init__(self, best_estimator, best_params, best_score,
+                 cv_results, scoring='accuracy'):
+        self.best_estimator_ = best_estimator
+        self.best_params_ = best_params
+        self.best_score_ = best_score
+        self.cv_results_ = cv_results
+        self.scoring = scoring
+
+    def score(self, X, y):
+        return get_scorer(self.scoring)(self.best_estimator_, X, y)
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+
+def _take(X, rows):
+    '''
+    This function selects rows by position from a DataFrame,
+    Series, array or sparse matrix.
+    '''
+    if hasattr(X, 'iloc'):
+        return X.iloc[rows]
+    return X[rows]
+
+
+def _hash_array(digest, values):
+    if hasattr(values, 'iloc'):
+        digest.update(frame_fingerprint(pd.DataFrame(values)).encode())
+    elif sp.issparse(values):
+        values = values.tocsr()
+        for part in (values.data, values.indices, values.indptr):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        digest.update(repr(values.shape).encode())
+    else:
+        values = np.asarray(values)
+        digest.update(np.ascontiguousarray(values).tobytes())
+        digest.update(repr((values.shape, str(values.dtype))).encode())
+
+
+def data_fingerprint(X, y=None):
+    '''
+    This function hashes the content of the features and the target.
+
+    Parameters
+    ----------
+    X: DataFrame, array or sparse matrix
+    y: Series or array (default=None)
+
+    Returns
+    -------
+    str, hex digest
+    '''
+    digest = hashlib.sha256()
+    _hash_array(digest, X)
+    if y is not None:
+        _hash_array(digest, y)
+    return digest.hexdigest()
+
+
+def _is_boosted(estimator):
+    return estimator.__class__.__module__.split('.')[0] in ('catboost',
+                                                            'xgboost')
+
+
+@instrument
+def _fit_and_score(estimator, X, y, train, test, scoring,
+                   fit_params, early_stopping_rounds, random_state=220):
+    '''
+    This function fits one CV fold and scores it on the held-out part.
+    Boosted models stop early when early_stopping_rounds is given,
+    on a share of the training part (EARLY_STOPPING_SHARE) kept out
+    of the fit, so the held-out part is never seen before scoring.
+    '''
+    X_te, y_te = _take(X, test), _take(y, test)
+    fit_params = dict(fit_params)
+    if early_stopping_rounds and _is_boosted(estimator):
+        train, stop = train_test_split(train, test_size=EARLY_STOPPING_SHARE,
+                                       random_state=random_state)
+        eval_set = (_take(X, stop), _take(y, stop))
+        if estimator.__class__.__module__.startswith('catboost'):
+            fit_params['early_stopping_rounds'] = early_stopping_rounds
+            fit_params['eval_set'] = eval_set
+        else:
+            estimator.set_params(early_stopping_rounds=early_stopping_rounds)
+            fit_params['eval_set'] = [eval_set]
+            fit_params['verbose'] = False
+    estimator.fit(_take(X, train), _take(y, train), **fit_params)
+
+    return get_scorer(scoring)(estimator, X_te, y_te)
+
+
+def _load_trials(path):
+    trials = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                trial = json.loads(line)
+                trials[(trial.get('run'), trial['round'],
+                        trial['candidate'])] = trial
+    return trials
+
+
+def _search_key(estimator, X, y, fit_params, **settings):
+    '''
+    This function identifies a search run: the data, the model and
+    every setting that changes the candidates, the budgets or the scores.
+    Saved trials are only reused by a run with the same key.
+    '''
+    digest = hashlib.sha256(data_fingerprint(X, y).encode())
+    digest.update(type(estimator).__name__.encode())
+    digest.update(repr(sorted(estimator.get_params(deep=False).items()))
+                  .encode())
+    digest.update(repr(sorted(fit_params.items())).encode())
+    digest.update(repr(sorted(settings.items())).encode())
+    return digest.hexdigest()
+
+
+@instrument
+def halving_search(estimator, params, X_train, y_train, model_name,
+                   fit_params=None, n_candidates=27, factor=3,
+                   resource='n_samples', max_resources=None,
+                   early_stopping_rounds=None, scoring='accuracy',
+                   cv=5, n_cores=None, random_state=220, verbose=1):
+    '''
+    This function runs a randomized search with successive halving:
+    all candidates are cross-validated on a small budget (a share of
+    the rows, or of the trees/iterations), then only the best
+    1/factor of them move on to a budget factor times larger,
+    until the last round uses the full budget.
+    Every finished trial is saved to Models/{model_name}_trials.jsonl,
+    so a search that stopped halfway resumes where it left off;
+    trials are only reused by a search on the same data with the same
+    model and settings.
+
+    Parameters
+    ----------
+    estimator: unfitted model
+    params: dict, different parameters
+    X_train: DataFrame or sparse matrix, train set of variables
+    y_train: DataFrame, train set of target values
+    model_name: str, model name as a string
+    fit_params: dict (default=None), passed to fit (e.g. cat_features)
+    n_candidates: int (default=27), number of parameter sets sampled
+    factor: int (default=3), share of candidates kept after each round
+    resource: str (default='n_samples'), 'n_samples' to grow the rows,
+              or the name of a model parameter (e.g. 'n_estimators',
+              'iterations') to grow
+    max_resources: int (default=None), full budget of that parameter,
+                   required unless resource is 'n_samples'
+    early_stopping_rounds: int (default=None), early stopping
+                           for CatBoost and XGBoost models
+    scoring: str (default='accuracy')
+    cv: int (default=5), number of folds
+    n_cores: int (default=None), cores shared between the folds fitted
+             in parallel and the threads of each model; all when None
+             (the best model is refitted with all of them)
+    random_state: int (default=220)
+    verbose: int (default=1)
+
+    Returns
+    --------
+    SearchResult with the best model refitted on the whole train set
+    '''
+    fit_params = fit_params or {}
+    if resource == 'n_samples':
+        max_resources = X_train.shape[0]
+    elif max_resources is None:
+        raise ValueError('max_resources is needed when resource is '
+                         'a model parameter')
+
+    candidates = list(ParameterSampler(params, n_candidates,
+                                       random_state=random_state))
+    n_rounds = max(1, math.ceil(math.log(len(candidates), factor)))
+    rows = np.random.RandomState(random_state).permutation(X_train.shape[0])
+
+    trials_path = f'Models/{model_name}_trials.jsonl'
+    trials = _load_trials(trials_path)
+    run = _search_key(estimator, X_train, y_train, fit_params,
+                      n_candidates=n_candidates, factor=factor,
+                      resource=resource, max_resources=max_resources,
+                      early_stopping_rounds=early_stopping_rounds,
+                      scoring=scoring, cv=repr(cv),
+                      random_state=random_state, params=repr(params))
+    n_cores = n_cores or os.cpu_count()
+    n_jobs, n_threads = split_cores(n_cores, check_cv(cv).get_n_splits())
+    estimator = set_n_threads(clone(estimator), n_threads)
+    cv_results = {'round': [], 'n_resources': [], 'params': [],
+                  'mean_test_score': []}
+
+    # the data goes to the workers once, in shared memory,
+    # and each fold is only a pair of row positions into it
+    shared = (nullcontext(X_train) if fit_params.get('cat_features')
+              else shared_frame(X_train))
+    with shared as X_cv:
+        alive = list(range(len(candidates)))
+        for r in range(n_rounds):
+            n_resources = max(1, int(max_resources
+                                     * factor**(r - n_rounds + 1)))
+            if resource == 'n_samples':
+                subset = np.sort(rows[:n_resources])
+            else:
+                subset = np.arange(X_train.shape[0])
+            y = _take(y_train, subset)
+            folds = [(subset[train], subset[test]) for train, test
+                     in check_cv(cv, y, classifier=is_classifier(estimator))
+                     .split(subset, y)]
+            if verbose:
+                print(f'Round {r + 1}/{n_rounds}: {len(alive)} candidates, '
+                      f'{resource}={n_resources}')
+
+            scores = {}
+            for i in alive:
+                trial = trials.get((run, r, i))
+                if (trial and trial['params'] == repr(candidates[i])
+                        and trial['n_resources'] == n_resources):
+                    scores[i] = trial['score']
+                    continue
+                est = clone(estimator).set_params(**candidates[i])
+                if resource != 'n_samples':
+                    est.set_params(**{resource: n_resources})
+                fold_scores = Parallel(n_jobs=n_jobs)(
+                    delayed(_fit_and_score)(clone(est), X_cv, y_train,
+                                            train, test, scoring, fit_params,
+                                            early_stopping_rounds,
+                                            random_state)
+                    for train, test in folds)
+                scores[i] = float(np.mean(fold_scores))
+                with open(trials_path, 'a') as f:
+                    f.write(json.dumps({'run': run, 'round': r,
+                                        'candidate': i,
+                                        'n_resources': n_resources,
+                                        'params': repr(candidates[i]),
+                                        'score': scores[i]}) + '\n')
+
+            for i in alive:
+                cv_results['round'].append(r)
+                cv_results['n_resources'].append(n_resources)
+                cv_results['params'].append(candidates[i])
+                cv_results['mean_test_score'].append(scores[i])
+
+            alive = sorted(alive, key=lambda i: -scores[i])
+            if r < n_rounds - 1:
+                alive = alive[:max(1, math.ceil(len(alive) / factor))]
+
+    best = alive[0]
+    best_estimator = set_n_threads(
+        clone(estimator).set_params(**candidates[best]), n_cores)
+    if resource != 'n_samples':
+        best_estimator.set_params(**{resource: max_resources})
+    best_estimator.fit(X_train, y_train, **fit_params)
+
+    return SearchResult(best_estimator, candidates[best], scores[best],
+                        cv_results, scoring)
+
+
+def _sparse_ols(X, y):
+    '''
+    This function fits ordinary least squares with a constant on a
+    sparse X (see sparse_ols_table) and returns the coefficients,
+    the unscaled covariance pinv([1, X]'[1, X]), the residuals
+    and the rank of [1, X].
+    '''
+    X = sp.csr_matrix(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_rows, n_cols = X.shape
+
+    # pinv([1, X]) = pinv(G) [1, X]' with G = [1, X]' [1, X]: the
+    # minimum-norm solution and pinv(G) as the unscaled covariance
+    X1 = sp.hstack([np.ones((n_rows, 1)), X], format='csr')
+    gram = (X1.T @ X1).toarray()
+
+    # G is badly conditioned (e.g. Season against the constant), so its
+    # eigenvectors come from the unit-diagonal D^-1 G D^-1 instead.
+    # D^-1 pinv(D^-1 G D^-1) D^-1 solves the same least squares, and
+    # projecting it on the row space of [1, X] gives pinv(G) itself
+    scale = np.sqrt(np.diag(gram))
+    scale[scale == 0] = 1
+    w, v = np.linalg.eigh(gram / np.outer(scale, scale))
+    kept = w > w.max() * len(w) * np.finfo(float).eps
+    rank = kept.sum()
+    inv = (v[:, kept] / w[kept]) @ v[:, kept].T / np.outer(scale, scale)
+    null = np.linalg.qr(v[:, ~kept] / scale[:, None])[0]
+    proj = np.eye(n_cols + 1) - null @ null.T
+    cov_unscaled = proj @ inv @ proj
+    params = cov_unscaled @ (X1.T @ y)
+
+    return params, cov_unscaled, y - X1 @ params, rank
+
+
+def _ols_table(params, cov_unscaled, resid, rank, feature_names, alpha):
+    df_resid = len(resid) - rank
+    std_err = np.sqrt(np.diag(cov_unscaled) * (resid @ resid) / df_resid)
+    t = params / std_err
+    p = 2 * stats.t.sf(np.abs(t), df_resid)
+    q = stats.t.ppf(1 - alpha / 2, df_resid)
+    conf_int = np.column_stack([params - q * std_err, params + q * std_err])
+
+    table = summary_params((None, params, std_err, t, p, conf_int),
+                           yname='y', xname=['const'] + list(feature_names),
+                           alpha=alpha)
+    table = pd.DataFrame(table.data)
+    table.columns = table.iloc[0]
+    table = table.drop(0)
+    table = table.set_index(table.columns[0])
+    return table.astype(float)
+
+
+def sparse_ols_table(X, y, feature_names, alpha=0.05):
+    '''
+    This function fits ordinary least squares with a constant and returns
+    the coefficient table of statsmodels' OLS summary (as in
+    Models/linreg.csv), without making X dense: only the small
+    features x features cross-product matrix is built.
+    Like statsmodels, it gives the minimum-norm solution of [1, X]
+    when some columns are exactly collinear (e.g. every one-hot column
+    of a category next to the constant).
+
+    Parameters
+    ----------
+    X: CSR matrix or DataFrame, features without the constant
+       (e.g. NFLPreprocessor(encoding='onehot', sparse=True) output)
+    y: Series or array, target values
+    feature_names: list, names of the columns of X
+    alpha: float (default=0.05), level of the confidence intervals
+
+    Returns
+    -------
+    DataFrame indexed by 'const' and the feature names, with the columns
+    coef, std err, t, P>|t|, [0.025, 0.975]
+    '''
+    return _ols_table(*_sparse_ols(X, y), feature_names, alpha)
+
+
+def sparse_ols_summary(X, y, feature_names, alpha=0.05):
+    '''
+    This function fits ordinary least squares with a constant like
+    sparse_ols_table, and also gives the model figures of the top of
+    statsmodels' OLS summary (R-squared, F-statistic, AIC, ...).
+
+    Parameters
+    ----------
+    X: CSR matrix or DataFrame, features without the constant
+    y: Series or array, target values
+    feature_names: list, names of the columns of X
+    alpha: float (default=0.05), level of the confidence intervals
+
+    Returns
+    -------
+    Series of model figures, coefficient table (see sparse_ols_table)
+    '''
+    params, cov_unscaled, resid, rank = _sparse_ols(X, y)
+    y = np.asarray(y, dtype=float)
+    n_rows = len(y)
+    df_model, df_resid = rank - 1, n_rows - rank
+    ssr = resid @ resid
+    tss = ((y - y.mean())**2).sum()
+    f_value = ((tss - ssr) / df_model) / (ssr / df_resid)
+    llf = -n_rows / 2 * (np.log(2 * np.pi) + np.log(ssr / n_rows) + 1)
+
+    model = pd.Series({
+        'R-squared': 1 - ssr / tss,
+        'Adj. R-squared': 1 - (n_rows - 1) / df_resid * ssr / tss,
+        'F-statistic': f_value,
+        'Prob (F-statistic)': stats.f.sf(f_value, df_model, df_resid),
+        'Log-Likelihood': llf,
+        'AIC': -2 * llf + 2 * rank,
+        'BIC': -2 * llf + np.log(n_rows) * rank,
+        'No. Observations': n_rows,
+        'Df Residuals': df_resid,
+        'Df Model': df_model})
+    return model, _ols_table(params, cov_unscaled, resid, rank,
+                             feature_names, alpha)
@@ -0,0 +1,308 @@
+import pandas as pd
+import numpy as np
+import os
+import xgboost as xgb
+import catboost as cb
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from catboost.utils import quantize
+from pipeline import read_plays
+from instrumentation import instrument, stage
+
+# folder for the on-disk caches of the external-memory training
+OUT_OF_CORE_DIR = 'Data/out_of_core'
+
+
+def csv_chunks(path, chunksize=100000, raw=False):
+    '''
+    This function makes a chunk reader for make_chunks arguments:
+    every call starts reading the file again.
+
+    Parameters
+    ----------
+    path: str, path of the csv file
+    chunksize: int (default=100000), number of rows read at a time
+    raw: boolean (default=False), True for raw data (train.csv schema),
+         which is read in whole plays; False for cleaned data
+
+    Returns
+    -------
+    function returning a generator of DataFrames
+    '''
+    if raw:
+        return lambda: read_plays(path, chunksize)
+    return lambda: pd.read_csv(path, chunksize=chunksize)
+
+
+def _split_mask(n_rows, chunk_index, test_size, seed):
+    '''
+    This function picks the test rows of a chunk.
+    The choice only depends on the seed and the chunk number,
+    so every pass over the data sees the same split.
+    '''
+    rng = np.random.default_rng([seed, chunk_index])
+    return rng.random(n_rows) < test_size
+
+
+def encoded_chunks(make_chunks, preprocessor, target='Yards', part='train',
+                   test_size=0.2, seed=220):
+    '''
+    This function cleans and label-encodes the chunks with the fitted
+    preprocessor as they are read, keeping the train or the test rows.
+
+    Parameters
+    ----------
+    make_chunks: function returning an iterable of DataFrames
+    preprocessor: fitted NFLPreprocessor
+    target: str (default='Yards'), target column
+    part: str (default='train'), 'train', 'test' or 'all'
+    test_size: float (default=0.2), share of rows held out for testing
+    seed: int (default=220), seed of the split
+
+    Returns
+    -------
+    generator of (features DataFrame, target array)
+    '''
+    for i, chunk in enumerate(make_chunks()):
+        if part != 'all':
+            test = _split_mask(len(chunk), i, test_size, seed)
+            chunk = chunk[test if part == 'test' else ~test]
+        if not len(chunk):
+            continue
+        with stage('encode_chunk', rows_in=len(chunk)):
+            X = preprocessor.transform(chunk)
+        yield X, chunk[target].values.astype(np.float32)
+
+
+class EncodedChunkIter(xgb.DataIter):
+    '''
+    This class feeds encoded chunks to XGBoost one at a time.
+    XGBoost caches each chunk on disk in its own format, so training
+    only keeps about one chunk of raw data in memory.
+
+    Parameters
+    ----------
+    make_chunks: function returning an iterable of DataFrames
+    preprocessor: fitted NFLPreprocessor
+    cache_prefix: str, path prefix of XGBoost's cache files
+    chunk_params: passed to encoded_chunks (target, part, test_size, seed)
+    '''
+    def __init__(self, make_chunks, preprocessor, cache_prefix,
+                 **chunk_params):
+        self.make_chunks = make_chunks
+        self.preprocessor = preprocessor
+        self.chunk_params = chunk_params
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = encoded_chunks(self.make_chunks, self.preprocessor,
+                                          **self.chunk_params)
+        X, y = next(self._chunks, (None, None))
+        if X is None:
+            return False
+        input_data(data=X, label=y)
+        return True
+
+    def reset(self):
+        self._chunks = None
+
+
+def evaluate_chunked(predict, make_chunks, preprocessor, target='Yards',
+                     part='test', test_size=0.2, seed=220):
+    '''
+    This function scores a regression model chunk by chunk.
+
+    Parameters
+    ----------
+    predict: function, features DataFrame -> predictions
+    make_chunks: function returning an iterable of DataFrames
+    preprocessor: fitted NFLPreprocessor
+    target: str (default='Yards')
+    part: str (default='test'), 'train', 'test' or 'all'
+    test_size: float (default=0.2)
+    seed: int (default=220)
+
+    Returns
+    -------
+    dict with the RMSE and R^2
+    '''
+    n = 0
+    sum_y = sum_y2 = sum_err2 = 0.0
+    for X, y in encoded_chunks(make_chunks, preprocessor, target, part,
+                               test_size, seed):
+        y = y.astype(np.float64)
+        err = y - np.asarray(predict(X), dtype=np.float64)
+        n += len(y)
+        sum_y += y.sum()
+        sum_y2 += (y**2).sum()
+        sum_err2 += (err**2).sum()
+
+    total = sum_y2 - sum_y**2 / n
+    return {'rmse': float(np.sqrt(sum_err2 / n)),
+            'r2': float(1 - sum_err2 / total)}
+
+
+@instrument
+def train_xgboost_chunked(make_chunks, preprocessor, params=None,
+                          num_boost_round=100, target='Yards',
+                          test_size=0.2, seed=220,
+                          cache_dir=OUT_OF_CORE_DIR, verbose=True):
+    '''
+    This function trains XGBoost on data read in chunks, with an
+    external-memory DMatrix: the encoded chunks are quantized into
+    pages cached on disk, so memory follows the chunk size rather
+    than the size of the data.
+
+    Parameters
+    ----------
+    make_chunks: function returning an iterable of DataFrames,
+                 e.g. csv_chunks('Data/cleaned_nfl.csv')
+    preprocessor: NFLPreprocessor fitted on the same kind of data
+                  (see NFLPreprocessor.fit_chunks), encoding='label'
+    params: dict (default=None), XGBoost training parameters
+            (tree_method is always 'hist')
+    num_boost_round: int (default=100)
+    target: str (default='Yards'), target column
+    test_size: float (default=0.2), share of rows held out for testing
+    seed: int (default=220), seed of the split and of the model
+    cache_dir: str (default=OUT_OF_CORE_DIR), folder of the cache files
+    verbose: boolean (default=True), print the scores
+
+    Returns
+    -------
+    Booster, dict of train and test scores
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    chunk_params = {'target': target, 'test_size': test_size, 'seed': seed}
+    it = EncodedChunkIter(make_chunks, preprocessor,
+                          os.path.join(cache_dir, 'xgb'), **chunk_params)
+    with stage('build_dmatrix'):
+        dtrain = xgb.ExtMemQuantileDMatrix(it)
+
+    params = {'objective': 'reg:squarederror', 'seed': seed,
+              **(params or {}), 'tree_method': 'hist'}
+    with stage('xgb_train', rows_in=dtrain.num_row()):
+        booster = xgb.train(params, dtrain, num_boost_round)
+
+    def predict(X):
+        return booster.inplace_predict(X)
+
+    scores = {'train': evaluate_chunked(predict, make_chunks, preprocessor,
+                                        part='train', **chunk_params),
+              'test': evaluate_chunked(predict, make_chunks, preprocessor,
+                                       part='test', **chunk_params)}
+    if verbose:
+        print('Train:', scores['train'])
+        print('Test:', scores['test'])
+
+    return booster, scores
+
+
+def write_encoded_tsv(make_chunks, preprocessor, path, target='Yards',
+                      part='train', test_size=0.2, seed=220):
+    '''
+    This function writes encoded chunks to a tab-separated file
+    (target first, no header) with its CatBoost column description.
+
+    Parameters
+    ----------
+    make_chunks: function returning an iterable of DataFrames
+    preprocessor: fitted NFLPreprocessor
+    path: str, path of the data file; the column description is
+          saved next to it as path + '.cd'
+    target: str (default='Yards')
+    part: str (default='train'), 'train', 'test' or 'all'
+    test_size: float (default=0.2)
+    seed: int (default=220)
+
+    Returns
+    -------
+    number of rows written
+    '''
+    options = pa_csv.WriteOptions(include_header=False, delimiter='\t',
+                                  quoting_style='none')
+    writer = None
+    n_rows = 0
+    try:
+        for X, y in encoded_chunks(make_chunks, preprocessor, target, part,
+                                   test_size, seed):
+            table = pa.Table.from_pandas(X.astype(np.float32).assign(
+                **{'__target': y})[['__target'] + list(X.columns)],
+                preserve_index=False)
+            if writer is None:
+                writer = pa_csv.CSVWriter(path, table.schema,
+                                          write_options=options)
+            writer.write_table(table)
+            n_rows += len(X)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    with open(path + '.cd', 'w') as f:
+        f.write('0\tLabel\n')
+        for i, col in enumerate(preprocessor.feature_names_):
+            f.write(f'{i + 1}\tNum\t{col}\n')
+
+    return n_rows
+
+
+@instrument
+def train_catboost_chunked(make_chunks, preprocessor, params=None,
+                           target='Yards', test_size=0.2, seed=220,
+                           border_count=254, work_dir=OUT_OF_CORE_DIR,
+                           verbose=True):
+    '''
+    This function trains CatBoost on data read in chunks.
+    The encoded chunks are written to disk, then CatBoost quantizes the
+    file block by block into a pool holding one byte per feature value
+    (instead of eight for the float64 DataFrame), so the raw data is
+    never loaded at once.
+
+    Parameters
+    ----------
+    make_chunks: function returning an iterable of DataFrames,
+                 e.g. csv_chunks('Data/cleaned_nfl.csv')
+    preprocessor: NFLPreprocessor fitted on the same kind of data
+                  (see NFLPreprocessor.fit_chunks), encoding='label'
+    params: dict (default=None), CatBoostRegressor parameters
+    target: str (default='Yards'), target column
+    test_size: float (default=0.2), share of rows held out for testing
+    seed: int (default=220), seed of the split and of the model
+    border_count: int (default=254), number of bins per feature
+    work_dir: str (default=OUT_OF_CORE_DIR), folder of the encoded file
+    verbose: boolean (default=True), print the scores
+
+    Returns
+    -------
+    CatBoostRegressor, dict of train and test scores
+    '''
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, 'catboost_train.tsv')
+    chunk_params = {'target': target, 'test_size': test_size, 'seed': seed}
+
+    with stage('write_encoded_tsv'):
+        write_encoded_tsv(make_chunks, preprocessor, path, part='train',
+                          **chunk_params)
+    with stage('quantize_pool'):
+        pool = quantize(path, column_description=path + '.cd',
+                        border_count=border_count, random_seed=seed)
+    os.remove(path)
+
+    model = cb.CatBoostRegressor(**{'random_seed': seed, 'verbose': False,
+                                    **(params or {})})
+    with stage('catboost_fit', rows_in=pool.num_row()):
+        model.fit(pool)
+
+    scores = {'train': evaluate_chunked(model.predict, make_chunks,
+                                        preprocessor, part='train',
+                                        **chunk_params),
+              'test': evaluate_chunked(model.predict, make_chunks,
+                                       preprocessor, part='test',
+                                       **chunk_params)}
+    if verbose:
+        print('Train:', scores['train'])
+        print('Test:', scores['test'])
+
+    return model, scores
@@ -0,0 +1,690 @@
+import pandas as pd
+import numpy as np
+import os
+import csv
+import glob
+import hashlib
+import inspect
+import io
+import shutil
+import tempfile
+from collections import namedtuple
+from joblib import Parallel, delayed
+from helper import *
+import instrumentation
+
+# a named cleaning step: func(df, df_id, **params) -> (df, df_id)
+Stage = namedtuple('Stage', ['name', 'func', 'params'])
+
+# folder and size limit (bytes) of the stage cache
+STAGE_CACHE_DIR = 'Data/stage_cache'
+STAGE_CACHE_SIZE = 5 * 1024**3
+
+
+def read_plays(path, chunksize=100000, dtype=RAW_DTYPES):
+    '''
+    This function reads the raw data in chunks,
+    making sure all rows of a play end up in the same chunk.
+
+    Parameters
+    ----------
+    path: str, path to the raw csv file
+    chunksize: int (default=100000), number of rows read at a time
+    dtype: dict (default=RAW_DTYPES), dtypes of the columns
+           (see compute_fill_values for the dtypes of the whole file)
+
+    Returns
+    -------
+    generator of DataFrames
+    '''
+    leftover = None
+    reader = pd.read_csv(path, dtype=dtype, chunksize=chunksize)
+    while True:
+        with instrumentation.stage('read_csv') as s:
+            chunk = next(reader, None)
+            s.rows_out = None if chunk is None else len(chunk)
+        if chunk is None:
+            break
+        if leftover is not None:
+            chunk = pd.concat([leftover, chunk])
+        last_play = chunk['PlayId'].values == chunk['PlayId'].values[-1]
+        leftover = chunk[last_play]
+        if (~last_play).any():
+            yield chunk[~last_play]
+
+    if leftover is not None and len(leftover):
+        yield leftover
+
+
+def chunk_fill_summary(df):
+    '''
+    This function summarizes one chunk of the raw data for
+    replace_null_cols: which columns have nulls, which are categorical,
+    and the counts of each value.
+    Summaries of different chunks can be combined with merge_fill_summaries.
+
+    Parameters
+    ----------
+    df: DataFrame, raw data
+
+    Returns
+    -------
+    dict, column name -> (has nulls, is categorical, value counts)
+    '''
+    return value_summary(split_id_cols(df)[0])
+
+
+def value_summary(df):
+    '''
+    This function summarizes every column of a DataFrame:
+    whether it has nulls, whether it is categorical,
+    and the counts of each value.
+    Summaries of different chunks can be combined with merge_fill_summaries.
+
+    Parameters
+    ----------
+    df: DataFrame
+
+    Returns
+    -------
+    dict, column name -> (has nulls, is categorical, value counts)
+    '''
+    return {col: (df[col].isna().any(), df[col].dtype == 'O',
+                  df[col].value_counts(sort=False))
+            for col in df.columns}
+
+
+def merge_fill_summaries(left, right):
+    '''
+    This function combines the summaries of two chunks.
+
+    Parameters
+    ----------
+    left: dict, summary from chunk_fill_summary
+    right: dict, summary from chunk_fill_summary
+
+    Returns
+    -------
+    dict, combined summary
+    '''
+    # counts keep the order in which values were first seen
+    merged = {}
+    for col in left:
+        l_null, l_obj, l_counts = left[col]
+        r_null, r_obj, r_counts = right[col]
+        counts = pd.concat([l_counts, r_counts])
+        merged[col] = (l_null | r_null, l_obj | r_obj,
+                       counts.groupby(level=0, sort=False).sum())
+
+    return merged
+
+
+def fill_values_from_summary(summary):
+    '''
+    This function turns a summary into the values replace_null_cols
+    would use on the whole data: the most common value for categorical
+    columns and the median for numerical columns.
+
+    Parameters
+    ----------
+    summary: dict, summary from chunk_fill_summary/merge_fill_summaries
+
+    Returns
+    -------
+    dict, column name -> fill value
+    '''
+    fills = {}
+    for col, (has_nulls, is_obj, counts) in summary.items():
+        if not has_nulls:
+            continue
+        if is_obj:
+            fills[col] = counts.index[counts.values.argmax()]
+        else:
+            fills[col] = median_from_counts(counts)
+
+    return fills
+
+
+def median_from_counts(counts):
+    '''
+    This function finds the exact median of the values behind
+    value counts (the same as Series.median on the values).
+
+    Parameters
+    ----------
+    counts: Series, value -> count
+
+    Returns
+    -------
+    float (NaN if there are no values)
+    '''
+    counts = counts[counts > 0].sort_index()
+    if not len(counts):
+        return np.nan
+    cum_counts = counts.values.cumsum()
+    n = cum_counts[-1]
+    lower = counts.index[np.searchsorted(cum_counts, (n - 1)//2, side='right')]
+    upper = counts.index[np.searchsorted(cum_counts, n//2, side='right')]
+    return (lower + upper) / 2
+
+
+def common_dtypes(dtypes):
+    '''
+    This function finds the dtypes to read every chunk (or partition)
+    with, so that a column parsed as integers in one chunk and as floats
+    (because of nulls) in another is written the same way everywhere,
+    as when the whole file is read at once.
+
+    Parameters
+    ----------
+    dtypes: list of dicts, column name -> dtype of each chunk
+
+    Returns
+    -------
+    dict, column name -> dtype for the columns whose dtypes differ
+    '''
+    common = {}
+    for col in dtypes[0]:
+        kinds = {d[col] for d in dtypes}
+        if len(kinds) == 1:
+            continue
+        if all(pd.api.types.is_numeric_dtype(k)
+               and not pd.api.types.is_bool_dtype(k) for k in kinds):
+            common[col] = np.float64
+        else:
+            common[col] = object
+
+    return common
+
+
+@instrument
+def compute_fill_values(path, chunksize=100000, return_dtypes=False):
+    '''
+    This function makes a first pass over the raw data to find the
+    global null fill values, reading only one chunk at a time.
+
+    Parameters
+    ----------
+    path: str, path to the raw csv file
+    chunksize: int (default=100000), number of rows read at a time
+    return_dtypes: boolean (default=False), True to also get the dtypes
+                   to read every chunk with (see common_dtypes)
+
+    Returns
+    -------
+    dict, column name -> fill value
+    (and dict, column name -> dtype, when return_dtypes)
+    '''
+    summary = None
+    dtypes = []
+    for chunk in pd.read_csv(path, dtype=RAW_DTYPES, chunksize=chunksize):
+        chunk_summary = chunk_fill_summary(chunk)
+        dtypes.append(chunk.dtypes.to_dict())
+        if summary is None:
+            summary = chunk_summary
+        else:
+            summary = merge_fill_summaries(summary, chunk_summary)
+
+    fills = fill_values_from_summary(summary)
+    if return_dtypes:
+        return fills, {**common_dtypes(dtypes), **RAW_DTYPES}
+    return fills
+
+
+def clean_chunks(chunks, fills):
+    '''
+    This function cleans chunks of the raw data one at a time.
+
+    Parameters
+    ----------
+    chunks: iterable of DataFrames, raw data
+    fills: dict, global null fill values
+
+    Returns
+    -------
+    generator of (DataFrame used for training, DataFrame for ID purposes)
+    '''
+    for chunk in chunks:
+        yield clean_frame(chunk, fills)
+
+
+def write_chunks(cleaned, out_path, id_path=None):
+    '''
+    This function appends cleaned chunks to csv files as they come.
+
+    Parameters
+    ----------
+    cleaned: iterable of (DataFrame, DataFrame), output of clean_chunks
+    out_path: str, path of the cleaned csv file
+    id_path: str (default=None), path of the ID csv file
+
+    Returns
+    -------
+    number of rows written
+    '''
+    n_rows = 0
+    for i, (df, df_id) in enumerate(cleaned):
+        mode = 'w' if i == 0 else 'a'
+        with instrumentation.stage('to_csv', rows_in=len(df)):
+            df.to_csv(out_path, mode=mode, header=(i == 0), index=False)
+            if id_path:
+                df_id.to_csv(id_path, mode=mode, header=(i == 0),
+                             index=False)
+        n_rows += len(df)
+
+    return n_rows
+
+
+@instrument
+def clean_csv_in_chunks(path, out_path, id_path=None, chunksize=100000):
+    '''
+    This function cleans the raw data without loading it all at once.
+    A first pass computes the null fill values over the whole file,
+    and the dtypes of its columns, then a second pass reads, cleans and
+    writes each chunk with them, so the output is byte for byte the same
+    as cleaning the whole file in memory.
+
+    Parameters
+    ----------
+    path: str, path to the raw csv file
+    out_path: str, path of the cleaned csv file
+    id_path: str (default=None), path of the ID csv file
+    chunksize: int (default=100000), number of rows read at a time
+
+    Returns
+    -------
+    number of rows written
+    '''
+    fills, dtype = compute_fill_values(path, chunksize, return_dtypes=True)
+    chunks = read_plays(path, chunksize, dtype)
+
+    return write_chunks(clean_chunks(chunks, fills), out_path, id_path)
+
+
+def _csv_fields(line):
+    '''
+    This function splits one csv line into its fields, unquoting them.
+    '''
+    return next(csv.reader([line.decode('utf-8-sig').rstrip('\r\n')]), [])
+
+
+def game_partitions(path, n_parts, key='GameId'):
+    '''
+    This function splits the raw csv file into byte ranges of about
+    the same size that start and end between games, so every game
+    is read by a single worker.
+    It expects one row per line with the rows of a game next to each
+    other, as in train.csv; fields may be quoted (e.g. by write_raw_csv).
+
+    Parameters
+    ----------
+    path: str, path to the raw csv file
+    n_parts: int, number of partitions wanted (fewer when there are
+             fewer games)
+    key: str (default='GameId'), column the partitions are aligned on
+
+    Returns
+    -------
+    header line (bytes), list of (start, end) byte offsets
+    '''
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        col = _csv_fields(header).index(key)
+        bounds = [f.tell()]
+        for i in range(1, n_parts):
+            f.seek(max(size * i // n_parts, bounds[-1]))
+            if f.tell() > bounds[-1]:
+                f.readline()
+            start = f.tell()
+            line = f.readline()
+            game = _csv_fields(line)[col] if line else None
+            while line and _csv_fields(line)[col] == game:
+                start = f.tell()
+                line = f.readline()
+            if start > bounds[-1] and start < size:
+                bounds.append(start)
+        bounds.append(size)
+
+    return header, list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_partition(path, header, start, end, dtype=RAW_DTYPES):
+    '''
+    This function reads one byte range of the raw csv file.
+
+    Parameters
+    ----------
+    path: str, path to the raw csv file
+    header: bytes, header line of the file
+    start: int, first byte of the range (start of a line)
+    end: int, byte after the range (start of a line or end of file)
+    dtype: dict (default=RAW_DTYPES), dtypes of the columns
+
+    Returns
+    -------
+    DataFrame
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    return pd.read_csv(io.BytesIO(header + data), dtype=dtype)
+
+
+def _partition_summary(path, header, start, end):
+    df = read_partition(path, header, start, end)
+    return chunk_fill_summary(df), df.dtypes.to_dict()
+
+
+def _clean_partition(path, header, start, end, dtype, fills, out_path,
+                     id_path, write_header):
+    df, df_id = clean_frame(read_partition(path, header, start, end, dtype),
+                            fills)
+    df.to_csv(out_path, header=write_header, index=False)
+    if id_path:
+        df_id.to_csv(id_path, header=write_header, index=False)
+    return len(df)
+
+
+@instrument
+def clean_csv_in_parallel(path, out_path, id_path=None, n_cores=None,
+                          n_parts=None):
+    '''
+    This function cleans the raw data in a pool of processes.
+    The file is split into game-aligned byte ranges (see game_partitions)
+    that the workers read themselves.
+    A first parallel pass summarizes every partition; the summaries are
+    merged in file order into the global null fill values (and dtypes),
+    which are then sent to the workers of the second pass. Each of them
+    cleans its partitions and writes them to temporary files, which are
+    joined in file order, so the output is byte for byte the same as
+    reading and cleaning the whole file at once.
+
+    Parameters
+    ----------
+    path: str, path to the raw csv file
+    out_path: str, path of the cleaned csv file
+    id_path: str (default=None), path of the ID csv file
+    n_cores: int (default=None), number of processes; all cores when None
+    n_parts: int (default=None), number of partitions; 4 per process
+             when None, to balance the load (memory grows with the size
+             of a partition)
+
+    Returns
+    -------
+    number of rows written
+    '''
+    n_cores = n_cores or os.cpu_count()
+    header, parts = game_partitions(path, n_parts or 4 * n_cores)
+
+    with instrumentation.stage('partition_summaries'):
+        results = Parallel(n_jobs=n_cores)(
+            delayed(_partition_summary)(path, header, start, end)
+            for start, end in parts)
+    summary = results[0][0]
+    for part_summary, _ in results[1:]:
+        summary = merge_fill_summaries(summary, part_summary)
+    fills = fill_values_from_summary(summary)
+    dtype = {**common_dtypes([d for _, d in results]), **RAW_DTYPES}
+
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_path)))
+    try:
+        outs = [os.path.join(tmp_dir, f'{i:05d}.csv')
+                for i in range(len(parts))]
+        ids = [os.path.join(tmp_dir, f'{i:05d}_id.csv') if id_path else None
+               for i in range(len(parts))]
+        with instrumentation.stage('clean_partitions'):
+            n_rows = Parallel(n_jobs=n_cores)(
+                delayed(_clean_partition)(path, header, start, end, dtype,
+                                          fills, outs[i], ids[i], i == 0)
+                for i, (start, end) in enumerate(parts))
+
+        with instrumentation.stage('join_partitions', rows_in=sum(n_rows)):
+            for final, pieces in [(out_path, outs), (id_path, ids)]:
+                if not final:
+                    continue
+                with open(final, 'wb') as out:
+                    for piece in pieces:
+                        with open(piece, 'rb') as f:
+                            shutil.copyfileobj(f, out, 16 * 1024**2)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return sum(n_rows)
+
+
+def _stage_replace_null_cols(df, df_id):
+    return replace_null_cols(df), df_id
+
+
+def _stage_rename_elements(df, df_id):
+    return rename_elements(df, df_id), df_id
+
+
+def _stage_parse_text_cols(df, df_id):
+    return parse_text_cols(df), df_id
+
+
+def _stage_organize_team_abbrs(df, df_id):
+    return organize_team_abbrs(df), df_id
+
+
+def _stage_player_height(df, df_id):
+    df['PlayerHeight'] = height_to_inches(df['PlayerHeight'])
+    return df, df_id
+
+
+def _stage_flip_play_direction(df, df_id):
+    return flip_play_direction(df), df_id
+
+
+def _stage_team_sides(df, df_id):
+    return team_sides(df), df_id
+
+
+def _stage_yard_class(df, df_id):
+    df['Yard_class'] = yard_classes(df['Yards'])
+    return df, df_id
+
+
+def _stage_group_weather(df, df_id):
+    df['GameWeather'] = map_unique(df['GameWeather'], group_weather)
+    return df, df_id
+
+
+def _stage_offense_formation(df, df_id):
+    df['OffenseFormation'] = df['OffenseFormation'].replace('ACE',
+                                                            'SINGLEBACK')
+    return df, df_id
+
+
+# same steps as helper.clean_frame, applied after split_id_cols
+CLEANING_STAGES = [Stage('replace_null_cols', _stage_replace_null_cols, {}),
+                   Stage('rename_elements', _stage_rename_elements, {}),
+                   Stage('parse_text_cols', _stage_parse_text_cols, {}),
+                   Stage('organize_team_abbrs',
+                         _stage_organize_team_abbrs, {}),
+                   Stage('player_height', _stage_player_height, {}),
+                   Stage('flip_play_direction',
+                         _stage_flip_play_direction, {}),
+                   Stage('team_sides', _stage_team_sides, {}),
+                   Stage('yard_class', _stage_yard_class, {}),
+                   Stage('group_weather', _stage_group_weather, {}),
+                   Stage('offense_formation', _stage_offense_formation, {})]
+
+
+def code_fingerprint(func, _seen=None):
+    '''
+    This function hashes the source code of a function together with
+    the source of every function of this project it calls and the
+    lookup tables (dicts, lists, ...) it reads from module globals,
+    so editing a helper changes the fingerprint of the stages using it.
+
+    Parameters
+    ----------
+    func: function
+
+    Returns
+    -------
+    str, hex digest
+    '''
+    # look through decorators (e.g. instrument) to the function itself
+    func = inspect.unwrap(func)
+    if _seen is None:
+        _seen = set()
+    _seen.add(func)
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def names(code):
+        found = set(code.co_names)
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                found |= names(const)
+        return found
+
+    try:
+        digest = hashlib.sha256(inspect.getsource(func).encode())
+    except OSError:
+        # no source file (e.g. defined interactively): use the bytecode
+        digest = hashlib.sha256(func.__code__.co_code)
+        digest.update(repr(func.__code__.co_consts).encode())
+
+    for name in sorted(names(func.__code__)):
+        obj = func.__globals__.get(name)
+        if inspect.isfunction(obj) and inspect.unwrap(obj) not in _seen:
+            source_file = inspect.getsourcefile(obj) or ''
+            if os.path.dirname(os.path.abspath(source_file)) == project_dir:
+                digest.update(code_fingerprint(obj, _seen).encode())
+        elif isinstance(obj, (dict, list, tuple, set, str, int, float)):
+            digest.update(f'{name}={obj!r}'.encode())
+
+    return digest.hexdigest()
+
+
+def frame_fingerprint(df):
+    '''
+    This function hashes the content of a DataFrame
+    (values, index, column names and dtypes).
+
+    Parameters
+    ----------
+    df: DataFrame
+
+    Returns
+    -------
+    str, hex digest
+    '''
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df).values.tobytes())
+    digest.update(repr(list(zip(df.columns, df.dtypes.astype(str)))).encode())
+    return digest.hexdigest()
+
+
+def stage_keys(df, stages):
+    '''
+    This function builds the cache key of every stage from the key of
+    the stage before it (the raw data fingerprint for the first one),
+    the stage's code fingerprint and its parameters.
+
+    Parameters
+    ----------
+    df: DataFrame, raw data
+    stages: list of Stage
+
+    Returns
+    -------
+    list of str, one key per stage
+    '''
+    keys = []
+    key = frame_fingerprint(df)
+    for stage in stages:
+        digest = hashlib.sha256(key.encode())
+        digest.update(stage.name.encode())
+        digest.update(code_fingerprint(stage.func).encode())
+        digest.update(repr(sorted(stage.params.items())).encode())
+        key = digest.hexdigest()
+        keys.append(key)
+
+    return keys
+
+
+def evict_stage_cache(cache_dir=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_SIZE):
+    '''
+    This function deletes the least recently used cached stage outputs
+    until the cache fits in max_bytes.
+
+    Parameters
+    ----------
+    cache_dir: str (default=STAGE_CACHE_DIR), folder of the cache
+    max_bytes: int (default=STAGE_CACHE_SIZE), size limit in bytes
+
+    Returns
+    -------
+    list of deleted files
+    '''
+    files = sorted(glob.glob(os.path.join(cache_dir, '*.pkl')),
+                   key=os.path.getmtime)
+    total = sum(os.path.getsize(f) for f in files)
+    deleted = []
+    for f in files:
+        if total <= max_bytes:
+            break
+        total -= os.path.getsize(f)
+        os.remove(f)
+        deleted.append(f)
+
+    return deleted
+
+
+def run_stages(df, stages=CLEANING_STAGES, cache_dir=STAGE_CACHE_DIR,
+               max_bytes=STAGE_CACHE_SIZE, verbose=True):
+    '''
+    This function cleans the raw DataFrame stage by stage,
+    caching every stage's output on disk.
+    On a rerun, it starts from the last stage whose key is still cached,
+    so only stages whose input, code or parameters changed
+    (and the stages after them) are recomputed.
+
+    Parameters
+    ----------
+    df: DataFrame, raw data
+    stages: list of Stage (default=CLEANING_STAGES)
+    cache_dir: str (default=STAGE_CACHE_DIR), folder of the cache
+    max_bytes: int (default=STAGE_CACHE_SIZE), size limit in bytes
+    verbose: boolean (default=True), print which stages ran
+
+    Returns
+    --------
+    DataFrame used for training, DataFrame for ID purposes
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = stage_keys(df, stages)
+    paths = [os.path.join(cache_dir, f'{key}.pkl') for key in keys]
+
+    start = 0
+    for i in reversed(range(len(stages))):
+        if os.path.exists(paths[i]):
+            start = i + 1
+            break
+
+    if start:
+        # mark as recently used
+        os.utime(paths[start - 1])
+        df, df_id = pd.read_pickle(paths[start - 1])
+        if verbose:
+            print(f'Loaded {stages[start - 1].name} from cache')
+    else:
+        df, df_id = split_id_cols(df)
+
+    for stage, path in zip(stages[start:], paths[start:]):
+        with instrumentation.stage(stage.name, rows_in=len(df)) as s:
+            df, df_id = stage.func(df, df_id, **stage.params)
+            s.rows_out = len(df)
+        with instrumentation.stage('write_stage_cache', rows_in=len(df)):
+            pd.to_pickle((df, df_id), path)
+        if verbose:
+            print(f'Ran {stage.name}')
+
+    evict_stage_cache(cache_dir, max_bytes)
+
+    return df, df_id
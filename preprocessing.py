@@ -0,0 +1,354 @@
+import pandas as pd
+import numpy as np
+import json
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.preprocessing import StandardScaler
+from helper import (split_id_cols, null_fill_values, replace_null_cols,
+                    clean_frame)
+from pipeline import (chunk_fill_summary, value_summary,
+                      merge_fill_summaries, fill_values_from_summary,
+                      median_from_counts)
+
+# columns that are targets, not features
+TARGET_COLS = ['Yards', 'Yard_class']
+
+
+class NFLPreprocessor(BaseEstimator, TransformerMixin):
+    '''
+    This class cleans and encodes the data the same way at training
+    and scoring time.
+    fit learns the null fill values, the categories of every text column
+    and the feature columns once; transform only does array lookups.
+
+    Parameters
+    ----------
+    encoding: str (default='label'), 'label' to turn each text column into
+              the index of its value among the sorted categories (same as
+              LabelEncoder), 'onehot' for indicator columns
+              (same as pd.get_dummies(drop_first=True))
+    clean: boolean (default=True), True if the input is raw data
+           (train.csv schema), False if it was already cleaned
+           (its nulls are still filled with the values learned in fit)
+    unknown_value: int (default=-1), label given to categories not seen
+                   in fit; with 'onehot' they get all indicators at 0.
+                   It must not be a code of a seen category
+                   (0 to number of categories - 1)
+    sparse: boolean (default=False), with 'onehot', True to return a
+            scipy CSR matrix (numeric columns first, then the indicators)
+            instead of a mostly-zero DataFrame
+    '''
+    def __init__(self, encoding='label', clean=True, unknown_value=-1,
+                 sparse=False):
+        self.encoding = encoding
+        self.clean = clean
+        self.unknown_value = unknown_value
+        self.sparse = sparse
+
+    def _clean(self, X):
+        if self.clean:
+            X, _ = clean_frame(X.copy(), self.fills_)
+        else:
+            X = replace_null_cols(X.copy(), self.fills_)
+        return X.drop([col for col in TARGET_COLS if col in X.columns],
+                      axis=1)
+
+    def fit(self, X, y=None):
+        '''
+        This function learns the fill values, categories and columns.
+
+        Parameters
+        ----------
+        X: DataFrame, raw or cleaned data
+        y: ignored
+
+        Returns
+        -------
+        self
+        '''
+        if self.clean:
+            self.fills_ = null_fill_values(split_id_cols(X)[0])
+        else:
+            self.fills_ = null_fill_values(X)
+        X = self._clean(X)
+
+        self.columns_ = list(X.columns)
+        self.categories_ = {}
+        for col in X.columns:
+            if X[col].dtype == 'O' or isinstance(X[col].dtype,
+                                                 pd.CategoricalDtype):
+                self.categories_[col] = np.unique(X[col].astype(str).values)
+        self.medians_ = {col: float(X[col].median()) for col in X.columns
+                         if col not in self.categories_}
+        self._check_unknown_value()
+        self._set_feature_names()
+
+        return self
+
+    def fit_chunks(self, make_chunks):
+        '''
+        This function learns the same fill values, categories and columns
+        as fit, but reads the data one chunk at a time, so it works on
+        data that does not fit in memory.
+        Raw data is read twice: once for the fill values,
+        once to summarize the cleaned chunks.
+
+        Parameters
+        ----------
+        make_chunks: function returning an iterable of DataFrames
+                     (e.g. lambda: read_plays(path))
+
+        Returns
+        -------
+        self
+        '''
+        def summarize(chunks, summary_func):
+            summary = None
+            for chunk in chunks:
+                chunk_summary = summary_func(chunk)
+                summary = (chunk_summary if summary is None
+                           else merge_fill_summaries(summary, chunk_summary))
+            return summary
+
+        if self.clean:
+            self.fills_ = fill_values_from_summary(
+                summarize(make_chunks(), chunk_fill_summary))
+        else:
+            self.fills_ = fill_values_from_summary(
+                summarize(make_chunks(), value_summary))
+        summary = summarize((self._clean(chunk) for chunk in make_chunks()),
+                            value_summary)
+
+        self.columns_ = list(summary)
+        self.categories_ = {}
+        self.medians_ = {}
+        for col, (has_nulls, is_obj, counts) in summary.items():
+            if is_obj or isinstance(counts.index.dtype, pd.CategoricalDtype):
+                cats = counts.index.astype(str).tolist()
+                if has_nulls:
+                    cats.append('nan')
+                self.categories_[col] = np.unique(cats)
+            else:
+                self.medians_[col] = float(median_from_counts(counts))
+        self._check_unknown_value()
+        self._set_feature_names()
+
+        return self
+
+    def _check_unknown_value(self):
+        n_codes = max([len(cats) for cats in self.categories_.values()],
+                      default=0)
+        if 0 <= self.unknown_value < n_codes:
+            raise ValueError(f'unknown_value={self.unknown_value} is the code '
+                             f'of a seen category; use a negative value '
+                             f'or one of at least {n_codes}')
+
+    def _set_feature_names(self):
+        self.feature_names_ = []
+        for col in self.columns_:
+            if col not in self.categories_ or self.encoding == 'label':
+                self.feature_names_.append(col)
+        if self.encoding == 'onehot':
+            for col, cats in self.categories_.items():
+                self.feature_names_ += [f'{col}_{cat}' for cat in cats[1:]]
+
+    def encode(self, X):
+        '''
+        This function turns each text column into category codes.
+
+        Parameters
+        ----------
+        X: DataFrame, cleaned data
+
+        Returns
+        -------
+        dict, column name -> array of codes (unknown_value if unseen)
+        '''
+        codes = {}
+        for col, cats in self.categories_.items():
+            idx = pd.Index(cats).get_indexer(X[col].astype(str).values)
+            codes[col] = np.where(idx == -1, self.unknown_value, idx)
+        return codes
+
+    def transform(self, X):
+        '''
+        This function cleans and encodes new data.
+
+        Parameters
+        ----------
+        X: DataFrame, raw or cleaned data (same kind as in fit)
+
+        Returns
+        -------
+        DataFrame with the columns in feature_names_
+        (CSR matrix if sparse and encoding is 'onehot')
+        '''
+        X = self._clean(X)
+        codes = self.encode(X)
+        if self.sparse and self.encoding == 'onehot':
+            return self._sparse_onehot(X, codes)
+
+        out = {}
+        for col in self.columns_:
+            if col in self.categories_:
+                if self.encoding == 'label':
+                    out[col] = codes[col]
+            else:
+                values = X[col].values.astype(float)
+                out[col] = np.where(np.isnan(values), self.medians_[col],
+                                    values)
+        if self.encoding == 'onehot':
+            for col, cats in self.categories_.items():
+                onehot = (codes[col][:, None]
+                          == np.arange(1, len(cats))[None, :])
+                for j, cat in enumerate(cats[1:]):
+                    out[f'{col}_{cat}'] = onehot[:, j].astype(np.uint8)
+
+        return pd.DataFrame(out, index=X.index)[self.feature_names_]
+
+    def _sparse_onehot(self, X, codes):
+        '''
+        This function builds the one-hot CSR matrix straight from the codes:
+        each row stores its numeric values and one entry per text column
+        (none for the first category, as with drop_first, or unseen ones).
+        '''
+        numeric = [col for col in self.columns_ if col not in self.categories_]
+        values = X[numeric].values.astype(float)
+        medians = np.array([self.medians_[col] for col in numeric])
+        values = np.where(np.isnan(values), medians, values)
+
+        n_rows, n_numeric = values.shape
+        rows = [np.repeat(np.arange(n_rows), n_numeric)]
+        cols = [np.tile(np.arange(n_numeric), n_rows)]
+        data = [values.ravel()]
+        offset = n_numeric
+        for col, cats in self.categories_.items():
+            code = codes[col]
+            hit = (code > 0) & (code < len(cats))
+            rows.append(np.flatnonzero(hit))
+            cols.append(offset + code[hit] - 1)
+            data.append(np.ones(hit.sum()))
+            offset += len(cats) - 1
+
+        X = sp.csr_matrix((np.concatenate(data),
+                           (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(n_rows, offset))
+        X.eliminate_zeros()
+        return X
+
+    @property
+    def encodings_(self):
+        '''
+        dict, column name -> {category: code}, e.g. for the model registry
+        '''
+        return {col: {cat: i for i, cat in enumerate(cats)}
+                for col, cats in self.categories_.items()}
+
+    def save(self, path):
+        '''
+        This function saves the fitted lookup tables as JSON.
+
+        Parameters
+        ----------
+        path: str, path of the file
+
+        Returns
+        -------
+        None
+        '''
+        state = {'params': self.get_params(),
+                 'fills': {col: (v.item() if isinstance(v, np.generic)
+                                 else v) for col, v in self.fills_.items()},
+                 'columns': self.columns_,
+                 'categories': {col: cats.tolist()
+                                for col, cats in self.categories_.items()},
+                 'medians': self.medians_,
+                 'feature_names': self.feature_names_}
+        with open(path, 'w') as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        This function loads a preprocessor saved with save.
+
+        Parameters
+        ----------
+        path: str, path of the file
+
+        Returns
+        -------
+        fitted NFLPreprocessor
+        '''
+        with open(path) as f:
+            state = json.load(f)
+        prep = cls(**state['params'])
+        prep.fills_ = state['fills']
+        prep.columns_ = state['columns']
+        prep.categories_ = {col: np.array(cats, dtype=object)
+                            for col, cats in state['categories'].items()}
+        prep.medians_ = state['medians']
+        prep.feature_names_ = state['feature_names']
+        return prep
+
+
+class NumericScaler(BaseEstimator, TransformerMixin):
+    '''
+    This class standardizes the first n_numeric columns (the numeric
+    features of NFLPreprocessor(encoding='onehot')) and leaves the
+    indicator columns as they are, so a sparse matrix stays sparse.
+    It gives the same values as fitting StandardScaler on the numeric
+    columns only.
+
+    Parameters
+    ----------
+    n_numeric: int, number of numeric columns at the start of X
+               (len(preprocessor.medians_))
+    '''
+    def __init__(self, n_numeric):
+        self.n_numeric = n_numeric
+
+    def _numeric(self, X):
+        if sp.issparse(X):
+            return X[:, :self.n_numeric].toarray()
+        return np.asarray(X.iloc[:, :self.n_numeric] if hasattr(X, 'iloc')
+                          else X[:, :self.n_numeric], dtype=float)
+
+    def fit(self, X, y=None):
+        '''
+        This function learns the mean and scale of the numeric columns.
+
+        Parameters
+        ----------
+        X: CSR matrix, array or DataFrame
+        y: ignored
+
+        Returns
+        -------
+        self
+        '''
+        self.scaler_ = StandardScaler().fit(self._numeric(X))
+        return self
+
+    def transform(self, X):
+        '''
+        This function standardizes the numeric columns.
+
+        Parameters
+        ----------
+        X: CSR matrix, array or DataFrame
+
+        Returns
+        -------
+        same type as X
+        '''
+        numeric = self.scaler_.transform(self._numeric(X))
+        if sp.issparse(X):
+            return sp.hstack([sp.csr_matrix(numeric), X[:, self.n_numeric:]],
+                             format='csr')
+        X = X.copy()
+        if hasattr(X, 'columns'):
+            X[X.columns[:self.n_numeric]] = numeric
+        else:
+            X[:, :self.n_numeric] = numeric
+        return X
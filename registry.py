@@ -0,0 +1,290 @@
+import pandas as pd
+import numpy as np
+import os
+import copy
+import json
+import time
+import pickle
+import shutil
+import importlib
+import sklearn
+from sklearn.tree._tree import Tree
+
+# folder holding one sub-folder per registered model
+REGISTRY_DIR = 'Models/registry'
+# sub-folder of a registered model holding its CompiledForest
+COMPILED_DIR = 'compiled'
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return str(obj)
+
+
+def _tree_models(model):
+    '''
+    This function lists the fitted sklearn decision trees of a model
+    (a single tree or a forest), or returns None for other models.
+    '''
+    if isinstance(getattr(model, 'tree_', None), Tree):
+        return [model]
+    trees = getattr(model, 'estimators_', None)
+    if (isinstance(trees, list) and trees
+            and all(isinstance(getattr(t, 'tree_', None), Tree)
+                    for t in trees)):
+        return trees
+    return None
+
+
+def _model_format(model):
+    module = model.__class__.__module__.split('.')[0]
+    if module == 'catboost':
+        return 'catboost'
+    if module == 'xgboost':
+        return 'xgboost'
+    if _tree_models(model) is not None:
+        return 'sklearn_trees'
+    return 'pickle'
+
+
+def _save_trees(model, path):
+    '''
+    This function saves the nodes and values of all trees of a model
+    as flat .npy arrays and the rest of the model (without trees)
+    as a small pickle.
+    '''
+    trees = _tree_models(model)
+    states = [t.tree_.__getstate__() for t in trees]
+    offsets = np.cumsum([0] + [s['node_count'] for s in states])
+
+    np.save(os.path.join(path, 'nodes.npy'),
+            np.concatenate([s['nodes'] for s in states]))
+    np.save(os.path.join(path, 'values.npy'),
+            np.concatenate([s['values'] for s in states]))
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    np.save(os.path.join(path, 'depths.npy'),
+            np.array([s['max_depth'] for s in states]))
+
+    bare_trees = []
+    for t in trees:
+        bare = copy.copy(t)
+        bare.tree_ = None
+        bare_trees.append(bare)
+    if trees[0] is model:
+        skeleton = bare_trees[0]
+    else:
+        skeleton = copy.copy(model)
+        skeleton.estimators_ = bare_trees
+
+    with open(os.path.join(path, 'skeleton.pkl'), 'wb') as f:
+        pickle.dump(skeleton, f)
+
+
+def _load_trees(path):
+    '''
+    This function puts a tree model saved by _save_trees back together.
+    The node arrays are read from the memory-mapped files without
+    unpickling them, but sklearn's Tree copies them into its own memory,
+    so every process holds its own copy of the trees. To share the
+    pages between processes, predict with inference.load_compiled.
+    '''
+    with open(os.path.join(path, 'skeleton.pkl'), 'rb') as f:
+        model = pickle.load(f)
+    nodes = np.load(os.path.join(path, 'nodes.npy'), mmap_mode='r')
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+    offsets = np.load(os.path.join(path, 'offsets.npy'))
+    depths = np.load(os.path.join(path, 'depths.npy'))
+
+    trees = model.estimators_ if hasattr(model, 'estimators_') else [model]
+    for i, t in enumerate(trees):
+        n_classes = np.atleast_1d(getattr(t, 'n_classes_', 1))
+        tree = Tree(t.n_features_in_, n_classes.astype(np.intp),
+                    t.n_outputs_)
+        start, end = offsets[i], offsets[i + 1]
+        tree.__setstate__({'max_depth': depths[i],
+                           'node_count': end - start,
+                           'nodes': nodes[start:end],
+                           'values': values[start:end]})
+        t.tree_ = tree
+
+    return model
+
+
+def save_model(model, name, feature_names=None, encodings=None,
+               scores=None, params=None, preprocessor=None,
+               registry_dir=REGISTRY_DIR):
+    '''
+    This function registers a fitted model in a compact format:
+    native .cbm for CatBoost, UBJSON for XGBoost,
+    flat .npy node arrays for sklearn trees and forests,
+    and a pickle for anything else.
+    The metadata is saved next to it in meta.json, and a compiled copy
+    from an earlier save (see inference.load_compiled) is removed.
+
+    Parameters
+    ----------
+    model: fitted model, or a fitted search object
+           (its best estimator, params and score are used)
+    name: str, model name
+    feature_names: list (default=None), features the model expects
+    encodings: dict (default=None), category encodings of the features
+    scores: dict (default=None), e.g. {'train': 0.8, 'test': 0.7}
+    params: dict (default=None), hyperparameters
+    preprocessor: fitted NFLPreprocessor (default=None), saved as
+                  preprocessor.json; its features and encodings are used
+                  when feature_names/encodings are not given
+    registry_dir: str (default=REGISTRY_DIR)
+
+    Returns
+    -------
+    str, folder of the registered model
+    '''
+    scores = dict(scores or {})
+    if hasattr(model, 'best_estimator_'):
+        params = params or model.best_params_
+        scores.setdefault('cv', model.best_score_)
+        model = model.best_estimator_
+    if preprocessor is not None:
+        feature_names = feature_names or preprocessor.feature_names_
+        encodings = encodings or preprocessor.encodings_
+    if feature_names is None and hasattr(model, 'feature_names_in_'):
+        feature_names = list(model.feature_names_in_)
+
+    path = os.path.join(registry_dir, name)
+    os.makedirs(path, exist_ok=True)
+    shutil.rmtree(os.path.join(path, COMPILED_DIR), ignore_errors=True)
+    if preprocessor is not None:
+        preprocessor.save(os.path.join(path, 'preprocessor.json'))
+
+    fmt = _model_format(model)
+    if fmt == 'catboost':
+        model.save_model(os.path.join(path, 'model.cbm'))
+    elif fmt == 'xgboost':
+        model.save_model(os.path.join(path, 'model.ubj'))
+    elif fmt == 'sklearn_trees':
+        _save_trees(model, path)
+    else:
+        with open(os.path.join(path, 'model.pkl'), 'wb') as f:
+            pickle.dump(model, f)
+
+    meta = {'name': name,
+            'format': fmt,
+            'class': f'{model.__class__.__module__}.'
+                     f'{model.__class__.__name__}',
+            'sklearn_version': sklearn.__version__,
+            'feature_names': feature_names,
+            'encodings': encodings,
+            'scores': scores,
+            'params': params,
+            'saved_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2, default=_json_default)
+
+    return path
+
+
+def load_metadata(name, registry_dir=REGISTRY_DIR):
+    '''
+    This function reads the metadata of a registered model
+    without loading the model.
+
+    Parameters
+    ----------
+    name: str, model name
+    registry_dir: str (default=REGISTRY_DIR)
+
+    Returns
+    -------
+    dict
+    '''
+    with open(os.path.join(registry_dir, name, 'meta.json')) as f:
+        return json.load(f)
+
+
+def list_models(registry_dir=REGISTRY_DIR):
+    '''
+    This function lists the registered models with their scores.
+
+    Parameters
+    ----------
+    registry_dir: str (default=REGISTRY_DIR)
+
+    Returns
+    -------
+    DataFrame
+    '''
+    rows = []
+    if os.path.isdir(registry_dir):
+        for name in sorted(os.listdir(registry_dir)):
+            if os.path.exists(os.path.join(registry_dir, name, 'meta.json')):
+                meta = load_metadata(name, registry_dir)
+                rows.append({'name': name, 'format': meta['format'],
+                             'class': meta['class'], **meta['scores']})
+    return pd.DataFrame(rows)
+
+
+def _load(name, registry_dir):
+    meta = load_metadata(name, registry_dir)
+    path = os.path.join(registry_dir, name)
+    module, cls = meta['class'].rsplit('.', 1)
+
+    if meta['format'] == 'catboost':
+        model = getattr(importlib.import_module(module), cls)()
+        model.load_model(os.path.join(path, 'model.cbm'))
+    elif meta['format'] == 'xgboost':
+        model = getattr(importlib.import_module(module), cls)()
+        model.load_model(os.path.join(path, 'model.ubj'))
+    elif meta['format'] == 'sklearn_trees':
+        model = _load_trees(path)
+    else:
+        with open(os.path.join(path, 'model.pkl'), 'rb') as f:
+            model = pickle.load(f)
+
+    return model
+
+
+class LazyModel:
+    '''
+    This class stands in for a registered model and only loads it
+    the first time one of its attributes (e.g. predict) is used.
+    The metadata is available right away.
+    '''
+    def __init__(self, name, registry_dir=REGISTRY_DIR):
+        self.name = name
+        self.registry_dir = registry_dir
+        self.meta = load_metadata(name, registry_dir)
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = _load(self.name, self.registry_dir)
+        return self._model
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr in ('_model', 'meta'):
+            raise AttributeError(attr)
+        return getattr(self.model, attr)
+
+
+def load_model(name, registry_dir=REGISTRY_DIR, lazy=False):
+    '''
+    This function loads a registered model.
+
+    Parameters
+    ----------
+    name: str, model name
+    registry_dir: str (default=REGISTRY_DIR)
+    lazy: boolean (default=False), True to get a LazyModel that loads
+          the model on first use
+
+    Returns
+    -------
+    model (or LazyModel)
+    '''
+    if lazy:
+        return LazyModel(name, registry_dir)
+    return _load(name, registry_dir)
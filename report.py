@@ -0,0 +1,381 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from collections import namedtuple
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from sklearn.model_selection import train_test_split
+import matplotlib.pyplot as plt
+import seaborn as sns
+from pipeline import frame_fingerprint, code_fingerprint
+from preprocessing import NFLPreprocessor
+from registry import REGISTRY_DIR, LazyModel
+from storage import save_cleaned, load_cleaned_table, frame_from_table
+from visualizations import *
+
+# a figure of the report: draw(df, models, **params) draws it with pyplot,
+# df holding the data columns it reads (all columns if None) and
+# models the registered models it uses, in order
+Figure = namedtuple('Figure', ['name', 'draw', 'columns', 'models',
+                               'params', 'transparent'],
+                    defaults=[(), {}, False])
+
+# cleaned data in the Arrow format (see storage.save_cleaned); written
+# from the csv next to it (Data/cleaned_nfl.csv) when it is missing
+REPORT_DATA = 'Data/cleaned_nfl.feather'
+REPORT_DIR = 'Images'
+# input keys of the figures last drawn, by image path
+REPORT_MANIFEST = 'Data/report_manifest.json'
+
+NUMERIC_FEATS = ['long_axis', 'short_axis', 'speed', 'accel',
+                 'Dis', 'Orientation', 'Dir', 'YardLine', 'Distance',
+                 'GameClock', 'HomeScoreBeforePlay', 'VisitorScoreBeforePlay',
+                 'DefendersInTheBox', 'PlayerHeight', 'PlayerWeight',
+                 'Temperature', 'Humidity', 'WindSpeed']
+BOX_COLS = ['Team', 'Season', 'PossessionTeam',
+            'FieldPosition', 'PlayDirection', 'StadiumType']
+
+
+def _draw_conf_mat(df, models, target='Yard_class', test_size=0.2,
+                   seed=220):
+    # as in the notebook: groups numbered 1 to 5 in YARD_ORDER,
+    # a numeric Season and train_test_split(X, y, stratify=y)
+    model, = models
+    df = df.assign(Season=df['Season'].astype(int))
+    y = df[target].map({label: i + 1
+                        for i, label in enumerate(YARD_ORDER)}).values
+    path = os.path.join(model.registry_dir, model.name, 'preprocessor.json')
+    if os.path.exists(path):
+        prep = NFLPreprocessor.load(path)
+    else:
+        # registered without its preprocessor: the notebook's label
+        # encoding is the one fitted on all the rows
+        prep = NFLPreprocessor(clean=False).fit(df)
+    _, test = train_test_split(np.arange(len(df)), test_size=test_size,
+                               stratify=y, random_state=seed)
+    # plot_conf_mat names the numbered groups
+    plot_conf_mat(y[test], model.predict(prep.transform(df.iloc[test])))
+
+
+def _draw_importance(df, models, top10=False, despine=False):
+    model, = models
+    plot_reg_feat_imp(model, model.meta['feature_names'], top10=top10)
+    if despine:
+        sns.despine(left=False, bottom=False)
+
+
+def _draw_distributions(df, models):
+    plot_distributions(df, NUMERIC_FEATS)
+
+
+def _draw_boxplots(df, models):
+    plot_boxplots(df, BOX_COLS)
+
+
+def _draw_target(df, models, target='Yards'):
+    plot_target_distribution(df, target)
+
+
+def _draw_group_count(df, models, column='Yard_class'):
+    plot_group_count(df, column, path=None)
+
+
+def _draw_two_subplots(df, models, col1, col2, size, num_type=1,
+                       order=None, rotate=None):
+    two_subplots(df, col1, col2, size, num_type, order, rotate)
+
+
+# the figures of the project, slowest first so they start early
+FIGURES = [Figure('conf_mat', _draw_conf_mat, None, ('rfc_v',)),
+           Figure('numeric_distributions', _draw_distributions,
+                  NUMERIC_FEATS),
+           Figure('Yards_Yard_class', _draw_two_subplots,
+                  ['Yards', 'Yard_class'], (),
+                  {'col1': 'Yards', 'col2': 'Yard_class', 'size': (12, 4),
+                   'num_type': 2, 'order': YARD_ORDER}),
+           Figure('StadiumType_Turf', _draw_two_subplots,
+                  ['StadiumType', 'Turf'], (),
+                  {'col1': 'StadiumType', 'col2': 'Turf', 'size': (10, 4)}),
+           Figure('Position_OffenseFormation', _draw_two_subplots,
+                  ['Position', 'OffenseFormation'], (),
+                  {'col1': 'Position', 'col2': 'OffenseFormation',
+                   'size': (15, 4), 'rotate': True}),
+           Figure('WindDirection_GameWeather', _draw_two_subplots,
+                  ['WindDirection', 'GameWeather'], (),
+                  {'col1': 'WindDirection', 'col2': 'GameWeather',
+                   'size': (15, 4), 'rotate': True}),
+           Figure('boxplots', _draw_boxplots, BOX_COLS + ['Yards']),
+           Figure('Yards', _draw_target, ['Yards'], transparent=True),
+           Figure('Yard_groups', _draw_group_count, ['Yard_class'],
+                  transparent=True),
+           Figure('xgbr_imp', _draw_importance, [], ('xgbr',)),
+           Figure('xgbr_imp_10', _draw_importance, [], ('xgbr',),
+                  {'top10': True, 'despine': True}),
+           Figure('rfc_vanilla_feats', _draw_importance, [], ('rfc_v',),
+                  {'despine': True}, True),
+           Figure('rfc_top10_feats', _draw_importance, [], ('rfc_v',),
+                  {'top10': True, 'despine': True}, True)]
+
+# data and models loaded by this process, kept between figures
+# and between reports (joblib reuses its worker processes)
+_loaded = {}
+
+
+def _table(data_path):
+    '''
+    This function memory-maps the data once per process. Every worker
+    maps the same file, so they share its pages instead of each holding
+    a copy.
+    '''
+    key = (os.path.abspath(data_path), os.stat(data_path).st_mtime_ns)
+    if _loaded.get('data_key') != key:
+        _loaded['data_key'] = key
+        _loaded['data'] = load_cleaned_table(data_path)
+    return _loaded['data']
+
+
+def _model(name, registry_dir, fingerprint):
+    '''
+    This function loads a registered model once per process
+    (again if it was saved since). Each worker holds its own copy
+    of the trees (see registry._load_trees).
+    '''
+    key = ('model', os.path.abspath(registry_dir), name)
+    cached = _loaded.get(key)
+    if cached is None or cached[0] != fingerprint:
+        cached = _loaded[key] = (fingerprint, LazyModel(name, registry_dir))
+    return cached[1]
+
+
+def registered_model_fingerprint(name, registry_dir=REGISTRY_DIR):
+    '''
+    This function hashes the names, sizes and modification times of the
+    files of a registered model, which change whenever it is saved again.
+
+    Parameters
+    ----------
+    name: str, model name
+    registry_dir: str (default=REGISTRY_DIR)
+
+    Returns
+    -------
+    str, hex digest (None if the model is not registered)
+    '''
+    path = os.path.join(registry_dir, name)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    digest = hashlib.sha256()
+    for f in sorted(os.listdir(path)):
+        st = os.stat(os.path.join(path, f))
+        digest.update(f'{f}:{st.st_size}:{st.st_mtime_ns}'.encode())
+    return digest.hexdigest()
+
+
+def figure_key(figure, column_prints, model_prints):
+    '''
+    This function builds the input key of a figure from the fingerprints
+    of the columns and models it reads, the code drawing it
+    (see pipeline.code_fingerprint) and its parameters.
+
+    Parameters
+    ----------
+    figure: Figure
+    column_prints: dict, column name -> fingerprint
+    model_prints: dict, model name -> fingerprint
+
+    Returns
+    -------
+    str, hex digest
+    '''
+    columns = column_prints if figure.columns is None else figure.columns
+    digest = hashlib.sha256(figure.name.encode())
+    digest.update(code_fingerprint(figure.draw).encode())
+    digest.update(repr(sorted(figure.params.items())).encode())
+    digest.update(repr(figure.transparent).encode())
+    for col in columns:
+        digest.update(f'{col}={column_prints[col]}'.encode())
+    for name in figure.models:
+        digest.update(f'{name}={model_prints[name]}'.encode())
+    return digest.hexdigest()
+
+
+def _draw_figure(figure, data_path, registry_dir, model_prints, path,
+                 parent_pid):
+    '''
+    This function draws one figure and saves it,
+    returning its wall time and the error, if any.
+    '''
+    # workers have no display; the calling process keeps its backend
+    if os.getpid() != parent_pid:
+        plt.switch_backend('agg')
+    start = time.perf_counter()
+    try:
+        table = _table(data_path)
+        columns = (table.column_names if figure.columns is None
+                   else figure.columns)
+        df = frame_from_table(table.select(columns), categorical=False)
+        models = [_model(name, registry_dir, model_prints[name])
+                  for name in figure.models]
+        with threadpool_limits(limits=1):
+            plt.figure()
+            figure.draw(df, models, **figure.params)
+            plt.savefig(path, bbox_inches='tight',
+                        transparent=figure.transparent)
+        error = None
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    finally:
+        plt.close('all')
+
+    return time.perf_counter() - start, error
+
+
+def report_data(data_path=REPORT_DATA):
+    '''
+    This function makes sure the Arrow copy of the cleaned data exists:
+    when it is missing, it is written from the csv saved next to it by
+    the cleaning notebook (e.g. Data/cleaned_nfl.csv).
+
+    Parameters
+    ----------
+    data_path: str (default=REPORT_DATA)
+
+    Returns
+    -------
+    str, data_path
+    '''
+    if not os.path.exists(data_path):
+        csv_path = os.path.splitext(data_path)[0] + '.csv'
+        if not os.path.exists(csv_path):
+            raise FileNotFoundError(f'neither {data_path} nor {csv_path} '
+                                    f'exists; run nfl_data_clean.ipynb')
+        save_cleaned(pd.read_csv(csv_path), data_path)
+    return data_path
+
+
+def build_report(figures=FIGURES, data_path=REPORT_DATA, out_dir=REPORT_DIR,
+                 registry_dir=REGISTRY_DIR, manifest_path=REPORT_MANIFEST,
+                 n_jobs=None, force=False, verbose=True):
+    '''
+    This function draws the figures of the project in parallel and saves
+    them as png files, skipping the figures whose data columns, models,
+    code and parameters did not change since they were last drawn.
+    The workers memory-map the data (saved with storage.save_cleaned),
+    load the registered models, and keep both between figures.
+
+    Parameters
+    ----------
+    figures: list of Figure (default=FIGURES)
+    data_path: str (default=REPORT_DATA), cleaned data in the Arrow format
+               (see report_data)
+    out_dir: str (default=REPORT_DIR), folder of the images
+    registry_dir: str (default=REGISTRY_DIR), folder of the models
+    manifest_path: str (default=REPORT_MANIFEST), keys of the drawn figures
+    n_jobs: int (default=None), number of worker processes; all cores
+            when None
+    force: boolean (default=False), True to draw every figure again
+    verbose: boolean (default=True), print the report
+
+    Returns
+    -------
+    DataFrame with the status (drawn, skipped, missing model or failed),
+    wall time and error of each figure
+    '''
+    data_path = report_data(data_path)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # fingerprints of the columns and models the figures use
+    table = load_cleaned_table(data_path)
+    used = set()
+    for figure in figures:
+        used |= set(table.column_names if figure.columns is None
+                    else figure.columns)
+    column_prints = {col: frame_fingerprint(frame_from_table(
+                         table.select([col]), categorical=False))
+                     for col in table.column_names if col in used}
+    model_prints = {name: registered_model_fingerprint(name, registry_dir)
+                    for figure in figures for name in figure.models}
+
+    rows = {}
+    todo = []
+    for figure in figures:
+        path = os.path.join(out_dir, f'{figure.name}.png')
+        missing = [name for name in figure.models
+                   if model_prints[name] is None]
+        if missing:
+            rows[figure.name] = {'status': 'missing model',
+                                 'error': ', '.join(missing)}
+            continue
+        key = figure_key(figure, column_prints, model_prints)
+        if not force and manifest.get(path) == key and os.path.exists(path):
+            rows[figure.name] = {'status': 'skipped'}
+            continue
+        todo.append((figure, path, key))
+
+    n_workers = max(1, min(n_jobs or os.cpu_count(), len(todo)))
+    results = Parallel(n_jobs=n_workers)(
+        delayed(_draw_figure)(figure, data_path, registry_dir, model_prints,
+                              path, os.getpid())
+        for figure, path, key in todo)
+
+    for (figure, path, key), (wall, error) in zip(todo, results):
+        if error is None:
+            manifest[path] = key
+            rows[figure.name] = {'status': 'drawn', 'wall_time': wall}
+        else:
+            manifest.pop(path, None)
+            rows[figure.name] = {'status': 'failed', 'wall_time': wall,
+                                 'error': error}
+
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    report = pd.DataFrame([{'figure': figure.name, **rows[figure.name]}
+                           for figure in figures]).set_index('figure')
+    if verbose:
+        print(report.round(3).to_string())
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Draw the figures of the project in parallel.')
+    parser.add_argument('--data', default=REPORT_DATA,
+                        help='cleaned data in the Arrow format')
+    parser.add_argument('--out', default=REPORT_DIR,
+                        help='folder of the images')
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    parser.add_argument('--manifest', default=REPORT_MANIFEST)
+    parser.add_argument('--n-jobs', type=int, default=None,
+                        help='number of worker processes (all cores)')
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='names of the figures to draw')
+    parser.add_argument('--force', action='store_true',
+                        help='draw the figures even if nothing changed')
+    args = parser.parse_args(argv)
+
+    figures = FIGURES
+    if args.only:
+        figures = [figure for figure in FIGURES if figure.name in args.only]
+
+    report = build_report(figures, args.data, args.out, args.registry,
+                          args.manifest, args.n_jobs, args.force)
+    return int((report['status'] == 'failed').any())
+
+
+if __name__ == '__main__':
+    # go through the imported module, so the workers find the figures
+    # by reference and keep what they loaded in its _loaded
+    import report
+    sys.exit(report.main())
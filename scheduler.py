@@ -0,0 +1,144 @@
+import pandas as pd
+import numpy as np
+import os
+import time
+from collections import namedtuple
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+
+# a model to fit: estimator.fit(X, y, **fit_params)
+# weight sets its share of the cores relative to the other jobs
+ModelJob = namedtuple('ModelJob', ['name', 'estimator', 'X', 'y',
+                                   'fit_params', 'weight'],
+                      defaults=[None, 1])
+
+
+def split_cores(n_cores, n_outer):
+    '''
+    This function splits a core budget between outer parallelism
+    (e.g. CV folds or concurrent models) and the threads of each model.
+
+    Parameters
+    ----------
+    n_cores: int, number of cores to use
+    n_outer: int, number of tasks that could run at the same time
+
+    Returns
+    -------
+    number of outer workers, number of threads per worker
+    '''
+    n_cores = max(1, n_cores)
+    outer = max(1, min(n_outer, n_cores))
+    return outer, max(1, n_cores // outer)
+
+
+def set_n_threads(estimator, n_threads):
+    '''
+    This function sets the number of threads a model uses,
+    whatever the library calls that parameter.
+    For a search object (e.g. RandomizedSearchCV), it sets the
+    threads of the model being searched.
+
+    Parameters
+    ----------
+    estimator: model
+    n_threads: int
+
+    Returns
+    -------
+    the same estimator
+    '''
+    params = estimator.get_params(deep=False)
+    if 'estimator' in params and 'cv' in params:
+        set_n_threads(params['estimator'], n_threads)
+    elif estimator.__class__.__module__.startswith('catboost'):
+        estimator.set_params(thread_count=n_threads)
+    elif 'n_jobs' in params:
+        estimator.set_params(n_jobs=n_threads)
+
+    return estimator
+
+
+def _run_job(job, n_threads):
+    '''
+    This function fits one job with its share of the cores
+    and measures its wall and CPU time.
+    '''
+    set_n_threads(job.estimator, n_threads)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    with threadpool_limits(limits=n_threads):
+        job.estimator.fit(job.X, job.y, **(job.fit_params or {}))
+
+    return job.estimator, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def allocate_cores(jobs, n_cores):
+    '''
+    This function gives each job a number of threads proportional to
+    its weight, with at least one thread per job.
+
+    Parameters
+    ----------
+    jobs: list of ModelJob
+    n_cores: int, number of cores to use
+
+    Returns
+    -------
+    list of int, threads per job
+    '''
+    weights = np.array([job.weight for job in jobs], dtype=float)
+    share = np.floor(n_cores * weights / weights.sum()).astype(int)
+    share = np.maximum(share, 1)
+
+    # hand out the cores lost to rounding, biggest jobs first
+    for i in np.argsort(-weights):
+        if share.sum() >= n_cores:
+            break
+        share[i] += 1
+
+    return share.tolist()
+
+
+def run_jobs(jobs, n_cores=None, verbose=True):
+    '''
+    This function fits independent models at the same time without
+    oversubscribing the machine: each job runs in its own process,
+    with its library threads (and BLAS/OpenMP pools) limited to its
+    share of the cores.
+    When there are more jobs than cores, they queue with one core each.
+
+    Parameters
+    ----------
+    jobs: list of ModelJob
+    n_cores: int (default=None), number of cores to use; all when None
+    verbose: boolean (default=True), print the report
+
+    Returns
+    -------
+    dict of fitted models by job name, DataFrame with the cores,
+    wall time, CPU time and CPU use of each job
+    '''
+    n_cores = n_cores or os.cpu_count()
+    n_workers, _ = split_cores(n_cores, len(jobs))
+    if len(jobs) <= n_cores:
+        threads = allocate_cores(jobs, n_cores)
+    else:
+        threads = [1] * len(jobs)
+
+    results = Parallel(n_jobs=n_workers)(
+        delayed(_run_job)(job, n) for job, n in zip(jobs, threads))
+
+    models = {}
+    report = []
+    for job, n, (model, wall, cpu) in zip(jobs, threads, results):
+        models[job.name] = model
+        report.append({'job': job.name, 'cores': n,
+                       'wall_time': wall, 'cpu_time': cpu,
+                       'cpu_use': cpu / (wall * n) if wall else np.nan})
+    report = pd.DataFrame(report).set_index('job')
+
+    if verbose:
+        print(report.round(3))
+
+    return models, report
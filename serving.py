@@ -0,0 +1,328 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import time
+import queue
+import threading
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from helper import RAW_DTYPES
+from synthetic import RAW_COLUMNS
+from preprocessing import NFLPreprocessor, TARGET_COLS
+from registry import REGISTRY_DIR, load_model, load_metadata
+from inference import load_compiled
+
+
+class MicroBatcher:
+    '''
+    This class groups the rows of requests that arrive at about the
+    same time into one batch, so the model predicts them in a single
+    vectorized call.
+    When a batch fails, its requests are predicted one by one,
+    so an error only reaches the request that caused it.
+
+    Parameters
+    ----------
+    predict: function, list of rows (dicts) -> array of row predictions
+    max_rows: int (default=22*1024), most rows in a batch
+    max_wait: float (default=0.002), seconds to wait for more requests
+    '''
+    def __init__(self, predict, max_rows=22*1024, max_wait=0.002):
+        self.predict = predict
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, rows):
+        '''
+        This function queues rows and waits for their predictions.
+
+        Parameters
+        ----------
+        rows: list of dicts, one per row
+
+        Returns
+        -------
+        array of row predictions
+        '''
+        request = {'rows': rows, 'done': threading.Event()}
+        self.requests.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['result']
+
+    def _run(self, batch):
+        '''
+        This function predicts a batch of requests in one call, or one
+        request at a time if that fails.
+        '''
+        try:
+            preds = self.predict([row for r in batch for row in r['rows']])
+            end = 0
+            for request in batch:
+                start, end = end, end + len(request['rows'])
+                request['result'] = preds[start:end]
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0]['error'] = e
+            else:
+                for request in batch:
+                    self._run([request])
+
+    def _loop(self):
+        while True:
+            batch = [self.requests.get()]
+            n_rows = len(batch[0]['rows'])
+            deadline = time.perf_counter() + self.max_wait
+            while n_rows < self.max_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                n_rows += len(request['rows'])
+
+            self._run(batch)
+            for request in batch:
+                request['done'].set()
+
+
+class ScoringService:
+    '''
+    This class scores raw handoff plays (train.csv schema) with a
+    registered model: rows are cleaned and encoded by the model's
+    fitted NFLPreprocessor, predicted in micro-batches, and averaged
+    over the 22 rows of each play.
+    It keeps latency and throughput counters.
+
+    Parameters
+    ----------
+    model_name: str, name of the model in the registry
+    registry_dir: str (default=REGISTRY_DIR)
+    max_rows: int (default=22*1024), most rows in a batch
+    max_wait: float (default=0.002), seconds to wait for more requests
+    compiled: boolean (default=False), True to predict with the model
+              compiled into flat node arrays (see inference.py): much
+              faster for batches of a few plays, slower for thousands
+              of rows, so use it with a small max_rows; the node
+              arrays are memory-mapped and shared between processes
+    '''
+    def __init__(self, model_name, registry_dir=REGISTRY_DIR,
+                 max_rows=22*1024, max_wait=0.002, compiled=False):
+        if compiled:
+            self.model = load_compiled(model_name, registry_dir)
+            self.is_classifier = self.model.classes_ is not None
+        else:
+            self.model = load_model(model_name, registry_dir)
+            self.is_classifier = hasattr(self.model, 'predict_proba')
+        self.meta = load_metadata(model_name, registry_dir)
+        self.preprocessor = NFLPreprocessor.load(
+            os.path.join(registry_dir, model_name, 'preprocessor.json'))
+        if self.preprocessor.clean:
+            self.input_columns = [col for col in RAW_COLUMNS
+                                  if col not in TARGET_COLS]
+        else:
+            self.input_columns = self.preprocessor.columns_ + ['PlayId']
+        self.batcher = MicroBatcher(self._predict, max_rows, max_wait)
+
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=10000)
+        self.n_requests = 0
+        self.n_plays = 0
+        self.started = time.time()
+
+    def _check(self, rows):
+        '''
+        This function checks that every row of one request has the
+        columns the preprocessor reads, so a malformed request fails
+        on its own instead of in a batch.
+        The rows stay dicts: one DataFrame is built per batch, which is
+        much faster than one per request.
+        '''
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.to_dict('records')
+        if not len(rows):
+            raise ValueError('no rows')
+        missing = {col for row in rows for col in self.input_columns
+                   if col not in row}
+        if missing:
+            raise ValueError(f'missing columns: {sorted(missing)}')
+        return rows
+
+    def _predict(self, rows):
+        rows = pd.DataFrame(rows)
+        # strings from JSON are cast once per batch, as read_plays does
+        for col, dtype in RAW_DTYPES.items():
+            if col in rows.columns:
+                rows[col] = rows[col].where(rows[col].isna(),
+                                            rows[col].astype(dtype))
+        X = self.preprocessor.transform(rows)
+        if self.is_classifier:
+            return self.model.predict_proba(X)
+        return np.asarray(self.model.predict(X), dtype=float).reshape(-1, 1)
+
+    def score(self, rows):
+        '''
+        This function scores the rows of one or more plays.
+
+        Parameters
+        ----------
+        rows: list of dicts or DataFrame, raw rows (train.csv schema)
+
+        Returns
+        -------
+        dict with the PlayIds and, per play, the predicted yards
+        or the probability of each yard class
+        '''
+        start = time.perf_counter()
+        rows = self._check(rows)
+        preds = self.batcher.submit(rows)
+        play_ids = np.array([row['PlayId'] for row in rows])
+        plays, play_ids = pd.factorize(play_ids)
+        per_play = np.zeros((len(play_ids), preds.shape[1]))
+        np.add.at(per_play, plays, preds)
+        per_play /= np.bincount(plays)[:, None]
+        if self.is_classifier:
+            out = {'PlayId': play_ids.tolist(),
+                   'classes': [str(c) for c in self.model.classes_],
+                   'probabilities': per_play.tolist()}
+        else:
+            out = {'PlayId': play_ids.tolist(),
+                   'yards': per_play[:, 0].tolist()}
+
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+            self.n_requests += 1
+            self.n_plays += len(play_ids)
+        return out
+
+    def metrics(self):
+        '''
+        This function reports the latency percentiles (ms)
+        and the throughput since the service started.
+
+        Returns
+        -------
+        dict
+        '''
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            elapsed = time.time() - self.started
+            return {'requests': self.n_requests,
+                    'plays': self.n_plays,
+                    'plays_per_sec': self.n_plays / elapsed,
+                    'p50_ms': float(np.percentile(latencies, 50))
+                    if len(latencies) else None,
+                    'p99_ms': float(np.percentile(latencies, 99))
+                    if len(latencies) else None}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def _send(self, code, body):
+        body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send(200, self.server.service.metrics())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+            rows = json.loads(self.rfile.read(length))['rows']
+            self._send(200, self.server.service.score(rows))
+        except Exception as e:
+            self._send(400, {'error': str(e)})
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # room for many clients connecting at once
+    request_queue_size = 1024
+
+
+def serve(model_name, host='127.0.0.1', port=8000,
+          registry_dir=REGISTRY_DIR, **batch_params):
+    '''
+    This function starts the scoring service over HTTP.
+    POST /predict with {"rows": [...]} returns the predictions,
+    GET /metrics returns the latency and throughput counters.
+
+    Parameters
+    ----------
+    model_name: str, name of the model in the registry
+    host: str (default='127.0.0.1')
+    port: int (default=8000)
+    registry_dir: str (default=REGISTRY_DIR)
+    batch_params: passed to ScoringService (max_rows, max_wait)
+
+    Returns
+    -------
+    the HTTP server (already serving in a background thread)
+    '''
+    server = _Server((host, port), _Handler)
+    server.service = ScoringService(model_name, registry_dir, **batch_params)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def load_test(url, plays, n_requests=1000, concurrency=16):
+    '''
+    This function sends many requests to the scoring service at once
+    and reports the throughput and latency seen by the clients.
+
+    Parameters
+    ----------
+    url: str, e.g. 'http://127.0.0.1:8000'
+    plays: list of DataFrames, raw rows of the plays to send
+           (one request per play, cycling through the list)
+    n_requests: int (default=1000)
+    concurrency: int (default=16), requests in flight at the same time
+
+    Returns
+    -------
+    dict with plays per second and p50/p99 latency (ms)
+    '''
+    bodies = [json.dumps({'rows': json.loads(p.to_json(orient='records'))})
+              .encode() for p in plays]
+
+    def send(i):
+        start = time.perf_counter()
+        request = urllib.request.Request(
+            url + '/predict', data=bodies[i % len(bodies)],
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            n_plays = len(json.loads(response.read())['PlayId'])
+        return time.perf_counter() - start, n_plays
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(send, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([r[0] for r in results]) * 1000
+    report = {'plays_per_sec': sum(r[1] for r in results) / elapsed,
+              'p50_ms': float(np.percentile(latencies, 50)),
+              'p99_ms': float(np.percentile(latencies, 99))}
+    print(report)
+    return report
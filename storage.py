@@ -0,0 +1,124 @@
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+def compact_dtypes(df):
+    '''
+    This function shrinks the dtypes of a cleaned DataFrame
+    without losing information:
+    text columns become categoricals,
+    floats become float32 when every value survives the round trip,
+    and integers get the smallest integer type that fits.
+
+    Parameters
+    ----------
+    df: DataFrame
+
+    Returns
+    -------
+    DataFrame with compact dtypes
+    '''
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == 'O':
+            df[col] = df[col].astype('category')
+        elif df[col].dtype == np.float64:
+            values = df[col].values
+            small = values.astype(np.float32)
+            same = (small.astype(np.float64) == values) | np.isnan(values)
+            if same.all():
+                df[col] = small
+        elif pd.api.types.is_integer_dtype(df[col].dtype):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+
+    return df
+
+
+def save_cleaned(df, path='Data/cleaned_nfl.feather'):
+    '''
+    This function saves the cleaned data in the Arrow (Feather) format,
+    with categoricals stored as dictionary-encoded columns.
+    The file is left uncompressed so it can be memory-mapped.
+
+    Parameters
+    ----------
+    df: DataFrame, cleaned data
+    path: str (default='Data/cleaned_nfl.feather'), path of the file
+
+    Returns
+    -------
+    None
+    '''
+    table = pa.Table.from_pandas(compact_dtypes(df), preserve_index=False)
+    feather.write_feather(table, path, compression='uncompressed')
+
+
+def load_cleaned_table(path='Data/cleaned_nfl.feather', columns=None):
+    '''
+    This function memory-maps the cleaned data as an Arrow table.
+    No data is copied until the columns are used.
+
+    Parameters
+    ----------
+    path: str (default='Data/cleaned_nfl.feather'), path of the file
+    columns: list (default=None), columns to read; all when None
+
+    Returns
+    -------
+    pyarrow Table
+    '''
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+def load_cleaned(path='Data/cleaned_nfl.feather', columns=None,
+                 exclude=None, categorical=True):
+    '''
+    This function loads the cleaned data into a DataFrame,
+    reading only the requested columns.
+
+    Parameters
+    ----------
+    path: str (default='Data/cleaned_nfl.feather'), path of the file
+    columns: list (default=None), columns to read; all when None
+    exclude: list (default=None), columns to leave out
+             (e.g. ['Yard_class'] for regression)
+    categorical: boolean (default=True), False to turn categoricals
+                 back into object columns, as read from the csv
+
+    Returns
+    -------
+    DataFrame
+    '''
+    if exclude:
+        if columns is None:
+            with pa.memory_map(path) as source:
+                columns = pa.ipc.open_file(source).schema.names
+        columns = [col for col in columns if col not in exclude]
+
+    return frame_from_table(load_cleaned_table(path, columns), categorical)
+
+
+def frame_from_table(table, categorical=True):
+    '''
+    This function turns an Arrow table of the cleaned data
+    into a DataFrame.
+
+    Parameters
+    ----------
+    table: pyarrow Table, e.g. from load_cleaned_table
+    categorical: boolean (default=True), False to turn categoricals
+                 back into object columns, as read from the csv
+
+    Returns
+    -------
+    DataFrame
+    '''
+    df = table.to_pandas(split_blocks=True)
+    if not categorical:
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(object)
+
+    return df
@@ -0,0 +1,412 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import argparse
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from helper import STADIUM_TYPES, TURF_TYPES, WEATHER_NAMES, CITY_NAMES
+
+# columns of train.csv, in order
+RAW_COLUMNS = ['GameId', 'PlayId', 'Team', 'X', 'Y', 'S', 'A', 'Dis',
+               'Orientation', 'Dir', 'NflId', 'DisplayName', 'JerseyNumber',
+               'Season', 'YardLine', 'Quarter', 'GameClock', 'PossessionTeam',
+               'Down', 'Distance', 'FieldPosition', 'HomeScoreBeforePlay',
+               'VisitorScoreBeforePlay', 'NflIdRusher', 'OffenseFormation',
+               'OffensePersonnel', 'DefendersInTheBox', 'DefensePersonnel',
+               'PlayDirection', 'TimeHandoff', 'TimeSnap', 'Yards',
+               'PlayerHeight', 'PlayerWeight', 'PlayerBirthDate',
+               'PlayerCollegeName', 'Position', 'HomeTeamAbbr',
+               'VisitorTeamAbbr', 'Week', 'Stadium', 'Location',
+               'StadiumType', 'Turf', 'GameWeather', 'Temperature',
+               'Humidity', 'WindSpeed', 'WindDirection']
+
+# plays in the Kaggle train.csv (509762 rows), the size of scale=1
+KAGGLE_PLAYS = 23171
+
+TEAMS = ['ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE',
+         'DAL', 'DEN', 'DET', 'GB', 'HOU', 'IND', 'JAX', 'KC',
+         'LA', 'LAC', 'MIA', 'MIN', 'NE', 'NO', 'NYG', 'NYJ',
+         'OAK', 'PHI', 'PIT', 'SEA', 'SF', 'TB', 'TEN', 'WAS']
+
+# PossessionTeam and FieldPosition spell these teams differently
+POSSESSION_ABBRS = {'ARI': 'ARZ', 'BAL': 'BLT', 'CLE': 'CLV', 'HOU': 'HST'}
+
+WEEKS_PER_SEASON = 17
+GAMES_PER_WEEK = len(TEAMS) // 2
+
+# messy text columns: (common values with their probabilities, variants);
+# the probability left over is shared by the variants, which include
+# every spelling rename_elements handles
+STADIUM_POOL = ({'Outdoor': 0.5, 'Outdoors': 0.1, 'Indoors': 0.05,
+                 'Dome': 0.05, 'Retractable Roof': 0.05, np.nan: 0.06},
+                list(STADIUM_TYPES))
+TURF_POOL = ({'Grass': 0.45, 'Field Turf': 0.15, 'FieldTurf': 0.1,
+              'Natural Grass': 0.1}, list(TURF_TYPES))
+WEATHER_POOL = ({'Cloudy': 0.15, 'Sunny': 0.15, 'Partly Cloudy': 0.1,
+                 'Clear and warm': 0.05, 'Mostly Sunny': 0.05,
+                 'Clear and cold': 0.03, 'Rain': 0.03, 'Showers': 0.02,
+                 'Snow': 0.01, 'Fair': 0.02, np.nan: 0.09},
+                list(WEATHER_NAMES))
+WIND_SPEED_POOL = ({**{str(i): 0.04 for i in range(20)}, np.nan: 0.1},
+                   ['4 MPh', '10mph', '7 mph', '11-17', '10-20', 'Calm',
+                    '15 gusts up to 25', '14 Gusting to 24', 'SSW', 'E',
+                    'SE'])
+WIND_DIRECTION_POOL = ({**{d: 0.05 for d in
+                           ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW',
+                            'NNE', 'ENE', 'ESE', 'SSE', 'SSW', 'WSW',
+                            'WNW', 'NNW']}, np.nan: 0.1},
+                       ['From S', 'North', 'NorthEast', 'West-Southwest',
+                        'from W', 'Calm', 'W-NW', 'From SSW', 'South',
+                        'East North East', 's', 'n', '1', '8', '13'])
+LOCATION_POOL = ({}, list(CITY_NAMES) + sorted(set(CITY_NAMES.values())))
+
+FORMATIONS = ['SINGLEBACK', 'SHOTGUN', 'I_FORM', 'PISTOL', 'JUMBO',
+              'WILDCAT', 'EMPTY', 'ACE', np.nan]
+FORMATION_P = [0.35, 0.35, 0.15, 0.05, 0.04, 0.02, 0.01, 0.02, 0.01]
+
+OFFENSE_PERSONNEL = ['1 RB, 1 TE, 3 WR', '1 RB, 2 TE, 2 WR',
+                     '2 RB, 1 TE, 2 WR', '1 RB, 3 TE, 1 WR',
+                     '6 OL, 1 RB, 1 TE, 2 WR']
+DEFENSE_PERSONNEL = ['4 DL, 2 LB, 5 DB', '4 DL, 3 LB, 4 DB',
+                     '3 DL, 4 LB, 4 DB', '2 DL, 4 LB, 5 DB',
+                     '3 DL, 3 LB, 5 DB']
+
+# positions of the 11 players of each side, by slot;
+# the running back (offense slot 0) carries the ball
+OFFENSE_POSITIONS = ['RB', 'QB', 'WR', 'WR', 'WR', 'TE', 'C', 'G', 'G',
+                     'T', 'OT']
+DEFENSE_POSITIONS = ['DE', 'DE', 'DT', 'NT', 'OLB', 'ILB', 'MLB', 'CB',
+                     'CB', 'SS', 'FS']
+
+# players on a team's roster for every slot
+DEPTH = 2
+
+# every 'MM:SS:00' value of the game clock
+CLOCKS = np.array([f'{m:02d}:{s:02d}:00' for m in range(16)
+                   for s in range(60)][:15*60 + 1], dtype=object)
+
+
+def _pool_arrays(pool):
+    '''
+    This function turns a (common values, variants) pool into
+    an array of values and their probabilities.
+    '''
+    common, variants = pool
+    values = list(common) + [v for v in variants if v not in common]
+    n_rare = len(values) - len(common)
+    p_rare = (1 - sum(common.values())) / max(1, n_rare)
+    p = np.array(list(common.values()) + [p_rare] * n_rare)
+    return np.array(values, dtype=object), p / p.sum()
+
+
+def _pick(rng, pool, size):
+    values, p = _pool_arrays(pool)
+    return values[rng.choice(len(values), size=size, p=p)]
+
+
+def make_rosters(seed=220):
+    '''
+    This function makes the players of every team: DEPTH players for
+    each of the 11 offense and 11 defense slots.
+    Their attributes are drawn once, so a player keeps them in every play.
+
+    Parameters
+    ----------
+    seed: int (default=220), random seed
+
+    Returns
+    -------
+    dict of arrays (train.csv player columns), indexed by
+    ((team*2 + side)*11 + slot)*DEPTH + depth, side 0 being the offense
+    '''
+    rng = np.random.default_rng([seed, 0])
+    n = len(TEAMS) * 2 * 11 * DEPTH
+    player = np.arange(n)
+    depth = player % DEPTH
+    slot = (player // DEPTH) % 11
+    side = (player // (11 * DEPTH)) % 2
+    nfl_id = 2500000 + player
+
+    feet = np.where(rng.random(n) < 0.7, 6, 5)
+    inches = np.where(feet == 6, rng.integers(0, 7, n),
+                      rng.integers(8, 12, n))
+    birth = (np.datetime64('1985-01-01')
+             + rng.integers(0, 365*12, n).astype('timedelta64[D]'))
+    linemen = ((side == 0) & (slot >= 6)) | ((side == 1) & (slot <= 3))
+    colleges = np.array([f'College {i}' for i in range(120)], dtype=object)
+
+    position = np.where(side == 0,
+                        np.array(OFFENSE_POSITIONS, dtype=object)[slot],
+                        np.array(DEFENSE_POSITIONS, dtype=object)[slot])
+    # the backup safeties are listed as SAF, like some players in train.csv
+    position[(side == 1) & (slot == 10) & (depth == 1)] = 'SAF'
+
+    return {'NflId': nfl_id,
+            'DisplayName': np.array([f'Player {i}' for i in nfl_id],
+                                    dtype=object),
+            'JerseyNumber': rng.integers(1, 100, n),
+            'PlayerHeight': np.array([f'{f}-{i}' for f, i
+                                      in zip(feet, inches)], dtype=object),
+            'PlayerWeight': np.where(linemen, rng.integers(280, 350, n),
+                                     rng.integers(180, 260, n)),
+            'PlayerBirthDate': np.array(pd.to_datetime(birth)
+                                        .strftime('%m/%d/%Y'), dtype=object),
+            'PlayerCollegeName': colleges[rng.integers(0, len(colleges), n)],
+            'Position': position}
+
+
+def make_week(week, seed=220, plays_per_game=45, rosters=None):
+    '''
+    This function makes the raw rows of all the games of one week
+    (every team plays once), 22 rows per play.
+    A week only depends on its number and the seed,
+    so weeks can be made separately and in any order.
+
+    Parameters
+    ----------
+    week: int, number of the week counted from the first week of 2017
+    seed: int (default=220), random seed
+    plays_per_game: int (default=45), handoff plays per game
+    rosters: dict (default=None), output of make_rosters(seed)
+
+    Returns
+    -------
+    DataFrame (GAMES_PER_WEEK*plays_per_game*22 rows)
+    '''
+    rng = np.random.default_rng([seed, 1, week])
+    if rosters is None:
+        rosters = make_rosters(seed)
+    teams = np.array(TEAMS, dtype=object)
+    season, week_of_season = divmod(week, WEEKS_PER_SEASON)
+    n_games = GAMES_PER_WEEK
+    n_plays = n_games * plays_per_game
+    n_rows = n_plays * 22
+
+    # games; a GameId is the date (YYYYMMDD) and a 2 digit counter
+    home, away = rng.permutation(len(TEAMS)).reshape(2, n_games)
+    date = (np.datetime64(f'{2017 + season}-09-07')
+            + np.timedelta64(7 * week_of_season, 'D'))
+    game_ids = int(str(date).replace('-', '')) * 100 + np.arange(n_games)
+    stadium_type = _pick(rng, STADIUM_POOL, n_games)
+    weather = _pick(rng, WEATHER_POOL, n_games)
+    indoor = np.array([STADIUM_TYPES.get(s) == 'Indoor'
+                       for s in stadium_type])
+    weather[indoor & (rng.random(n_games) < 0.8)] = 'Controlled Climate'
+    games = {'GameId': game_ids,
+             'HomeTeamAbbr': teams[home],
+             'VisitorTeamAbbr': teams[away],
+             'Season': np.full(n_games, 2017 + season),
+             'Week': np.full(n_games, 1 + week_of_season),
+             'Stadium': np.array([f'{t} Stadium' for t in teams[home]],
+                                 dtype=object),
+             'Location': _pick(rng, LOCATION_POOL, n_games),
+             'StadiumType': stadium_type,
+             'Turf': _pick(rng, TURF_POOL, n_games),
+             'GameWeather': weather,
+             'Temperature': np.where(rng.random(n_games) < 0.08, np.nan,
+                                     rng.integers(10, 95, n_games)),
+             'Humidity': np.where(rng.random(n_games) < 0.08, np.nan,
+                                  rng.integers(0, 100, n_games)),
+             'WindSpeed': _pick(rng, WIND_SPEED_POOL, n_games),
+             'WindDirection': _pick(rng, WIND_DIRECTION_POOL, n_games)}
+
+    # plays
+    game = np.repeat(np.arange(n_games), plays_per_game)
+    play_index = np.tile(np.arange(plays_per_game), n_games)
+    offense_home = rng.random(n_plays) < 0.5
+    offense = np.where(offense_home, home[game], away[game])
+    defense = np.where(offense_home, away[game], home[game])
+    poss = pd.Series(teams[offense]).replace(POSSESSION_ABBRS).values
+    defn = pd.Series(teams[defense]).replace(POSSESSION_ABBRS).values
+    yard_line = rng.integers(1, 51, n_plays)
+    own_side = rng.random(n_plays) < 0.5
+    field_position = np.where(own_side, poss, defn).astype(object)
+    field_position[yard_line == 50] = np.nan
+    direction = np.where(rng.random(n_plays) < 0.5, 'left', 'right')
+    snap = (np.datetime64(f'{date}T17:00:00')
+            + rng.integers(0, 3*3600, n_plays).astype('timedelta64[s]'))
+    yards = np.clip(np.round(rng.gamma(1.6, 2.8, n_plays) - 1.5
+                             + rng.normal(0, 1.5, n_plays)), -15, 99)
+    plays = {'PlayId': game_ids[game] * 10000 + 36 + play_index * 20,
+             'YardLine': yard_line,
+             'Quarter': 1 + np.minimum(play_index * 4 // plays_per_game, 3),
+             'GameClock': CLOCKS[rng.integers(0, len(CLOCKS), n_plays)],
+             'PossessionTeam': poss,
+             'Down': rng.integers(1, 5, n_plays),
+             'Distance': rng.integers(1, 20, n_plays),
+             'FieldPosition': field_position,
+             'HomeScoreBeforePlay': rng.integers(0, 40, n_plays),
+             'VisitorScoreBeforePlay': rng.integers(0, 40, n_plays),
+             'OffenseFormation': np.array(FORMATIONS, dtype=object)[
+                 rng.choice(len(FORMATIONS), n_plays, p=FORMATION_P)],
+             'OffensePersonnel': np.array(OFFENSE_PERSONNEL, dtype=object)[
+                 rng.integers(0, len(OFFENSE_PERSONNEL), n_plays)],
+             'DefendersInTheBox': np.where(rng.random(n_plays) < 0.003,
+                                           np.nan,
+                                           rng.integers(4, 10, n_plays)),
+             'DefensePersonnel': np.array(DEFENSE_PERSONNEL, dtype=object)[
+                 rng.integers(0, len(DEFENSE_PERSONNEL), n_plays)],
+             'PlayDirection': direction.astype(object),
+             'TimeHandoff': np.datetime_as_string(snap + 1).astype(object)
+                            + '.000Z',
+             'TimeSnap': np.datetime_as_string(snap).astype(object)
+                         + '.000Z',
+             'Yards': yards.astype(int)}
+
+    # players: 11 home rows then 11 away rows in every play
+    play = np.repeat(np.arange(n_plays), 22)
+    slot = np.tile(np.arange(22), n_plays)
+    is_home = slot < 11
+    on_offense = is_home == offense_home[play]
+    team = np.where(is_home, home[game[play]], away[game[play]])
+    player = (((team*2 + ~on_offense)*11 + slot % 11)*DEPTH
+              + rng.integers(0, DEPTH, n_rows))
+    # the ball carrier is the offense's running back
+    rusher = player[np.arange(n_plays)*22 + np.where(offense_home, 0, 11)]
+
+    # players line up around the line of scrimmage
+    line = 10 + np.where(own_side, yard_line, 100 - yard_line)[play]
+    behind = np.where(slot % 11 == 0, rng.uniform(4, 8, n_rows),
+                      rng.uniform(0.5, 3, n_rows))
+    x = np.where(on_offense, line - behind,
+                 line + rng.uniform(0.5, 12, n_rows))
+    x = np.where(direction[play] == 'left', 120 - x, x)
+
+    df = pd.DataFrame({
+        'Team': np.where(is_home, 'home', 'away').astype(object),
+        'X': np.round(x, 2),
+        'Y': np.round(np.clip(rng.normal(26.65, 9, n_rows), 0, 53.3), 2),
+        'S': np.round(rng.gamma(2, 1.2, n_rows), 2),
+        'A': np.round(rng.gamma(2, 0.8, n_rows), 2),
+        'Dis': np.round(rng.uniform(0, 0.8, n_rows), 2),
+        'Orientation': np.where(rng.random(n_rows) < 0.0001, np.nan,
+                                np.round(rng.uniform(0, 360, n_rows), 2)),
+        'Dir': np.where(rng.random(n_rows) < 0.0001, np.nan,
+                        np.round(rng.uniform(0, 360, n_rows), 2))})
+    for col, values in rosters.items():
+        df[col] = values[player]
+    for col, values in plays.items():
+        df[col] = values[play]
+    for col, values in games.items():
+        df[col] = values[game[play]]
+    df['NflIdRusher'] = rosters['NflId'][rusher][play]
+
+    return df[RAW_COLUMNS]
+
+
+def iter_raw_chunks(n_plays, seed=220, plays_per_game=45,
+                    chunk_rows=1000000):
+    '''
+    This function makes n_plays plays of raw rows, week after week,
+    and yields them in chunks of whole weeks.
+    The rows are the same whatever the chunk size.
+
+    Parameters
+    ----------
+    n_plays: int, number of plays
+    seed: int (default=220), random seed
+    plays_per_game: int (default=45), handoff plays per game
+    chunk_rows: int (default=1000000), about how many rows per chunk
+
+    Returns
+    -------
+    generator of DataFrames
+    '''
+    rosters = make_rosters(seed)
+    plays_per_week = GAMES_PER_WEEK * plays_per_game
+    n_weeks = -(-n_plays // plays_per_week)
+    weeks_per_chunk = max(1, chunk_rows // (plays_per_week * 22))
+
+    for start in range(0, n_weeks, weeks_per_chunk):
+        weeks = range(start, min(start + weeks_per_chunk, n_weeks))
+        chunk = pd.concat([make_week(w, seed, plays_per_game, rosters)
+                           for w in weeks], ignore_index=True)
+        # the last week is cut to the number of plays asked for
+        yield chunk.iloc[:(n_plays - start*plays_per_week) * 22]
+
+
+def make_raw_frame(n_plays, seed=220, plays_per_game=45):
+    '''
+    This function makes fake raw data with the same columns and
+    the same kinds of messy values as train.csv: 22 rows per play,
+    with the rusher's NflId in NflIdRusher.
+
+    Parameters
+    ----------
+    n_plays: int, number of plays
+    seed: int (default=220), random seed
+    plays_per_game: int (default=45), handoff plays per game
+
+    Returns
+    -------
+    DataFrame (22*n_plays rows)
+    '''
+    return pd.concat(iter_raw_chunks(n_plays, seed, plays_per_game),
+                     ignore_index=True)
+
+
+def write_raw_csv(path, scale=1.0, seed=220, plays_per_game=45,
+                  chunk_rows=1000000, verbose=True):
+    '''
+    This function writes fake raw data to a csv file one chunk at a time,
+    so the size is only limited by the disk.
+    scale=1 makes as many plays as the Kaggle train.csv;
+    bigger scales go on to the seasons after 2018.
+
+    Parameters
+    ----------
+    path: str, path of the csv file
+    scale: float (default=1.0), number of plays relative to train.csv
+    seed: int (default=220), random seed
+    plays_per_game: int (default=45), handoff plays per game
+    chunk_rows: int (default=1000000), about how many rows per chunk
+    verbose: boolean (default=True), print the progress
+
+    Returns
+    -------
+    number of rows written
+    '''
+    n_plays = max(1, round(scale * KAGGLE_PLAYS))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    # Arrow writes csv several times faster than DataFrame.to_csv
+    writer = None
+    n_rows = 0
+    try:
+        for chunk in iter_raw_chunks(n_plays, seed, plays_per_game,
+                                     chunk_rows):
+            if writer is None:
+                schema = pa.Schema.from_pandas(chunk, preserve_index=False)
+                writer = pa_csv.CSVWriter(
+                    path, schema,
+                    write_options=pa_csv.WriteOptions(quoting_style='needed'))
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema,
+                                                    preserve_index=False))
+            n_rows += len(chunk)
+            if verbose:
+                print(f'{n_rows}/{n_plays * 22} rows written')
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Write fake raw handoff data in the train.csv schema.')
+    parser.add_argument('path', help='path of the csv file')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='number of plays relative to train.csv')
+    parser.add_argument('--seed', type=int, default=220)
+    parser.add_argument('--chunk-rows', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    write_raw_csv(args.path, args.scale, args.seed,
+                  chunk_rows=args.chunk_rows)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+import json
+import numpy as np
+from benchmarks import (compare_to_baseline, peak_rss, run_benchmarks,
+                        save_baseline)
+
+
+def test_peak_rss_sees_native_allocations():
+    # numpy's buffer is allocated outside the Python allocator's pools
+    peak = peak_rss(lambda: np.ones(2**25).sum())
+    assert peak > 2**28 * 0.9
+
+
+def test_benchmarks_compare_to_their_baseline(tmp_path):
+    results = run_benchmarks(sizes=(2200,), model_max_rows=2200, repeat=1,
+                             verbose=False)
+    assert {'clean_frame', 'catboost_classifier.fit',
+            'xgboost_regressor.predict'} <= set(results['case'])
+    assert (results['peak_mb'] >= 0).all()
+
+    path = tmp_path / 'baseline.json'
+    save_baseline(results, str(path))
+    compared = compare_to_baseline(results, str(path))
+    assert not compared['regressed'].any()
+    assert (compared['time_ratio'] == 1).all()
+
+    # a case twice as slow and one using twice the memory regress
+    baseline = json.loads(path.read_text())
+    baseline['clean_frame@2200']['time'] /= 2
+    baseline['catboost_classifier.fit@2200']['peak_mb'] /= 2
+    path.write_text(json.dumps(baseline))
+    slower = results.copy()
+    slower.loc[slower['case'] == 'clean_frame', 'time'] += 0.02
+    compared = compare_to_baseline(slower, str(path))
+    assert (set(compared.loc[compared['regressed'], 'case'])
+            == {'clean_frame', 'catboost_classifier.fit'})
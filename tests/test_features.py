@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from helper import clean_frame
+from features import (build_play_tensors, defense_mask, spatial_features,
+                      plays_without_rusher)
+from synthetic import make_raw_frame
+
+
+@pytest.fixture
+def cleaned():
+    df, df_id = clean_frame(make_raw_frame(20, seed=5))
+    return df.reset_index(drop=True), df_id.reset_index(drop=True)
+
+
+def _drop_rusher(df_id, play):
+    df_id = df_id.copy()
+    rows = df_id['PlayId'] == df_id['PlayId'].unique()[play]
+    df_id.loc[rows, 'NflIdRusher'] = -1
+    return df_id
+
+
+def test_play_tensors_drop_plays_without_rusher(cleaned):
+    df, df_id = cleaned
+    broken = _drop_rusher(df_id, 3)
+    missing = df_id['PlayId'].unique()[3]
+    assert plays_without_rusher(broken).tolist() == [missing]
+
+    players, plays, index, rows = build_play_tensors(df, broken)
+
+    assert len(index) == len(players) == 19
+    assert missing not in index['PlayId'].values
+    # rows still point into the full frame, rusher first
+    first = rows[:, 0]
+    assert (broken['PlayId'].values[first] == index['PlayId'].values).all()
+    assert (broken['NflId'].values[first]
+            == broken['NflIdRusher'].values[first]).all()
+    np.testing.assert_array_equal(players[:, 0, 0],
+                                  df['long_axis'].values[first]
+                                  .astype(np.float32))
+
+    with pytest.raises(ValueError, match='no row for their rusher'):
+        build_play_tensors(df, broken, drop_no_rusher=False)
+
+
+def test_spatial_features_without_rusher_are_nan(cleaned):
+    df, df_id = cleaned
+    players, plays, index, rows = build_play_tensors(df, df_id)
+    # the play loses its rusher after the tensors were built
+    broken = _drop_rusher(df_id, 3)
+
+    defense = defense_mask(broken, rows)
+    feats = spatial_features(players, defense)
+
+    assert not defense[3].any()
+    assert defense[np.arange(20) != 3].sum(axis=1).min() == 11
+    assert feats.iloc[3].isna().all()
+    assert feats.drop(index=3)['nearest_def_dist'].notna().all()
+    assert len(feats) == 20
@@ -0,0 +1,95 @@
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+from helper import (CITY_NAMES, DROP_COLS, ID_COLS, POSITION_NAMES,
+                    RAW_DTYPES, STADIUM_TYPES, TURF_TYPES, WEATHER_NAMES,
+                    assign_yard_class, clean_frame, clean_WindDirection,
+                    give_me_WindSpeed, group_weather, new_orientation,
+                    replace_null_cols, strtoseconds)
+from synthetic import make_raw_frame
+
+
+def _row_wise_clean(nfl):
+    # the cleaning cells of nfl_data_clean.ipynb before clean_frame,
+    # with the row-by-row helpers they called
+    nfl = nfl.rename(columns={'X': 'long_axis', 'Y': 'short_axis',
+                              'S': 'speed', 'A': 'accel'})
+    nfl_id = nfl[ID_COLS].copy()
+    nfl = nfl.drop(DROP_COLS, axis=1)
+
+    for col in nfl.columns[nfl.isna().any()]:
+        if nfl[col].dtype == 'O':
+            nfl[col] = nfl[col].fillna(nfl[col].value_counts().index[0])
+        else:
+            nfl[col] = nfl[col].fillna(nfl[col].median())
+
+    nfl['StadiumType'] = nfl['StadiumType'].apply(lambda x: STADIUM_TYPES[x])
+    nfl['Turf'] = nfl['Turf'].apply(lambda x: TURF_TYPES[x])
+    nfl['GameWeather'] = nfl['GameWeather'].apply(
+        lambda x: WEATHER_NAMES[x] if x in WEATHER_NAMES else x)
+    nfl['Position'] = nfl['Position'].apply(
+        lambda x: POSITION_NAMES[x] if x in POSITION_NAMES else x)
+    nfl_id['Location'] = nfl_id['Location'].apply(
+        lambda x: CITY_NAMES[x] if x in CITY_NAMES else x)
+
+    nfl['WindSpeed'] = nfl['WindSpeed'].apply(give_me_WindSpeed)
+    nfl['GameClock'] = nfl['GameClock'].apply(strtoseconds)
+    nfl['WindDirection'] = nfl['WindDirection'].apply(clean_WindDirection)
+
+    nfl['TeamAbbr'] = nfl.apply(lambda row: row['HomeTeamAbbr']
+                                if row['Team'] == 'home'
+                                else row['VisitorTeamAbbr'], axis=1)
+    nfl['OppTeamAbbr'] = nfl.apply(lambda row: row['VisitorTeamAbbr']
+                                   if row['Team'] == 'home'
+                                   else row['HomeTeamAbbr'], axis=1)
+    nfl = nfl.drop(['HomeTeamAbbr', 'VisitorTeamAbbr'], axis=1)
+
+    nfl['PlayerHeight'] = nfl['PlayerHeight'].apply(
+        lambda x: 12 * int(x.split('-')[0]) + int(x.split('-')[1]))
+    nfl['long_axis'] = nfl.apply(lambda row: row['long_axis']
+                                 if row['PlayDirection']
+                                 else 120 - row['long_axis'], axis=1)
+    for col in ['Orientation', 'Dir']:
+        nfl[col] = nfl.apply(lambda row: new_orientation(
+            row[col], row['PlayDirection']), axis=1)
+    for col in ['FieldPosition', 'PossessionTeam']:
+        nfl[col] = nfl.apply(lambda row: 'Home'
+                             if row[col] == row['TeamAbbr']
+                             else 'Away', axis=1)
+    nfl['Yard_class'] = nfl['Yards'].apply(assign_yard_class)
+    nfl['GameWeather'] = nfl['GameWeather'].apply(group_weather)
+    nfl['OffenseFormation'] = nfl['OffenseFormation'].apply(
+        lambda x: 'SINGLEBACK' if x == 'ACE' else x)
+
+    return nfl, nfl_id
+
+
+@pytest.mark.parametrize('seed', [0, 220])
+def test_clean_frame_matches_row_wise_helpers(tmp_path, seed):
+    path = tmp_path / 'train.csv'
+    make_raw_frame(200, seed=seed).to_csv(path, index=False)
+
+    # read as the notebook does; the text columns stay strings even
+    # when a sample happens to hold only numbers (e.g. WindSpeed)
+    df, df_id = clean_frame(pd.read_csv(path, dtype=RAW_DTYPES))
+    expected, expected_id = _row_wise_clean(
+        pd.read_csv(path, dtype=RAW_DTYPES))
+
+    pd.testing.assert_frame_equal(df, expected[df.columns],
+                                  check_dtype=False)
+    assert list(df.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(df_id, expected_id, check_dtype=False)
+
+
+def test_replace_null_cols_downcasts_filled_objects_quietly():
+    df = pd.DataFrame({'Humidity': pd.Series([1.5, None, 3.0],
+                                             dtype=object),
+                       'Turf': ['Grass', None, 'Grass']})
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', FutureWarning)
+        df = replace_null_cols(df, {'Humidity': 2.0, 'Turf': 'Grass'})
+
+    assert df['Humidity'].dtype == np.float64
+    assert df['Humidity'].tolist() == [1.5, 2.0, 3.0]
+    assert df['Turf'].tolist() == ['Grass'] * 3
@@ -0,0 +1,60 @@
+import copy
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.tree import DecisionTreeClassifier
+from importance import _booster_threads, model_fingerprint, shap_values
+from registry import save_model, load_model
+
+
+def test_same_predictions_different_trees():
+    X = pd.DataFrame({'a': [0., 1.] * 50})
+    y = X['a'].astype(int)
+    model = DecisionTreeClassifier(max_depth=1).fit(X, y)
+    moved = copy.deepcopy(model)
+    # the split moves from 0.5 to 0.9: no row of X changes side
+    moved.tree_.threshold[0] = 0.9
+
+    assert (moved.predict_proba(X) == model.predict_proba(X)).all()
+    assert model_fingerprint(moved) != model_fingerprint(model)
+
+
+def test_refit_and_reload_keep_the_fingerprint(tmp_path):
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(200, 3)), columns=list('abc'))
+    y = X['a'] + rng.normal(size=200)
+    forest = RandomForestRegressor(n_estimators=5, random_state=0).fit(X, y)
+    save_model(forest, 'forest', registry_dir=str(tmp_path))
+
+    assert (model_fingerprint(clone(forest).fit(X, y))
+            == model_fingerprint(forest))
+    assert (model_fingerprint(load_model('forest', str(tmp_path)))
+            == model_fingerprint(forest))
+    assert (model_fingerprint(clone(forest).fit(X, y * 2))
+            != model_fingerprint(forest))
+
+
+def test_xgboost_fingerprint_follows_the_booster():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(200, 3))
+    y = X[:, 0] + rng.normal(size=200)
+    model = xgb.XGBRegressor(n_estimators=5).fit(X, y)
+
+    assert (model_fingerprint(clone(model).fit(X, y))
+            == model_fingerprint(model))
+    assert (model_fingerprint(clone(model).fit(X, -y))
+            != model_fingerprint(model))
+
+
+def test_shap_values_leave_the_booster_threads_alone():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(200, 3))
+    booster = xgb.XGBRegressor(n_estimators=5, n_jobs=3).fit(
+        X, X[:, 0]).get_booster()
+    before = _booster_threads(booster)
+
+    values = shap_values(booster, X, n_jobs=1)
+    assert values.shape == (200, 3)
+    assert _booster_threads(booster) == before
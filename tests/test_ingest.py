@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from helper import RAW_DTYPES
+from ingest import compress_counts, ingest_games, load_state, load_store
+from pipeline import (chunk_fill_summary, fill_values_from_summary,
+                      median_from_counts, merge_fill_summaries)
+from synthetic import make_raw_frame
+
+
+@pytest.fixture
+def batches(tmp_path):
+    raw = make_raw_frame(180, seed=5, plays_per_game=45)
+    games = raw['GameId'].unique()
+    paths = []
+    for i, part in enumerate([games[:2], games[2:]]):
+        path = tmp_path / f'week{i}.csv'
+        raw[raw['GameId'].isin(part)].to_csv(path, index=False)
+        paths.append(str(path))
+    return paths
+
+
+def test_second_ingest_fills_as_both_batches(batches, tmp_path):
+    store = str(tmp_path / 'store')
+    first = ingest_games(batches[0], store, chunksize=1000, verbose=False)
+    second = ingest_games(batches[1], store, chunksize=1000, verbose=False)
+
+    frames = [pd.read_csv(path, dtype=RAW_DTYPES) for path in batches]
+    expected = fill_values_from_summary(
+        merge_fill_summaries(*[chunk_fill_summary(df) for df in frames]))
+    manifest, _ = load_state(store)
+    new_parts = manifest['parts'][len(first):]
+    assert len(new_parts) == len(second)
+    for part in new_parts:
+        assert part['fills'].keys() == expected.keys()
+        for col, value in expected.items():
+            assert part['fills'][col] == pytest.approx(value)
+
+    assert manifest['batches'] == 2
+    assert len(manifest['games']) == 4
+    assert len(load_store(store)) == sum(len(df) for df in frames)
+
+
+def test_ingesting_known_games_again_changes_nothing(batches, tmp_path):
+    store = tmp_path / 'store'
+    for path in batches:
+        ingest_games(path, str(store), chunksize=1000, verbose=False)
+    before = {f: f.read_bytes() for f in store.rglob('*') if f.is_file()}
+
+    added = ingest_games(batches[1], str(store), verbose=False)
+
+    assert added.empty
+    after = {f: f.read_bytes() for f in store.rglob('*') if f.is_file()}
+    assert after == before
+
+
+def test_compress_counts_keeps_the_median_within_a_bucket():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=100000).round(4)
+    counts = pd.Series(values).value_counts(sort=False)
+    max_values = 100
+
+    compressed = compress_counts(counts, max_values)
+
+    assert len(compressed) <= max_values
+    assert compressed.sum() == len(values)
+    # a bucket holds about 1/max_values of the values
+    low, high = np.quantile(values, [0.5 - 1 / max_values,
+                                     0.5 + 1 / max_values])
+    assert low <= median_from_counts(compressed) <= high
+    assert median_from_counts(counts) == np.median(values)
+    assert compress_counts(counts, len(counts)) is counts
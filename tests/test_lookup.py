@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from helper import clean_frame
+from lookup import (build_index, find_rows, index_path, load_index,
+                    open_cleaned, save_indexed)
+from synthetic import make_raw_frame
+
+
+@pytest.fixture(scope='module')
+def cleaned():
+    return clean_frame(make_raw_frame(90, seed=7, plays_per_game=30))
+
+
+def test_find_rows_with_missing_and_mixed_keys(cleaned):
+    _, df_id = cleaned
+    index = build_index(df_id)
+    plays = df_id['PlayId'].unique()
+
+    np.testing.assert_array_equal(
+        find_rows(index, 'PlayId', plays[3]),
+        np.flatnonzero(df_id['PlayId'] == plays[3]))
+    # keys in any order, one missing: rows of each found key, in order
+    rows = find_rows(index, 'PlayId', [plays[5], -1, plays[0]])
+    np.testing.assert_array_equal(
+        rows, np.concatenate([np.flatnonzero(df_id['PlayId'] == plays[5]),
+                              np.flatnonzero(df_id['PlayId'] == plays[0])]))
+    assert len(find_rows(index, 'PlayId', [-1, plays.max() + 1])) == 0
+    assert find_rows(index, 'PlayId', []).dtype == np.int64
+
+    name = df_id['DisplayName'].iloc[10]
+    np.testing.assert_array_equal(
+        find_rows(index, 'DisplayName', [name, 'Nobody']),
+        np.flatnonzero(df_id['DisplayName'] == name))
+
+
+def test_saved_index_finds_the_same_rows(cleaned, tmp_path):
+    df, df_id = cleaned
+    path = str(tmp_path / 'cleaned.feather')
+    save_indexed(df, df_id, path)
+    index = build_index(df_id)
+    loaded = load_index(index_path(path))
+
+    for col, arrays in index.items():
+        for built, read in zip(arrays, loaded[col]):
+            assert isinstance(read, np.memmap)
+            np.testing.assert_array_equal(read, built)
+
+
+def test_lookup_joins_ids_to_the_rows_of_a_key(cleaned, tmp_path):
+    df, df_id = cleaned
+    path = str(tmp_path / 'cleaned.feather')
+    save_indexed(df, df_id, path)
+    lookup = open_cleaned(path)
+
+    play = df_id['PlayId'].iloc[100]
+    got = lookup.play(play)
+    mask = (df_id['PlayId'] == play).values
+    pd.testing.assert_frame_equal(
+        got[df.columns], df[mask].reset_index(drop=True), check_dtype=False)
+    assert (got['PlayId'] == play).all()
+
+    name = df_id['DisplayName'].iloc[5]
+    got = lookup.player(name=name, columns=['Yards'],
+                        id_columns=['DisplayName', 'GameId'])
+    mask = (df_id['DisplayName'] == name).values
+    assert list(got.columns) == ['Yards', 'DisplayName', 'GameId']
+    np.testing.assert_array_equal(got['Yards'], df['Yards'][mask])
+    np.testing.assert_array_equal(got['GameId'], df_id['GameId'][mask])
+
+    assert lookup.game(-1).empty
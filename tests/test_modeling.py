@@ -0,0 +1,177 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+import statsmodels.api as sm
+import xgboost as xgb
+import joblib
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeRegressor
+import modeling
+from modeling import (_fit_and_score, halving_search, run_randomized_search,
+                      sparse_ols_summary, sparse_ols_table)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(300, 4)), columns=list('abcd'))
+    y = pd.Series(X['a'] * 2 + rng.normal(size=300))
+    return X, y
+
+
+def test_early_stopping_never_sees_the_scoring_fold(data, monkeypatch):
+    X, y = data
+    train, test = np.arange(240), np.arange(240, 300)
+    seen = {}
+    fit = xgb.XGBRegressor.fit
+
+    def spy(self, X_fit, y_fit, eval_set=None, **params):
+        seen['fit'] = X_fit.index.values
+        seen['eval'] = eval_set[0][0].index.values
+        return fit(self, X_fit, y_fit, eval_set=eval_set, **params)
+
+    monkeypatch.setattr(xgb.XGBRegressor, 'fit', spy)
+    _fit_and_score(xgb.XGBRegressor(n_estimators=20), X, y, train, test,
+                   'r2', {}, early_stopping_rounds=5)
+
+    assert not np.isin(seen['eval'], test).any()
+    assert not np.isin(seen['fit'], test).any()
+    assert not np.isin(seen['fit'], seen['eval']).any()
+    assert len(seen['fit']) + len(seen['eval']) == len(train)
+
+
+def test_halving_search_reuses_trials_only_for_the_same_run(data, tmp_path,
+                                                           monkeypatch):
+    X, y = data
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Models').mkdir()
+    params = {'max_depth': [1, 2, 3, 4]}
+
+    def search(X, y, factor=2):
+        return halving_search(DecisionTreeRegressor(random_state=0), params,
+                              X, y, 'tree', n_candidates=4, factor=factor,
+                              scoring='r2', cv=3, n_cores=1, verbose=0)
+
+    first = search(X, y)
+    trials = (tmp_path / 'Models' / 'tree_trials.jsonl').read_text()
+    n_trials = len(trials.splitlines())
+
+    # same run: every trial is read back, none is refitted
+    again = search(X, y)
+    assert again.cv_results_ == first.cv_results_
+    assert len((tmp_path / 'Models' / 'tree_trials.jsonl').read_text()
+               .splitlines()) == n_trials
+
+    # new data or a new budget: nothing is reused
+    search(X, y * 3 + 1)
+    assert len({json.loads(line)['run'] for line in
+                (tmp_path / 'Models' / 'tree_trials.jsonl').read_text()
+                .splitlines()}) == 2
+    search(X, y, factor=3)
+    assert len({json.loads(line)['run'] for line in
+                (tmp_path / 'Models' / 'tree_trials.jsonl').read_text()
+                .splitlines()}) == 3
+
+
+def _spy_threads(monkeypatch):
+    # folds run in this process, recording the threads of each model
+    seen = {'n_jobs': [], 'threads': []}
+
+    def parallel(n_jobs):
+        seen['n_jobs'].append(n_jobs)
+        return joblib.Parallel(n_jobs=1)
+
+    def fit_and_score(est, *args):
+        seen['threads'].append(est.n_jobs)
+        return _fit_and_score(est, *args)
+
+    monkeypatch.setattr(modeling, 'Parallel', parallel)
+    monkeypatch.setattr(modeling, '_fit_and_score', fit_and_score)
+    return seen
+
+
+def test_halving_search_splits_cores_and_refits_with_all(data, tmp_path,
+                                                         monkeypatch):
+    X, y = data
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'Models').mkdir()
+    seen = _spy_threads(monkeypatch)
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    rs = halving_search(model, {'max_depth': [1, 2]}, X, y > 0, 'forest',
+                        n_candidates=2, factor=2, cv=2, n_cores=8,
+                        verbose=0)
+
+    # 2 folds at a time with 4 threads each, then one refit with 8
+    assert set(seen['n_jobs']) == {2}
+    assert set(seen['threads']) == {4}
+    assert rs.best_estimator_.n_jobs == 8
+    assert model.n_jobs is None
+
+
+def test_randomized_search_refits_with_all_cores(data, tmp_path,
+                                                 monkeypatch):
+    X, y = data
+    monkeypatch.chdir(tmp_path)
+    y = (y > 0).astype(int)
+    rs = run_randomized_search(RandomForestClassifier, 'forest',
+                               {'n_estimators': [3, 4, 5, 6],
+                                'max_depth': [1, 2, 3]},
+                               X[:240], X[240:], y[:240], y[240:],
+                               n_cores=2)
+
+    # the CV fits shared the 2 cores, the refit got both
+    assert rs.estimator.n_jobs == 1
+    assert rs.best_estimator_.n_jobs == 2
+    assert rs.best_estimator_.get_params()['max_depth'] == \
+        rs.best_params_['max_depth']
+    assert rs.score(X[240:], y[240:]) == rs.best_estimator_.score(
+        X[240:], y[240:])
+
+
+def test_sparse_ols_table_matches_statsmodels_on_collinear_design():
+    rng = np.random.default_rng(1)
+    n = 500
+    team = rng.integers(0, 3, n)
+    X = pd.DataFrame({'Season': rng.integers(2017, 2020, n).astype(float),
+                      'S': rng.normal(3, 1, n)})
+    for i in range(3):
+        # every indicator is kept, so they add up to the constant
+        X[f'Team_{i}'] = (team == i).astype(float)
+    y = 0.5 * X['S'] + team + rng.normal(size=n)
+
+    table = sparse_ols_table(sp.csr_matrix(X.values), y, list(X.columns))
+
+    fit = sm.OLS(y, sm.add_constant(X)).fit()
+    expected = pd.DataFrame(fit.summary().tables[1].data)
+    expected.columns = expected.iloc[0]
+    expected = expected.drop(0).set_index(expected.columns[0]).astype(float)
+    pd.testing.assert_frame_equal(table, expected, check_names=False,
+                                  rtol=1e-3)
+
+    model, summary_table = sparse_ols_summary(sp.csr_matrix(X.values), y,
+                                              list(X.columns))
+    pd.testing.assert_frame_equal(summary_table, table)
+    np.testing.assert_allclose(
+        model.values.astype(float),
+        [fit.rsquared, fit.rsquared_adj, fit.fvalue, fit.f_pvalue, fit.llf,
+         fit.aic, fit.bic, fit.nobs, fit.df_resid, fit.df_model],
+        rtol=1e-8)
+
+
+def test_shared_frame_takes_extension_and_category_dtypes():
+    X = pd.DataFrame({'a': pd.array([1, None, 3], dtype='Int64'),
+                      'b': pd.array([0.5, 1.5, None], dtype='Float64'),
+                      'c': [True, False, True]})
+    with modeling.shared_frame(X) as shared:
+        base = shared['a'].values
+        while not isinstance(base, np.memmap) and base.base is not None:
+            base = base.base
+        assert isinstance(base, np.memmap)
+        np.testing.assert_array_equal(
+            shared.values, [[1, 0.5, 1], [np.nan, 1.5, 0], [3, np.nan, 1]])
+
+    X['d'] = pd.Categorical(['x', 'y', 'x'])
+    with modeling.shared_frame(X) as shared:
+        assert shared is X
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from helper import RAW_DTYPES, clean_frame
+from out_of_core import csv_chunks, encoded_chunks, train_xgboost_chunked
+from preprocessing import NFLPreprocessor
+from synthetic import make_raw_frame
+
+
+@pytest.fixture(scope='module')
+def paths(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('data')
+    raw = make_raw_frame(300, seed=11, plays_per_game=30)
+    raw.to_csv(folder / 'train.csv', index=False)
+    clean_frame(pd.read_csv(folder / 'train.csv', dtype=RAW_DTYPES))[0] \
+        .to_csv(folder / 'cleaned.csv', index=False)
+    return {'raw': str(folder / 'train.csv'),
+            'cleaned': str(folder / 'cleaned.csv')}
+
+
+def _fitted_state(prep):
+    return (prep.fills_, prep.columns_,
+            {col: cats.tolist() for col, cats in prep.categories_.items()},
+            prep.medians_, prep.feature_names_)
+
+
+@pytest.mark.parametrize('kind, params', [
+    ('raw', {}), ('raw', {'encoding': 'onehot'}),
+    ('cleaned', {'clean': False})])
+def test_fit_chunks_matches_fit(paths, kind, params):
+    path = paths[kind]
+    df = (pd.read_csv(path, dtype=RAW_DTYPES) if kind == 'raw'
+          else pd.read_csv(path))
+    whole = NFLPreprocessor(**params).fit(df)
+    chunked = NFLPreprocessor(**params).fit_chunks(
+        csv_chunks(path, chunksize=1000, raw=kind == 'raw'))
+
+    assert _fitted_state(chunked) == _fitted_state(whole)
+    pd.testing.assert_frame_equal(chunked.transform(df), whole.transform(df))
+
+
+def test_chunked_xgboost_matches_in_memory_training(paths, tmp_path):
+    make_chunks = csv_chunks(paths['cleaned'], chunksize=1000)
+    prep = NFLPreprocessor(clean=False).fit_chunks(make_chunks)
+    params = {'max_depth': 4, 'eta': 0.3}
+    booster, scores = train_xgboost_chunked(
+        make_chunks, prep, params, num_boost_round=20,
+        cache_dir=str(tmp_path), verbose=False)
+
+    # the same train rows, encoded the same way, in one DMatrix
+    parts = list(encoded_chunks(make_chunks, prep, part='train'))
+    X = pd.concat([X for X, _ in parts])
+    y = np.concatenate([y for _, y in parts])
+    dtrain = xgb.QuantileDMatrix(X, y)
+    expected = xgb.train({'objective': 'reg:squarederror', 'seed': 220,
+                          **params, 'tree_method': 'hist'},
+                         dtrain, num_boost_round=20)
+
+    np.testing.assert_allclose(booster.inplace_predict(X),
+                               expected.inplace_predict(X), rtol=1e-5,
+                               atol=1e-5)
+    test = pd.concat([X for X, _ in encoded_chunks(make_chunks, prep,
+                                                   part='test')])
+    np.testing.assert_allclose(booster.inplace_predict(test),
+                               expected.inplace_predict(test), rtol=1e-5,
+                               atol=1e-5)
+    assert 0 < scores['train']['r2'] <= 1
@@ -0,0 +1,51 @@
+import pandas as pd
+from helper import RAW_DTYPES, clean_frame
+from pipeline import (clean_csv_in_chunks, clean_csv_in_parallel,
+                      game_partitions)
+from synthetic import KAGGLE_PLAYS, make_raw_frame, write_raw_csv
+
+
+def _whole_file_csv(raw_path, out_path, id_path):
+    df, df_id = clean_frame(pd.read_csv(raw_path, dtype=RAW_DTYPES))
+    df.to_csv(out_path, index=False)
+    df_id.to_csv(id_path, index=False)
+
+
+def test_chunked_clean_matches_in_memory_bytes(tmp_path):
+    raw = make_raw_frame(300, seed=3)
+    # integers written without decimals, with nulls in a single play,
+    # so most chunks read the column as int64 and one as float64
+    raw['DefendersInTheBox'] = raw['DefendersInTheBox'].astype('Int64')
+    raw_path = tmp_path / 'raw.csv'
+    raw.to_csv(raw_path, index=False)
+
+    _whole_file_csv(raw_path, tmp_path / 'whole.csv', tmp_path / 'whole_id.csv')
+    n_rows = clean_csv_in_chunks(raw_path, tmp_path / 'chunked.csv',
+                                 tmp_path / 'chunked_id.csv', chunksize=1000)
+
+    assert n_rows == len(raw)
+    assert ((tmp_path / 'chunked.csv').read_bytes()
+            == (tmp_path / 'whole.csv').read_bytes())
+    assert ((tmp_path / 'chunked_id.csv').read_bytes()
+            == (tmp_path / 'whole_id.csv').read_bytes())
+
+
+def test_parallel_clean_of_quoted_csv_matches_in_memory_bytes(tmp_path):
+    raw_path = tmp_path / 'raw.csv'
+    # write_raw_csv quotes the header and the text fields
+    write_raw_csv(str(raw_path), scale=300 / KAGGLE_PLAYS, seed=3,
+                  plays_per_game=20, verbose=False)
+    assert raw_path.read_bytes().startswith(b'"')
+
+    header, parts = game_partitions(str(raw_path), 6)
+    assert len(parts) == 6
+    _whole_file_csv(raw_path, tmp_path / 'whole.csv', tmp_path / 'whole_id.csv')
+    n_rows = clean_csv_in_parallel(str(raw_path), str(tmp_path / 'par.csv'),
+                                   str(tmp_path / 'par_id.csv'), n_cores=2,
+                                   n_parts=6)
+
+    assert n_rows == 300 * 22
+    assert ((tmp_path / 'par.csv').read_bytes()
+            == (tmp_path / 'whole.csv').read_bytes())
+    assert ((tmp_path / 'par_id.csv').read_bytes()
+            == (tmp_path / 'whole_id.csv').read_bytes())
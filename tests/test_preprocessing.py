@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from preprocessing import NFLPreprocessor
+
+
+def _frame():
+    return pd.DataFrame({'Team': ['home', 'away', 'home', None],
+                         'Speed': [1.0, np.nan, 3.0, 5.0]})
+
+
+def test_unknown_value_must_not_be_a_code():
+    with pytest.raises(ValueError, match='unknown_value'):
+        NFLPreprocessor(clean=False, unknown_value=1).fit(_frame())
+
+    prep = NFLPreprocessor(clean=False, unknown_value=2).fit(_frame())
+    new = pd.DataFrame({'Team': ['home', 'mars'], 'Speed': [1.0, 2.0]})
+    assert prep.transform(new)['Team'].tolist() == [1, 2]
+
+
+def test_cleaned_input_nulls_get_the_fit_fills():
+    prep = NFLPreprocessor(clean=False).fit(_frame())
+    assert prep.fills_ == {'Team': 'home', 'Speed': 3.0}
+    assert prep.categories_['Team'].tolist() == ['away', 'home']
+
+    out = prep.transform(pd.DataFrame({'Team': [None, 'away'],
+                                       'Speed': [np.nan, 2.0]}))
+    assert out['Team'].tolist() == [1, 0]
+    assert out['Speed'].tolist() == [3.0, 2.0]
+
+
+@pytest.mark.parametrize('unknown_value', [-1, 3, 4])
+def test_sparse_onehot_matches_dense_for_unseen_categories(unknown_value):
+    df = pd.DataFrame({'Team': ['home', 'away', 'home', 'away'],
+                       'Pos': ['RB', 'QB', 'WR', 'RB'],
+                       'Speed': [1.0, np.nan, 3.0, 5.0]})
+    new = pd.DataFrame({'Team': ['mars', 'home', 'away'],
+                        'Pos': ['QB', 'K', 'WR'],
+                        'Speed': [2.0, 1.0, np.nan]})
+    params = dict(clean=False, encoding='onehot', unknown_value=unknown_value)
+    dense = NFLPreprocessor(**params).fit(df).transform(new)
+    sparse = NFLPreprocessor(sparse=True, **params).fit(df).transform(new)
+
+    assert sparse.shape == dense.shape
+    np.testing.assert_array_equal(sparse.toarray(),
+                                  dense.values.astype(float))
+    # an unseen value sets no indicator at all
+    assert dense.filter(like='Pos_').iloc[1].sum() == 0
+    assert dense.filter(like='Team_').iloc[0].sum() == 0
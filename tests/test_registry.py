@@ -0,0 +1,26 @@
+import os
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from registry import COMPILED_DIR, save_model, load_model
+from inference import load_compiled
+
+
+def test_compiled_model_is_memory_mapped_and_dropped_on_save(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 4))
+    y = X[:, 0] + rng.normal(size=300)
+    model = RandomForestRegressor(n_estimators=5, random_state=0).fit(X, y)
+    registry_dir = str(tmp_path)
+    save_model(model, 'rf', registry_dir=registry_dir)
+
+    compiled = load_compiled('rf', registry_dir)
+    assert isinstance(compiled.feature, np.memmap)
+    assert isinstance(compiled.value, np.memmap)
+    np.testing.assert_allclose(compiled.predict(X),
+                               load_model('rf', registry_dir).predict(X))
+
+    model.set_params(n_estimators=3).fit(X, 2 * y)
+    save_model(model, 'rf', registry_dir=registry_dir)
+    assert not os.path.exists(tmp_path / 'rf' / COMPILED_DIR)
+    np.testing.assert_allclose(load_compiled('rf', registry_dir).predict(X),
+                               model.predict(X))
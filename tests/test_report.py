@@ -0,0 +1,45 @@
+import os
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from helper import clean_frame
+from preprocessing import NFLPreprocessor
+from registry import save_model
+from report import FIGURES, build_report
+from storage import load_cleaned
+from synthetic import make_raw_frame
+from visualizations import YARD_ORDER
+
+
+@pytest.mark.parametrize('with_preprocessor', [True, False])
+def test_conf_mat_from_the_csv_with_a_notebook_model(tmp_path,
+                                                     with_preprocessor):
+    df, _ = clean_frame(make_raw_frame(60, seed=1))
+    df.to_csv(tmp_path / 'cleaned_nfl.csv', index=False)
+    data_path = str(tmp_path / 'cleaned_nfl.feather')
+    registry_dir = str(tmp_path / 'registry')
+    figures = [figure for figure in FIGURES if figure.name == 'conf_mat']
+
+    # the report writes the Arrow copy the classification notebook reads
+    report = build_report(figures, data_path, str(tmp_path / 'Images'),
+                          registry_dir, str(tmp_path / 'manifest.json'),
+                          n_jobs=1, verbose=False)
+    assert os.path.exists(data_path)
+    assert report.loc['conf_mat', 'status'] == 'missing model'
+
+    # rfc_v as the classification notebook fits and registers it
+    nfl = load_cleaned(data_path, exclude=['Yards'], categorical=False)
+    nfl['Season'] = nfl['Season'].astype(int)
+    X = nfl.drop('Yard_class', axis=1)
+    y = nfl['Yard_class'].map({label: i + 1
+                               for i, label in enumerate(YARD_ORDER)})
+    prep_le = NFLPreprocessor(clean=False).fit(X)
+    model = RandomForestClassifier(n_estimators=5, random_state=0)
+    model.fit(prep_le.transform(X), y)
+    save_model(model, 'rfc_v', registry_dir=registry_dir,
+               preprocessor=prep_le if with_preprocessor else None)
+
+    report = build_report(figures, data_path, str(tmp_path / 'Images'),
+                          registry_dir, str(tmp_path / 'manifest.json'),
+                          n_jobs=1, verbose=False)
+    assert report.loc['conf_mat', 'status'] == 'drawn', report['error']
+    assert os.path.exists(tmp_path / 'Images' / 'conf_mat.png')
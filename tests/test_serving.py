@@ -0,0 +1,77 @@
+import json
+import threading
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from preprocessing import NFLPreprocessor
+from registry import save_model
+from serving import MicroBatcher, ScoringService
+from synthetic import make_raw_frame
+
+
+def _submit_together(submit, requests):
+    '''
+    This function submits requests from threads at the same time,
+    so they are predicted in one batch.
+    '''
+    results = [None] * len(requests)
+
+    def send(i):
+        try:
+            results[i] = submit(requests[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=send, args=(i,))
+               for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_batch_error_only_reaches_the_bad_request():
+    batches = []
+
+    def predict(rows):
+        batches.append(len(rows))
+        return np.array([float(row['x']) for row in rows])
+
+    batcher = MicroBatcher(predict, max_wait=0.2)
+    results = _submit_together(batcher.submit, [[{'x': 1}, {'x': 2}],
+                                         [{'x': 'oops'}],
+                                         [{'x': 3}]])
+
+    assert results[0].tolist() == [1.0, 2.0]
+    assert isinstance(results[1], ValueError)
+    assert results[2].tolist() == [3.0]
+    assert batches[0] == 4
+
+
+@pytest.fixture
+def service(tmp_path):
+    raw = make_raw_frame(30, seed=3)
+    prep = NFLPreprocessor().fit(raw)
+    model = RandomForestRegressor(n_estimators=5, random_state=0)
+    model.fit(prep.transform(raw), raw['Yards'])
+    save_model(model, 'rf', preprocessor=prep, registry_dir=str(tmp_path))
+    rows = json.loads(raw.drop(columns='Yards').to_json(orient='records'))
+    return ScoringService('rf', str(tmp_path), max_wait=0.2), rows
+
+
+def test_service_scores_good_plays_next_to_bad_ones(service):
+    service, rows = service
+    good = rows[:22]
+    bad = [dict(row, X='oops') for row in rows[22:44]]
+    missing = [{k: v for k, v in row.items() if k != 'Turf'}
+               for row in rows[44:66]]
+
+    with pytest.raises(ValueError, match='Turf'):
+        service.score(missing)
+    alone = service.score(good)
+    results = _submit_together(service.score, [good, bad])
+
+    assert results[0] == alone
+    assert len(alone['yards']) == 1
+    assert isinstance(results[1], Exception)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+import visualizations
+from visualizations import YARD_ORDER, box_summary, plot_conf_mat
+
+
+def test_box_summary_groups_categorical_like_text():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'Turf': rng.choice(['grass', 'artificial'], 200),
+                       'Yards': rng.normal(4, 6, 200).round()})
+    expected = box_summary(df, ['Turf'])['Turf']
+
+    df['Turf'] = df['Turf'].astype('category')
+    summary = box_summary(df, ['Turf'])['Turf']
+
+    assert [g['label'] for g in summary] == [g['label'] for g in expected]
+    for got, want in zip(summary, expected):
+        assert got['med'] == want['med']
+        np.testing.assert_array_equal(got['fliers'], want['fliers'])
+
+
+
+
+def test_box_summary_skips_unobserved_categories(recwarn):
+    df = pd.DataFrame({'Turf': pd.Categorical(['grass', 'grass', 'mix'] * 20,
+                                              categories=['artificial',
+                                                          'grass', 'mix']),
+                       'Yards': np.arange(60.)})
+    summary = box_summary(df, ['Turf'])['Turf']
+
+    assert [g['label'] for g in summary] == ['grass', 'mix']
+    assert not [w for w in recwarn if w.category is FutureWarning]
+
+
+@pytest.mark.parametrize('labels', [YARD_ORDER, [1, 2, 3, 4, 5]])
+def test_conf_mat_of_numbered_groups(monkeypatch, labels):
+    drawn = []
+    monkeypatch.setattr(visualizations.sns, 'heatmap',
+                        lambda data, **params: drawn.append(data))
+    y_true = np.array([1, 2, 3, 4, 5, 5])
+    y_pred = np.array([1, 2, 3, 4, 4, 5])
+    plot_conf_mat(y_true, y_pred, labels)
+    names = np.array(labels)
+    plot_conf_mat(names[y_true - 1], names[y_pred - 1], labels)
+
+    numbered, named = drawn
+    assert numbered.index[0] == f'Actual {labels[0]}'
+    np.testing.assert_array_equal(numbered.values, named.values)
+    assert numbered.values[4, 3] == 1 / 6
@@ -1,8 +1,180 @@
 import pandas as pd
 import numpy as np
+import os
+import pickle
+import hashlib
 import matplotlib.pyplot as plt
 import seaborn as sns
+from scipy.stats import gaussian_kde
 from sklearn.metrics import confusion_matrix
+from pipeline import frame_fingerprint, code_fingerprint
+
+PLOT_CACHE_DIR = 'Data/plot_cache'
+YARD_ORDER = ['< 0', '0-1', '2-3', '4-6', '> 6']
+
+
+def kde_sample(df, size=10000, strata=None, seed=220):
+    '''
+    This function draws the rows the density curves are estimated on.
+    With strata, every group keeps its share of the rows.
+
+    Parameters
+    ----------
+    df: DataFrame
+    size: int (default=10000), number of rows (all rows if fewer)
+    strata: str (default=None), column to stratify on (e.g. 'Yard_class')
+    seed: int (default=220)
+
+    Returns
+    -------
+    DataFrame
+    '''
+    if len(df) <= size:
+        return df
+    if strata is None:
+        return df.sample(size, random_state=seed)
+    return df.groupby(strata, group_keys=False, observed=True).sample(
+        frac=size / len(df), random_state=seed)
+
+
+def histogram_summary(df, col_list, bins=50, kde_size=10000, strata=None,
+                      seed=220):
+    '''
+    This function computes what plot_distributions draws: a histogram of
+    every column over all rows, and a density curve estimated on a
+    sample of kde_size rows (see kde_sample).
+
+    Parameters
+    ----------
+    df: DataFrame
+    col_list: list, names of numeric columns
+    bins: int (default=50), number of histogram bins
+    kde_size: int (default=10000), rows of the density sample
+              (0 for no density curves)
+    strata: str (default=None), column to stratify the sample on
+    seed: int (default=220)
+
+    Returns
+    -------
+    dict, column name -> {'counts', 'edges', 'n', 'kde': (x, density)}
+    '''
+    sample = kde_sample(df, kde_size, strata, seed) if kde_size else None
+    summary = {}
+    for col in col_list:
+        values = df[col].to_numpy(dtype=float)
+        values = values[~np.isnan(values)]
+        counts, edges = np.histogram(values, bins=bins)
+        summary[col] = {'counts': counts, 'edges': edges, 'n': len(values)}
+        if sample is not None:
+            x = sample[col].dropna().to_numpy(dtype=float)
+            if len(x) > 1 and x.std() > 0:
+                # bandwidth of the full data (Scott's rule), as seaborn
+                # would pick it, and the curve goes 3 bandwidths past it
+                kde = gaussian_kde(x, bw_method=len(values)**-0.2)
+                cut = 3 * np.sqrt(kde.covariance[0, 0])
+                grid = np.linspace(edges[0] - cut, edges[-1] + cut, 200)
+                summary[col]['kde'] = (grid, kde(grid))
+    return summary
+
+
+def box_summary(df, col_list, target='Yards'):
+    '''
+    This function computes the boxplot statistics of target for every
+    group of each column (quartiles, whiskers at 1.5 IQR and the
+    distinct outlying values), as matplotlib's bxp expects them.
+
+    Parameters
+    ----------
+    df: DataFrame
+    col_list: list, names of columns to group by
+    target: str (default='Yards')
+
+    Returns
+    -------
+    dict, column name -> list of dicts, one per group
+    '''
+    summary = {}
+    for col in col_list:
+        data = df[[col, target]].dropna()
+        groups, y = data[col], data[target]
+        if isinstance(groups.dtype, pd.CategoricalDtype):
+            # group on the values: thresholds mapped from categories
+            # would stay categorical and could not be compared
+            groups = groups.astype(groups.cat.categories.dtype)
+        q = (y.groupby(groups, sort=False, observed=True)
+             .quantile([0.25, 0.5, 0.75]).unstack())
+        iqr = q[0.75] - q[0.25]
+        low = groups.map(q[0.25] - 1.5 * iqr)
+        high = groups.map(q[0.75] + 1.5 * iqr)
+        inside = (y >= low) & (y <= high)
+        whislo = y[inside].groupby(groups[inside], observed=True).min()
+        whishi = y[inside].groupby(groups[inside], observed=True).max()
+        # repeated outliers are drawn on top of each other: keep one
+        fliers = (data[~inside].drop_duplicates()
+                  .groupby(col, observed=True)[target].apply(np.sort))
+
+        if pd.api.types.is_numeric_dtype(groups):
+            order = np.sort(q.index.values)
+        else:
+            order = pd.unique(groups)
+        summary[col] = [{'label': str(g), 'q1': q.loc[g, 0.25],
+                         'med': q.loc[g, 0.5], 'q3': q.loc[g, 0.75],
+                         'whislo': whislo.get(g, q.loc[g, 0.25]),
+                         'whishi': whishi.get(g, q.loc[g, 0.75]),
+                         'fliers': fliers.get(g, np.array([]))}
+                        for g in order]
+    return summary
+
+
+def plot_aggregates(df, dist_cols=(), box_cols=(), count_cols=(),
+                    target='Yards', cache_dir=PLOT_CACHE_DIR, bins=50,
+                    kde_size=10000, strata=None, seed=220):
+    '''
+    This function computes the aggregates of the EDA plots once and
+    caches them on disk, keyed on the data, the code and the settings,
+    so drawing the plots again does not go back over the rows.
+
+    Parameters
+    ----------
+    df: DataFrame
+    dist_cols: list (default=()), columns for plot_distributions
+    box_cols: list (default=()), columns for plot_boxplots
+    count_cols: list (default=()), columns for plot_group_count
+    target: str (default='Yards'), target of the boxplots
+    cache_dir: str (default=PLOT_CACHE_DIR), None to skip the cache
+    bins, kde_size, strata, seed: passed to histogram_summary
+
+    Returns
+    -------
+    dict with 'hist' (histogram_summary), 'box' (box_summary)
+    and 'counts' (column name -> value counts)
+    '''
+    params = {'dist_cols': list(dist_cols), 'box_cols': list(box_cols),
+              'count_cols': list(count_cols), 'target': target,
+              'bins': bins, 'kde_size': kde_size, 'strata': strata,
+              'seed': seed}
+    if cache_dir:
+        cols = list(dict.fromkeys(
+            list(dist_cols) + list(box_cols) + list(count_cols)
+            + ([target] if box_cols else []) + ([strata] if strata else [])))
+        digest = hashlib.sha256(frame_fingerprint(df[cols]).encode())
+        digest.update(code_fingerprint(plot_aggregates).encode())
+        digest.update(repr(sorted(params.items())).encode())
+        path = os.path.join(cache_dir, digest.hexdigest() + '.pkl')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+    aggregates = {'hist': histogram_summary(df, dist_cols, bins, kde_size,
+                                            strata, seed),
+                  'box': box_summary(df, box_cols, target),
+                  'counts': {col: df[col].value_counts()
+                             for col in count_cols}}
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, 'wb') as f:
+            pickle.dump(aggregates, f)
+    return aggregates
 
 
 def two_subplots(df, col1, col2, size, num_type=1,
@@ -28,76 +200,170 @@ def two_subplots(df, col1, col2, size, num_type=1,
     '''
     fig, axes = plt.subplots(1, 2, figsize=size)
     plt.subplots_adjust(wspace=0.4)
-    sns.countplot(df[col2], order=order, ax=axes[1])
+    _draw_counts(axes[1], df[col2], order)
     if num_type == 2:
-        sns.distplot(df[col1], ax=axes[0])
+        _draw_histogram(axes[0], histogram_summary(df, [col1])[col1])
+        axes[0].set_xlabel(col1)
+        axes[0].set_ylabel('Density')
     else:
-        sns.countplot(df[col1], order=order, ax=axes[0])
+        _draw_counts(axes[0], df[col1], order)
     axes[0].set_title(f'Distribution of {col1}')
     axes[1].set_title(f'Distribution of {col2}')
     if rotate:
         plt.setp(axes[1].get_xticklabels(), rotation=90);
 
-def plot_distributions(df, col_list):
+def _draw_counts(ax, column, order=None):
+    '''
+    This function draws the bars of a countplot from the value counts,
+    in the same order (sorted numbers, otherwise order of appearance).
+    '''
+    counts = column.value_counts()
+    if order is None:
+        if pd.api.types.is_numeric_dtype(column):
+            order = np.sort(counts.index.values)
+        else:
+            order = pd.unique(column.dropna())
+    sns.barplot(x=[str(v) for v in order],
+                y=counts.reindex(order, fill_value=0).values, ax=ax)
+    ax.set_xlabel(column.name)
+    ax.set_ylabel('count')
+
+
+def _draw_histogram(ax, hist):
+    '''
+    This function draws a histogram_summary entry:
+    density bars and the density curve.
+    '''
+    widths = np.diff(hist['edges'])
+    ax.bar(hist['edges'][:-1], hist['counts'] / (hist['n'] * widths),
+           width=widths, align='edge', alpha=0.4)
+    if 'kde' in hist:
+        ax.plot(*hist['kde'])
+
+
+def plot_target_distribution(df, target='Yards', aggregates=None):
+    '''
+    This function plots the distribution of the target.
+
+    Parameters
+    ----------
+    df: DataFrame (can be None when aggregates are given)
+    target: str (default='Yards')
+    aggregates: dict (default=None), histogram_summary of the target;
+                computed from df if None
+
+    Returns
+    -------
+    Histogram with density curve of the target
+    '''
+    if aggregates is None:
+        aggregates = histogram_summary(df, [target])
+    ax = plt.gca()
+    _draw_histogram(ax, aggregates[target])
+    ax.set_xlabel(target)
+    ax.set_ylabel('Density')
+    sns.despine(left=False, bottom=False)
+    plt.title(f'Distribution of {target} \n')
+
+
+def plot_distributions(df, col_list, aggregates=None):
     '''
     This function plots distributions of all columns in the specified list.
 
     Parameters
     ----------
-    df: DataFrame
+    df: DataFrame (can be None when aggregates are given)
     col_list: list, names of columns to plot
+    aggregates: dict (default=None), histogram_summary of the columns
+                (e.g. plot_aggregates(df, dist_cols=col_list)['hist']);
+                computed from df if None
 
     Returns
     -------
-    Distplots of all of the columns in the specified list
+    Histograms with density curves of all of the columns in the list
     '''
+    if aggregates is None:
+        aggregates = histogram_summary(df, col_list)
     fig, axes = plt.subplots(6, 3, figsize=(16, 20))
     plt.subplots_adjust(wspace=0.3, hspace=0.5)
     for i, feat in enumerate(col_list):
-        sns.distplot(df[feat], ax=axes[i//3, i % 3])
-        axes[i//3, i % 3].set_title(f'Distribution of {feat}');
+        ax = axes[i//3, i % 3]
+        _draw_histogram(ax, aggregates[feat])
+        ax.set_xlabel(feat)
+        ax.set_ylabel('Density')
+        ax.set_title(f'Distribution of {feat}');
 
 
-def plot_boxplots(df, col_list):
+def plot_boxplots(df, col_list, aggregates=None, target='Yards'):
     '''
     This function plots distributions of all columns in the specified list.
 
     Parameters
     ----------
-    df: DataFrame
+    df: DataFrame (can be None when aggregates are given)
     col_list: list, names of columns to plot
+    aggregates: dict (default=None), box_summary of the columns
+                (e.g. plot_aggregates(df, box_cols=col_list)['box']);
+                computed from df if None
+    target: str (default='Yards')
 
     Returns
     -------
     Boxplots of all of the columns in the specified list
     '''
+    if aggregates is None:
+        aggregates = box_summary(df, col_list, target)
     fig, axes = plt.subplots(2, 3, figsize=(15, 10))
     plt.subplots_adjust(wspace=0.3, hspace=0.3)
     for i, col in enumerate(col_list):
-        sns.boxplot(df[col], df['Yards'], ax=axes[i//3, i % 3])
-        axes[i//3, i % 3].set_title(f'Distribution of Yards for each {col}');
-
-
-def plot_group_count(df, column):
-    yard_order = ['< 0', '0-1', '2-3', '4-6', '> 6']
-    yard_counts = {}
-    for i in yard_order:
-        yard_counts[i] = dict(df[column].value_counts(sort=False))[i]
-    sns.countplot(df[column],
-                  order=yard_order)
-    for i, v in enumerate(yard_counts.values()):
+        ax = axes[i//3, i % 3]
+        ax.bxp(aggregates[col], patch_artist=True)
+        ax.set_xlabel(col)
+        ax.set_ylabel(target)
+        ax.set_title(f'Distribution of {target} for each {col}');
+
+
+def plot_group_count(df, column, counts=None, path='Images/Yard_groups'):
+    '''
+    This function plots the number of rows of each yard group.
+
+    Parameters
+    ----------
+    df: DataFrame (can be None when counts are given)
+    column: str, name of the yard group column
+    counts: Series (default=None), value counts of the column
+            (e.g. plot_aggregates(df, count_cols=[column])['counts'][column]);
+            computed from df if None
+    path: str (default='Images/Yard_groups'), where the graph is saved;
+          None to not save it
+
+    Returns
+    -------
+    Bar graph of the yard groups
+    '''
+    if counts is None:
+        counts = df[column].value_counts()
+    # groups already encoded as numbers are shown in sorted order
+    order = (YARD_ORDER if counts.index.isin(YARD_ORDER).any()
+             else sorted(counts.index))
+    yard_counts = counts.reindex(order, fill_value=0)
+    sns.barplot(x=[str(i) for i in order], y=yard_counts.values)
+    plt.xlabel(column)
+    plt.ylabel('count')
+    for i, v in enumerate(yard_counts.values):
         plt.text(i - 0.27, v + 2000,
                  str(v),
                  color='black',
                  fontsize=10)
     plt.title('Distribution of Yard Groups \n')
     sns.despine(left=False, bottom=False)
-    plt.savefig('Images/Yard_groups',
-                bbox_inches='tight',
-                transparent=True);
+    if path:
+        plt.savefig(path,
+                    bbox_inches='tight',
+                    transparent=True);
 
 
-def plot_reg_feat_imp(model, df, top10=None):
+def plot_reg_feat_imp(model, df, top10=None, importances=None):
     '''
     This function plots a horizontal bar graph,
     displaying the importance of features for specified model.
@@ -105,64 +371,68 @@ def plot_reg_feat_imp(model, df, top10=None):
     Parameters
     ----------
     model: model to plot
-    df: DataFrame
+    df: DataFrame the model was trained on, or list of its feature names
     top10: boolean (default=False), True if plotting Top 10 features
+    importances: DataFrame (default=None), importances from importance.py
+                 (e.g. importance.feature_importances(model, X_test, y_test));
+                 the model's feature_importances_ if None
 
     Returns
     -------
     Horizontal bar graph showing the importance of features.
     '''
-
-    feat_imp = pd.DataFrame([df.columns.values,
-                             model.feature_importances_]
-                           ).T
-    feat_imp.columns = ['features', 'importance']
+    if importances is None:
+        features = np.asarray(getattr(df, 'columns', df))
+        feat_imp = pd.DataFrame({'features': features,
+                                 'importance': model.feature_importances_})
+    else:
+        feat_imp = importances.rename_axis('features').reset_index()
     feat_imp.sort_values(by='importance', inplace=True)
     if top10:
+        feat_imp = feat_imp[-10:]
         plt.figure(figsize=(10, 7))
-        plt.barh(feat_imp['features'][-10:],
-                 feat_imp['importance'][-10:],
-                 align='center')
-        plt.yticks(np.arange(len(feat_imp['features'][-10:])),
-                   feat_imp['features'][-10:])
         plt.title('Top 10 important features in predicting yards')
-
     else:
         plt.figure(figsize=(10, 10))
-        plt.barh(feat_imp['features'],
-                 feat_imp['importance'],
-                 align='center')
-        plt.yticks(np.arange(len(feat_imp['features'])),
-                   feat_imp['features'])
         plt.title('Feature importance in predicting yards')
+    # permutation importances come with their spread over the repeats
+    plt.barh(feat_imp['features'],
+             feat_imp['importance'],
+             xerr=feat_imp.get('std'),
+             align='center')
+    plt.yticks(np.arange(len(feat_imp['features'])),
+               feat_imp['features'])
 
     plt.xlabel('Feature importance')
     plt.ylabel('Feature');
 
 
-def plot_feat_imp(model, df):
+def plot_feat_imp(model, df, importances=None):
     '''
     This function plots a horizontal bar graph,
-    displaying the importance of features for specified model.
+    displaying the importance of features for specified model:
+    the coefficients of linear models (with their signs),
+    the feature importances of the others.
 
     Parameters
     ----------
-    model: model to plot
-    df: DataFrame
+    model: fitted search object (e.g. RandomizedSearchCV) or model
+    df: DataFrame the model was trained on, or list of its feature names
+    importances: DataFrame (default=None), importances from importance.py
+                 to plot instead of the model's own
 
     Returns
     -------
     Horizontal bar graph showing the importance of features.
     '''
+    estimator = getattr(model, 'best_estimator_', model)
+    features = np.asarray(getattr(df, 'columns', df))
     plt.figure(figsize=(8, 8))
-    if (model == svm) | (model == log):
-        feat_imp = pd.DataFrame([df.columns.values,
-                                 model.best_estimator_.coef_[0],
-                                 np.abs(model.best_estimator_.coef_[0])],
-                                columns=['features',
-                                         'coefficients',
-                                         'absolute_coefs']
-                               )
+    if importances is None and hasattr(estimator, 'coef_'):
+        coefs = np.atleast_2d(estimator.coef_)[0]
+        feat_imp = pd.DataFrame({'features': features,
+                                 'coefficients': coefs,
+                                 'absolute_coefs': np.abs(coefs)})
         feat_imp.sort_values(by='absolute_coefs', inplace=True)
         plt.barh(feat_imp['features'],
                  feat_imp['absolute_coefs'],
@@ -170,13 +440,13 @@ def plot_feat_imp(model, df):
         plt.yticks(np.arange(len(feat_imp['features'])),
                    feat_imp['features'])
         sns.despine(left=False, bottom=False)
-        coefs = df['coefficients'].apply(lambda x: round(x, 2))
+        coefs = feat_imp['coefficients'].apply(lambda x: round(x, 2))
         for i, coef in enumerate(coefs):
             plt.text(np.abs(coef) + 0.007, i - 0.1,
                      str(np.abs(coef)),
                      color='black',
                      fontsize=18)
-            if v > 0:
+            if coef > 0:
                 plt.text(coef - 0.01, i - 0.1, '+',
                          color='black',
                          fontsize=12,
@@ -188,17 +458,62 @@ def plot_feat_imp(model, df):
                          fontweight='bold')
 
     else:
-        feat_imp = pd.DataFrame([df.columns.values,
-                                 model.best_estimator_.feature_importances_],
-                               ).T
-        feat_imp.columns=['features', 'importance']
+        if importances is None:
+            feat_imp = pd.DataFrame({
+                'features': features,
+                'importance': estimator.feature_importances_})
+        else:
+            feat_imp = importances.rename_axis('features').reset_index()
         feat_imp.sort_values(by='importance', inplace=True)
         plt.barh(feat_imp['features'],
-                     feat_imp['importance'],
-                     align='center')
+                 feat_imp['importance'],
+                 xerr=feat_imp.get('std'),
+                 align='center')
         plt.yticks(np.arange(len(feat_imp['features'])),
-                       feat_imp['features'])
+                   feat_imp['features'])
 
     plt.title('Feature importance in predicting yards')
     plt.xlabel('Feature importance')
     plt.ylabel('Feature');
+
+
+def _group_names(y, labels):
+    '''
+    This function turns codes 1 to len(labels) into the names in labels,
+    leaving groups already named as in labels as they are.
+    '''
+    y = np.asarray(y)
+    if (pd.api.types.is_numeric_dtype(y)
+            and not pd.Series(y).isin(labels).all()):
+        return np.array(labels)[y.astype(int) - 1]
+    return y
+
+
+def plot_conf_mat(y_true, y_pred, labels=YARD_ORDER):
+    '''
+    This function plots the confusion matrix of a classifier
+    as shares of all predictions.
+    Numeric groups that are not in labels are taken as the
+    notebook's codes, 1 to len(labels) in the order of labels.
+
+    Parameters
+    ----------
+    y_true: array, actual yard groups (names or codes)
+    y_pred: array, predicted yard groups (names or codes)
+    labels: list (default=YARD_ORDER), order of the groups
+
+    Returns
+    -------
+    Heatmap of the confusion matrix
+    '''
+    y_true = _group_names(y_true, labels)
+    y_pred = _group_names(y_pred, labels)
+    matrix = confusion_matrix(y_true, y_pred, labels=labels)
+    matrix = matrix / matrix.astype(float).sum()
+    conf_mat = pd.DataFrame(matrix,
+                            index=[f'Actual {l}' for l in labels],
+                            columns=[f'Predicted {l}' for l in labels])
+
+    sns.heatmap(conf_mat, cmap='PuBu', annot=True,
+                cbar=False, fmt='.2%')
+    plt.xticks(rotation=30);